@@ -2,6 +2,7 @@ import logging
 from agents import Agent, function_tool
 from app.services.openai_client import get_openai_client
 from app.core.config import settings
+from app.utils.deadline import bounded, budget
 
 # Configurar logger para este módulo
 logger = logging.getLogger(__name__)
@@ -15,11 +16,14 @@ async def search_faq(query: str) -> str:
     """
     logger.info(f"Searching FAQs for query: {query}")
     try:
-        results = await client.vector_search(
-            query=query,
-            vector_store_id=settings.openai_vs_faq_id,
-            max_num_results=3
-        )
+        # Solo lo que queda del deadline del request (con tope propio)
+        async with bounded("faq_search", settings.faq_search_timeout_s):
+            results = await client.vector_search(
+                query=query,
+                vector_store_id=settings.openai_vs_faq_id,
+                max_num_results=3,
+                timeout=budget(settings.faq_search_timeout_s),
+            )
         if not results:
             return "No se encontraron respuestas relevantes en las FAQs."
 
@@ -27,6 +31,9 @@ async def search_faq(query: str) -> str:
         snippets = [hit.content[0].text.strip() for hit in results]
         return "\n\n".join(snippets)
 
+    except TimeoutError:
+        logger.warning("FAQ search agotó su tiempo; respuesta de respaldo")
+        return "En este momento no pude consultar las preguntas frecuentes. Por favor, inténtalo de nuevo en unos minutos."
     except Exception as e:
         logger.error(f"Error during FAQ search: {e}")
         return "Ocurrió un error al buscar en las FAQs."
@@ -42,4 +49,7 @@ Devuelve **exactamente** el texto recuperado (sin resumir ni parafrasear)
 y, si desconoces, responde que no tienes información al respecto y no inventes información.
 """,
     tools=[search_faq],
+    # El texto de search_faq ya es la respuesta: se termina con el primer resultado
+    # de la herramienta, sin otra llamada al modelo solo para repetirlo.
+    tool_use_behavior="stop_on_first_tool",
 )
@@ -1,14 +1,15 @@
 # app/agents/inquirer_agent.py
 
 import json
-from agents import Agent, function_tool
+from typing import Any, Dict, List
+from agents import Agent, FunctionToolResult, RunContextWrapper, ToolsToFinalOutputResult, function_tool
 from app.utils.escalamiento_detector import detectar_escalamiento, es_caso_no_escalable, obtener_mensaje_escalamiento
 from app.utils.fecha_detector        import detectar_fecha_en_texto, extraer_fecha_aproximada
 
-@function_tool
-async def classify_justification_case(query: str) -> str:
+def classify_case(query: str) -> Dict[str, Any]:
     """
-    Retorna un JSON con:
+    Clasificación determinística (Python puro, sin LLM) de un caso de
+    justificación de faltas. Retorna un dict con:
       - case: uno de [enfermedad, calamidad, deportiva, viaje_trabajo, clases_virtuales, desconocido, pregunta_informativa]
       - required_doc: documento que debe presentar (o null si no es justificable)
       - follow_up: lista con UNA SOLA pregunta para avanzar el diálogo
@@ -35,33 +36,33 @@ async def classify_justification_case(query: str) -> str:
     ]
     
     if any(info in q for info in palabras_informativas):
-        return json.dumps({
+        return {
             "case": "pregunta_informativa",
             "required_doc": None,
             "follow_up": [],
             "note": "USAR_FAQ",
             "fecha_detectada": False
-        })
+        }
 
     # 1) Escalamiento incondicional
     if detectar_escalamiento(q):
-        return json.dumps({
+        return {
             "case": "escalamiento_inmediato",
             "required_doc": None,
             "follow_up": [],
             "note": obtener_mensaje_escalamiento(),
             "fecha_detectada": tiene_fecha
-        })
+        }
 
     # 2) Muerte de mascota (solo empático)
     if any(p in q for p in ["mascota", "perro", "gato"]) and "falle" in q:
-        return json.dumps({
+        return {
             "case": "calamidad_mascota",
             "required_doc": None,
             "follow_up": [],
             "note": "Lo siento mucho por tu mascota. Esta situación no está contemplada como justificación de inasistencia.",
             "fecha_detectada": tiene_fecha
-        })
+        }
 
     # 3) Mapeo general
     mapping = [
@@ -83,47 +84,47 @@ async def classify_justification_case(query: str) -> str:
             if case == "enfermedad":
                 # enfermedades catastróficas
                 if any(sev in q for sev in ["cáncer", "leucemia", "tumor"]):
-                    return json.dumps({
+                    return {
                         "case": "enfermedad_catastrica",
                         "required_doc": None,
                         "follow_up": [],
                         "note": "--mentor--",
                         "fecha_detectada": tiene_fecha
-                    })
+                    }
 
                 # Si el usuario CONFIRMA que tiene el certificado (no solo lo menciona)
                 # Excluir preguntas informativas como "qué debe tener mi certificado"
                 confirmaciones_certificado = ["si tengo", "sí tengo", "lo tengo", "ya tengo", "tengo el certificado", "tengo mi certificado"]
                 if any(kw in q for kw in confirmaciones_certificado):
-                    return json.dumps({
+                    return {
                         "case": case,
                         "required_doc": "Certificado médico",
                         "follow_up": [
                           "<p>Perfecto. Por favor, sube aquí en el chat el certificado médico como archivo adjunto (imagen o PDF).</p>"
                         ],
                         "fecha_detectada": tiene_fecha
-                    })
+                    }
 
                 # Caso normal de enfermedad: siempre pedir que suba el certificado al chat
                 pregunta = "<p>Para procesar tu justificación, por favor sube tu certificado médico aquí en el chat como archivo adjunto (imagen o PDF).</p>"
 
-                return json.dumps({
+                return {
                     "case": case,
                     "required_doc": "Certificado médico",
                     "follow_up": [pregunta],
                     "fecha_detectada": tiene_fecha,
                     "fecha_extraida": fecha_extraida
-                })
+                }
 
             # ——————————— CALAMIDAD DOMÉSTICA ———————————
             if case == "calamidad":
-                return json.dumps({
+                return {
                     "case": case,
                     "required_doc": "Acta de defunción y copia de cédula del estudiante",
                     "follow_up": [],
                     "note": "--mentor--",
                     "fecha_detectada": tiene_fecha
-                })
+                }
 
             # ——————————— DEPORTE ———————————
             if case == "deportiva":
@@ -132,23 +133,23 @@ async def classify_justification_case(query: str) -> str:
                 else:
                     pregunta = "¿Tienes el certificado oficial de participación? Si lo tienes, súbelo aquí en el chat."
 
-                return json.dumps({
+                return {
                     "case": case,
                     "required_doc": "Certificado oficial de participación deportiva",
                     "follow_up": [pregunta],
                     "fecha_detectada": tiene_fecha,
                     "fecha_extraida": fecha_extraida
-                })
+                }
 
             # ——————————— VIAJE DE TRABAJO ———————————
             if case == "viaje_trabajo":
-                return json.dumps({
+                return {
                     "case": case,
                     "required_doc": None,
                     "follow_up": [],
                     "note": "Lo siento, las inasistencias por viaje de trabajo no son justificables.",
                     "fecha_detectada": tiene_fecha
-                })
+                }
 
             # ——————————— CLASES VIRTUALES ———————————
             if case == "clases_virtuales":
@@ -157,23 +158,47 @@ async def classify_justification_case(query: str) -> str:
                 else:
                     pregunta = "¿Puedes enviarme el reporte médico o justificativo por este medio?"
 
-                return json.dumps({
+                return {
                     "case": case,
                     "required_doc": "Reporte médico o justificación por escrito",
                     "follow_up": [pregunta],
                     "fecha_detectada": tiene_fecha,
                     "fecha_extraida": fecha_extraida
-                })
+                }
 
     # ——————————— CASO DESCONOCIDO ———————————
-    return json.dumps({
+    return {
         "case": "desconocido",
         "required_doc": None,
         "follow_up": [],
         "note": "",
         "fecha_detectada": tiene_fecha,
         "fecha_extraida": fecha_extraida
-    })
+    }
+
+
+@function_tool
+async def classify_justification_case(query: str) -> str:
+    """
+    Retorna en JSON la clasificación de `classify_case`:
+      - case, required_doc, follow_up (una sola pregunta), note, fecha_detectada / fecha_extraida
+    """
+    return json.dumps(classify_case(query))
+
+
+def _verbatim_classification(
+    context: RunContextWrapper[Any], results: List[FunctionToolResult]
+) -> ToolsToFinalOutputResult:
+    """
+    Termina con el primer resultado de la herramienta, aplicando en Python la
+    misma regla que antes hacía el modelo: si `note` es "--mentor--", solo `--mentor--`.
+    """
+    output = results[0].output
+    try:
+        note = json.loads(output).get("note")
+    except (TypeError, ValueError, AttributeError):
+        note = None
+    return ToolsToFinalOutputResult(is_final_output=True, final_output="--mentor--" if note == "--mentor--" else output)
 
 
 inquirer_agent = Agent(
@@ -185,4 +210,5 @@ y devuelve únicamente el JSON que ésta retorne.
 - `follow_up` siempre tendrá **una sola pregunta** para continuar el diálogo.
 """,
     tools=[classify_justification_case],
+    tool_use_behavior=_verbatim_classification,
 )
@@ -1,45 +1,136 @@
+import asyncio
 import logging
-from agents import Agent, Runner, ModelSettings
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from agents import Agent, Runner, ModelSettings, RunHooks, TResponseInputItem
+from openai.types.responses import ResponseTextDeltaEvent
 from fastapi.responses import JSONResponse
 
 from app.agents.faq_agent import faq_agent, search_faq
 from app.agents.operator_agent import operator_agent
-from app.agents.inquirer_agent import inquirer_agent, classify_justification_case
+from app.agents.inquirer_agent import inquirer_agent
 from app.utils.tools      import get_current_date  
+from app.utils.intent_detector import ESTADO, FAQ, GENERAL, JUSTIFICACION
+from app.utils.context_window import estimate_tokens
+from app.utils.deadline import bounded, budget, deadline_stats
+from app.utils import stage_timer
 
 logger = logging.getLogger(__name__)
 
-manager_agent = Agent(
-    name="ManagerAgent",
-    model_settings=ModelSettings(temperature=0.2),  #temperatura
-    instructions="""
+
+# Uso de tokens de la última ejecución del Manager en el contexto actual (para `meta`)
+last_run_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("last_run_usage", default=None)
+# La última ejecución en streaming agotó el deadline después de entregar texto (respuesta parcial)
+last_run_truncated: ContextVar[bool] = ContextVar("last_run_truncated", default=False)
+
+
+class RunStats:
+    """
+    Llamadas al modelo por ejecución del Manager (incluye handoffs), por agente
+    final, y tokens de entrada servidos desde la caché de prompts del proveedor.
+    """
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.model_turns = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self._by_agent: Dict[str, Dict[str, int]] = {}
+        self._by_intent: Dict[str, Dict[str, int]] = {}
+
+    def record(self, result: Any, intent: str = "general") -> Dict[str, int]:
+        turns = len(result.raw_responses)
+        # Las instrucciones del Manager van en cada llamada suya; tras un handoff
+        # solo cuenta la llamada que lo decidió
+        manager_calls = turns if result.last_agent.name == manager_agent.name else 1
+        by_intent = self._by_intent.setdefault(intent, {"runs": 0, "tokens_saved": 0})
+        by_intent["runs"] += 1
+        by_intent["tokens_saved"] += INSTRUCTION_REPORT[intent]["saved_tokens"] * manager_calls
+
+        agent = self._by_agent.setdefault(result.last_agent.name, {"runs": 0, "model_turns": 0})
+        agent["runs"] += 1
+        agent["model_turns"] += turns
+        self.runs += 1
+        self.model_turns += turns
+
+        usage = result.context_wrapper.usage
+        cached = usage.input_tokens_details.cached_tokens or 0
+        self.input_tokens += usage.input_tokens
+        self.cached_tokens += cached
+        summary = {
+            "requests": usage.requests,
+            "input_tokens": usage.input_tokens,
+            "cached_tokens": cached,
+            "output_tokens": usage.output_tokens,
+        }
+        last_run_usage.set(summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        def per_run(d: Dict[str, int]) -> float:
+            return round(d["model_turns"] / d["runs"], 2) if d["runs"] else 0.0
+
+        return {
+            "runs": self.runs,
+            "turns_per_run": per_run({"runs": self.runs, "model_turns": self.model_turns}),
+            "by_agent": {name: {**d, "turns_per_run": per_run(d)} for name, d in self._by_agent.items()},
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": round(self.cached_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+            "by_intent": {
+                intent: {**report, **self._by_intent.get(intent, {"runs": 0, "tokens_saved": 0})}
+                for intent, report in INSTRUCTION_REPORT.items()
+            },
+        }
+
+
+# Instancia compartida del proceso
+run_stats = RunStats()
+
+# ============================================================
+# Instrucciones del Manager por secciones
+# ============================================================
+_SECCION_IDENTIDAD = """
 REGLA 1: Todo los mensajes que generes deben ser en HTML, unicamente usa <p> y </p>, y en lugar de \n debes usar <br> para saltos de línea. No abras el simbolo de interrogacion para las preguntas solo usa el de cierre ?, de esta manera para verte más humano en tus respuestas.
 Eres un mentor, si {mentor_gender} es M o F (Masculino o Femenino) dependiendo esto conjuga y habla apropiadamente al genero, eres un mentor/a de la UDLA (Universidad de las Américas) que busca ayudar en las inquietudes del estudiante, tienes una vision integral, siempre tratas a tus estudiantes atentamente, actua como humana y no robotizada, escribe mensajes breves pero cálidos, se empática y
 menciona solo en el primer mensaje el apodo del estudiante, en adelante solo mensajes sin mencionar su apodo/nombre.
 Solo saluda con el nombre del estudiante en el primer mensaje e identifica con la variable {gender} si es M o F (Masculino o Femenino) y dependiendo esto conjuga y habla apropiadamente al genero, evita usar "generalmente", "usualmente" ya que no es un lenguaje humano y pones en duda la respuesta.
 
 
-REGLA OperatorAgent (consulta de estado):
+"""
+
+_SECCION_ESTADO = """REGLA OperatorAgent (consulta de estado):
 - Llama al OperatorAgent SOLO cuando el estudiante pregunte por el ESTADO o RESULTADO de una justificación de inasistencia.
 - SÍ activa: "estado de mi justificación", "cómo va mi justificación", "ya aprobaron mi caso", "qué pasó con mi justificación", "revisaron mi solicitud", o cualquier otra variante que pregunte por el estado o resultado de una justificación ya enviada.
 - NO activa: saludos, preguntas casuales, cómo hacer una justificación, contactos, materias, cualquier otra cosa.
 
-Regla Justificación de faltas:
-- Siempre llama a `classify_justification_case` para saber:
+"""
+
+_SECCION_JUSTIFICACION = """Regla Justificación de faltas:
+- El caso ya viene clasificado en el chat, en la línea "ClasificacionCaso:" (JSON), con:
   • `case`  
   • `required_doc`  
   • `follow_up` (una pregunta)  
   • `note` (opcional)  
+- No hay que llamar a ninguna herramienta para clasificar; si no viene esa línea, el mensaje no es un caso de justificación reconocido.
 - **IMPORTANTE**: Si `note` es "USAR_FAQ", entonces usa `search_faq` con la pregunta original del estudiante para obtener la respuesta correcta de la base de conocimiento.
 - Muestra primero una frase amable y empática según el `case`.
 - Luego muestra EXACTAMENTE el texto que viene en `follow_up`, sin modificarlo ni agregar información adicional.
 - NO inventes pasos, ubicaciones, oficinas ni procesos que no estén en el `follow_up`.
 
-REGLA Preguntas Frecuentes y Generales FAQs:
+"""
+
+_SECCION_FAQ = """REGLA Preguntas Frecuentes y Generales FAQs:
 - Para preguntas generales de procesos, procedimientos o FAQs usa `search_faq`.
 
-Tus datos de usuario llegan en el chat con esta línea:
+"""
+
+_SECCION_CONVERSACION = """La conversación llega como mensajes: primero tus datos de usuario, después los mensajes previos del estudiante y tuyos, y al final el mensaje nuevo del estudiante.
+Tus datos de usuario llegan con esta línea:
 DatosUsuario: nombre={fullName}, apodo={nickname}, cédula={idCard}, carrera={career}, correo={email}, genero={gender}.
+Justo antes del mensaje nuevo llega "EstadoSesion:" y, si aplica, "ClasificacionCaso:". EstadoSesion ya resume la conversación, úsalo en lugar de deducirlo del historial: `fase` (inicio, caso_abierto, certificado_pedido, certificado_recibido, ocr_notificado, cerrado, escalado), `interaccion` (cuántas veces vas a haber respondido), `caso`, `documento` (el que ya subió; no se lo vuelvas a pedir) e `insistencia` (veces seguidas que repite lo mismo).
+Si el chat trae una línea "ResumenPrevio:", es el resumen de los mensajes anteriores de la conversación; tómalo en cuenta igual que el historial (caso en curso, documentos, insistencias, escalamientos).
 
 
 Actúa exclusivamente como el(la) mentor(a). Responde siempre siguiendo estrictamente las siguientes reglas de estilo:
@@ -49,7 +140,7 @@ Usa puntos y comas correctamente; los signos de interrogación y exclamación so
 No uses negritas, mayúsculas totales, cursivas ni emojis. Si debes detallar pasos, utiliza listas simples con guiones o viñetas, pero solo cuando sea indispensable.
 Todas las respuestas deben ser naturales, humanas y adaptadas al contexto del estudiante, nunca robotizadas ni impersonales.
 - Evita usar "entiendo / te entiendo" más de una vez cada tres mensajes.
-- Si desconoces de una pregunta muy puntual que no esten en los agentes de FAQs o Inquirer (`search_faq`, `classify_justification_case`), solo responde --mentor--
+- Si desconoces de una pregunta muy puntual que no esten en los agentes de FAQs o Inquirer (`search_faq` o la línea `ClasificacionCaso:`), solo responde --mentor--
 - Si la consulta de inasistencia es persistente, mencionar que debe tener en cuenta que si supera el 20% de inasistencia de manera general en su semestre perderá la beca; si supera el 20% en una materia pierde el derecho al examen de recuperación.
 
 
@@ -85,19 +176,170 @@ REGLA CRÍTICA - Mensajes de agradecimiento y cierre:
 - NO vuelvas a pedir que suba el certificado si ya lo subió y fue procesado.
 
 
-""",
-    tools=[search_faq,classify_justification_case, get_current_date],
+"""
+
+# Bloque común a todas las intenciones. Va primero y siempre idéntico: el proveedor
+# cachea el prefijo del prompt, así que los turnos de cualquier intención comparten
+# esa caché y solo las reglas específicas (al final) cambian entre variantes.
+_BLOQUE_COMUN = _SECCION_IDENTIDAD + _SECCION_CONVERSACION
+
+# Secciones propias de cada intención (ver app.utils.intent_detector), después del bloque común.
+# "general" lleva todas.
+INTENT_SECTIONS: Dict[str, Tuple[str, ...]] = {
+    GENERAL: (_SECCION_ESTADO, _SECCION_JUSTIFICACION, _SECCION_FAQ),
+    ESTADO: (_SECCION_ESTADO,),
+    JUSTIFICACION: (_SECCION_JUSTIFICACION, _SECCION_FAQ),
+    FAQ: (_SECCION_FAQ,),
+}
+INTENT_INSTRUCTIONS: Dict[str, str] = {
+    intent: _BLOQUE_COMUN + "".join(sections) for intent, sections in INTENT_SECTIONS.items()
+}
+
+
+manager_agent = Agent(
+    name="ManagerAgent",
+    model_settings=ModelSettings(temperature=0.2),  #temperatura
+    instructions=INTENT_INSTRUCTIONS[GENERAL],
+    tools=[search_faq, get_current_date],
     handoffs=[faq_agent, operator_agent, inquirer_agent]
 )
 
 
-async def run_manager(prompt: str) -> str:
+# Variantes precompiladas por intención: misma configuración, instrucciones recortadas
+MANAGER_VARIANTS: Dict[str, Agent] = {
+    intent: manager_agent if intent == GENERAL else manager_agent.clone(instructions=text)
+    for intent, text in INTENT_INSTRUCTIONS.items()
+}
+
+
+def manager_for(intent: str) -> Agent:
+    return MANAGER_VARIANTS.get(intent, manager_agent)
+
+
+def _instruction_report() -> Dict[str, Dict[str, int]]:
+    """Tokens (estimados) de instrucciones por intención y cuántos ahorra cada llamada frente a "general"."""
+    full = estimate_tokens(INTENT_INSTRUCTIONS[GENERAL])
+    return {
+        intent: {"instruction_tokens": estimate_tokens(text), "saved_tokens": full - estimate_tokens(text)}
+        for intent, text in INTENT_INSTRUCTIONS.items()
+    }
+
+
+INSTRUCTION_REPORT = _instruction_report()
+
+
+# Entrada del Manager: un prompt de texto o la lista de mensajes de la conversación
+ManagerInput = Union[str, List[TResponseInputItem]]
+
+
+class StageHooks(RunHooks):
+    """
+    Tiempos por agente y por herramienta de una corrida (Server-Timing):
+    `agent.<Nombre>` va desde que el agente toma el turno hasta su handoff o
+    respuesta final (incluye sus herramientas); `tool.<nombre>` es cada herramienta.
+    """
+
+    def __init__(self) -> None:
+        self._started: Dict[str, float] = {}
+
+    def _open(self, key: str) -> None:
+        self._started[key] = time.perf_counter()
+
+    def _close(self, key: str) -> None:
+        t0 = self._started.pop(key, None)
+        if t0 is not None:
+            stage_timer.record(key, time.perf_counter() - t0)
+
+    async def on_agent_start(self, context, agent) -> None:
+        self._open(f"agent.{agent.name}")
+
+    async def on_handoff(self, context, from_agent, to_agent) -> None:
+        self._close(f"agent.{from_agent.name}")
+
+    async def on_agent_end(self, context, agent, output) -> None:
+        self._close(f"agent.{agent.name}")
+
+    async def on_tool_start(self, context, agent, tool) -> None:
+        self._open(f"tool.{tool.name}")
+
+    async def on_tool_end(self, context, agent, tool, result) -> None:
+        self._close(f"tool.{tool.name}")
+
+
+def _stage_hooks() -> Optional[StageHooks]:
+    """Hooks de tiempos solo si el request se está midiendo (SERVER_TIMING)."""
+    return StageHooks() if stage_timer.current() is not None else None
+
+
+# Respuesta de respaldo cuando el turno agota su deadline (app.utils.deadline)
+TIMEOUT_REPLY = "<p>Estoy tardando más de lo normal en responder. Por favor, escríbeme de nuevo en unos minutos.</p>"
+
+
+async def run_manager(prompt: ManagerInput, intent: str = GENERAL) -> str:
     logger.info(f"[ManagerAgent] Prompt recibido: {prompt!r}")
+    last_run_usage.set(None)
+    last_run_truncated.set(False)
     try:
         # Runner.run() NO acepta temperature directamente
         # La temperatura se configura a nivel del modelo en Azure OpenAI
-        result = await Runner.run(manager_agent, prompt)
+        async with bounded("manager"):
+            result = await Runner.run(manager_for(intent), prompt, hooks=_stage_hooks())
+        run_stats.record(result, intent)
         return result.final_output
+    except TimeoutError:
+        logger.warning("[ManagerAgent] Deadline agotado; respuesta de respaldo")
+        return TIMEOUT_REPLY
     except Exception as e:
         logger.error(f"[ManagerAgent] Error: {e}", exc_info=True)
         return "Lo siento, desconozco del tema."
+
+
+async def stream_manager(prompt: ManagerInput, intent: str = GENERAL) -> AsyncIterator[str]:
+    """
+    Igual que run_manager pero con Runner.run_streamed: va entregando los
+    fragmentos de texto a medida que el modelo los genera. Los agentes que terminan
+    con el resultado de su herramienta (FAQ, Operator, Inquirer) no generan deltas:
+    en ese caso, al final se entrega `final_output` completo.
+    """
+    logger.info(f"[ManagerAgent] Prompt recibido (stream): {prompt!r}")
+    last_run_usage.set(None)
+    last_run_truncated.set(False)
+    emitted = False
+    answered = False  # hubo texto del agente que tiene el turno (desde el último handoff)
+    result = None
+    try:
+        result = Runner.run_streamed(manager_for(intent), prompt, hooks=_stage_hooks())
+        events = result.stream_events()
+        while True:
+            # Cada evento espera solo lo que queda del deadline del request
+            try:
+                event = await asyncio.wait_for(anext(events), budget())
+            except StopAsyncIteration:
+                break
+            if event.type == "agent_updated_stream_event":
+                answered = False
+            elif event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                if event.data.delta:
+                    emitted = answered = True
+                    yield event.data.delta
+        if not answered and result.final_output:
+            emitted = True
+            yield str(result.final_output)
+        run_stats.record(result, intent)
+    except TimeoutError:
+        deadline_stats.record("manager")
+        if emitted:
+            # Lo ya entregado queda como respuesta (parcial); el turno lo indica en `meta`
+            logger.warning("[ManagerAgent] Deadline agotado (stream); respuesta parcial")
+            last_run_truncated.set(True)
+        else:
+            logger.warning("[ManagerAgent] Deadline agotado (stream); respuesta de respaldo")
+            yield TIMEOUT_REPLY
+    except Exception as e:
+        logger.error(f"[ManagerAgent] Error (stream): {e}", exc_info=True)
+        if not emitted:
+            yield "Lo siento, desconozco del tema."
+    finally:
+        # La corrida sigue en tareas de fondo del SDK: se detiene si se abandona el stream
+        if result is not None and not result.is_complete:
+            result.cancel()
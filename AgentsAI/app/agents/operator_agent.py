@@ -1,12 +1,14 @@
 # app/agents/operator_agent.py
 from agents import Agent, function_tool
-import logging, os, time, json, requests, urllib3
+import asyncio, logging, os, time, json, requests, urllib3
 from requests import Session
 from requests.exceptions import (
     HTTPError, SSLError, ReadTimeout, ConnectTimeout, RequestException
 )
 from datetime import datetime
 
+from app.utils.deadline import bounded, budget
+
 # (opcional) .env
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -35,7 +37,7 @@ BANNER_EMAIL_KEY = (os.getenv("BANNER_EMAIL_KEY", "institutionalEmail") or "inst
 # Endpoint oficial
 BANNER_JUST_PATH = os.getenv("BANNER_JUST_PATH", "/api/GetStudentJustification")
 
-# Timeout en segundos
+# Timeout en segundos (tope; cada consulta usa lo que quede del deadline del request)
 BANNER_TIMEOUT_S = int(os.getenv("BANNER_TIMEOUT_S", "60"))
 
 # =========================
@@ -57,7 +59,7 @@ def _get_session() -> Session:
 # =========================
 #  Helpers HTTP
 # =========================
-def _get_banner_token() -> str:
+def _get_banner_token(timeout: float = BANNER_TIMEOUT_S) -> str:
     """Obtiene/cachea el token. Prueba /token y /Token por compatibilidad."""
     now = time.time()
     if _token_cache["access_token"] and now < _token_cache["expires_at"]:
@@ -77,7 +79,7 @@ def _get_banner_token() -> str:
     last_exc: Exception | None = None
     for url in urls:
         try:
-            resp = s.post(url, data=data, headers=headers, timeout=BANNER_TIMEOUT_S, verify=not INSECURE)
+            resp = s.post(url, data=data, headers=headers, timeout=timeout, verify=not INSECURE)
             resp.raise_for_status()
             payload = resp.json()
             access = payload.get("access_token") or payload.get("accessToken") or payload.get("token")
@@ -93,13 +95,13 @@ def _get_banner_token() -> str:
         except (ReadTimeout, ConnectTimeout, SSLError, RequestException) as e:
             last_exc = e
             logger.warning("[banner-token] fallo %s en %s (timeout=%ss, insecure=%s)",
-                           type(e).__name__, url, BANNER_TIMEOUT_S, INSECURE)
+                           type(e).__name__, url, timeout, INSECURE)
 
     raise last_exc or RuntimeError("No se pudo obtener token")
 
-def _banner_post_json(path: str, body: dict) -> dict:
+def _banner_post_json(path: str, body: dict, timeout: float = BANNER_TIMEOUT_S) -> dict:
     """POST JSON con Bearer; refresca token si 401."""
-    token = _get_banner_token()
+    token = _get_banner_token(timeout)
     url = f"{BANNER_API_BASE.rstrip('/')}/{path.lstrip('/')}"
     s = _get_session()
     headers = {
@@ -110,12 +112,12 @@ def _banner_post_json(path: str, body: dict) -> dict:
 
     def _do():
         return s.post(url, headers=headers, data=json.dumps(body),
-                      timeout=BANNER_TIMEOUT_S, verify=not INSECURE)
+                      timeout=timeout, verify=not INSECURE)
 
     resp = _do()
     if resp.status_code == 401:
         _token_cache["access_token"] = None
-        headers["Authorization"] = f"Bearer {_get_banner_token()}"
+        headers["Authorization"] = f"Bearer {_get_banner_token(timeout)}"
         resp = _do()
 
     try:
@@ -225,7 +227,7 @@ def _format_justification_html(api_response: dict, who: str) -> str:
 #  Tool expuesto
 # =========================
 @function_tool
-def case_status_udla(institutional_email: str) -> str:
+async def case_status_udla(institutional_email: str) -> str:
     """
     Consulta el estado de justificativos en UDLA Banner.
     Body enviado (por defecto): { "institutionalEmail": "<email>" }
@@ -237,8 +239,15 @@ def case_status_udla(institutional_email: str) -> str:
 
     try:
         payload = {BANNER_EMAIL_KEY: email}
-        resp = _banner_post_json(BANNER_JUST_PATH, payload)
+        # requests es síncrono: en un hilo, con el tiempo que quede del deadline del request
+        async with bounded("banner", BANNER_TIMEOUT_S):
+            resp = await asyncio.to_thread(
+                _banner_post_json, BANNER_JUST_PATH, payload, budget(BANNER_TIMEOUT_S)
+            )
         return _format_justification_html(resp, email)
+    except TimeoutError:
+        logger.warning("[case_status_udla] Banner no respondió dentro del deadline")
+        return "<p>No pude consultar tu caso en este momento.</p>"
     except Exception:
         logger.exception("[case_status_udla] Error consultando Banner")
         # Mensaje neutro, sin inventar datos
@@ -256,4 +265,6 @@ Devuelve únicamente el HTML del tool (usa solo <p>).
 Si no te dan el correo, tómalo de la línea 'DatosUsuario: ... correo=...'.
 """,
     tools=[case_status_udla],
+    # El HTML de case_status_udla se devuelve tal cual (sin otra llamada al modelo)
+    tool_use_behavior="stop_on_first_tool",
 )
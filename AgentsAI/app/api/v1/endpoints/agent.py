@@ -1,31 +1,57 @@
 # app/api/v1/endpoints/agent.py
 
-from fastapi import APIRouter, Depends, HTTPException, Body
-from typing import Any, Dict, Callable, Awaitable
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, Callable, Awaitable, AsyncIterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
 from datetime import datetime, timezone
-import re
+import asyncio
+import json
 import html
 
-from app.utils.dep_agents    import get_manager
+from app.utils.dep_agents    import get_manager, get_manager_stream
+from app.agents.manager_agent import TIMEOUT_REPLY, ManagerInput, last_run_truncated, last_run_usage
 from app.utils.response      import success_response
-from app.utils.session_store import (
-    get_history,
-    append_message,
-    clear_session,
-    get_uploaded_docs,
-    get_ocr_result,
-    add_uploaded_doc,
+from app.utils.session_store import session_batch, view_session
+from app.utils.conversation_state import (
+    CERRADO,
+    CERTIFICADO_PEDIDO,
+    CERTIFICADO_RECIBIDO,
+    EV_CIERRE,
+    EV_OCR_NOTIFICADO,
+    OCR_NOTIFICADO,
+    ConversationState,
+    state_of,
 )
+from app.utils.html_sanitizer import StreamingHtmlSanitizer, sanitize_html
+from app.utils.session_gate import session_gate
+from app.utils.session_events import OCR as OCR_EVENT, session_events
+from app.utils.burst_coalescer import burst_coalescer
+from app.utils.idempotency import fingerprint, idempotency_store, owner_of
+from app.utils.cancellation import cancel_on_disconnect, cancellations
+from app.utils.deadline import request_deadline
+from app.utils.stage_timer import stage
+from app.utils.transcript_cache import transcript_cache
+from app.utils.context_window import context_window
 from app.utils.escalamiento_detector import detectar_escalamiento, obtener_mensaje_escalamiento
+from app.utils.intent_detector import GENERAL, JUSTIFICACION, detectar_intencion
+from app.agents.inquirer_agent import classify_case
 from app.core.security import User
-from app.core.security import get_token_payload
-from app.schemas.agent import AgentRequest, AgentResponse
+from app.core.security import get_token_payload, verify_token
+from app.core.config import settings
+from app.schemas.agent import AgentProfile, AgentRequest, AgentResponse
+from app.schemas.response import APIResponse
 
 
 router = APIRouter(
     dependencies=[Depends(get_token_payload)]
 )
 
+def _es_comando(texto: str) -> bool:
+    """Comandos de control (p. ej. --reiniciar--): nunca se unen con otros mensajes."""
+    t = texto.strip()
+    return t.startswith("--") and t.endswith("--")
+
+
 # ---------------- Detectar cierre de conversación ----------------
 def _es_mensaje_cierre(texto: str) -> bool:
     """
@@ -112,76 +138,490 @@ def _generar_respuesta_cierre(nickname: str, mentor_gender: str) -> str:
     return random.choice(respuestas)
 # ------------------------------------------------
 
-# ---------------- HTML sanitizer ----------------
-def _sanitize_html(text: str) -> str:
+# ---------------- Pre-ruteo determinístico ----------------
+# Casos cuya respuesta queda fija con la clasificación: se responden sin LLM.
+_DIRECT_CASES = {"escalamiento_inmediato", "calamidad_mascota", "viaje_trabajo", "enfermedad"}
+
+
+def _respuesta_directa(case: Dict[str, Any], state: ConversationState) -> Optional[Tuple[str, str]]:
     """
-    Sanitiza la salida del LLM permitiendo tags seguros: <p>, </p>, <br>, <a>.
-    Previene ataques XSS pero permite HTML que el LLM genera intencionalmente.
-    
-    Si el LLM devuelve HTML válido (con <p>, <a>, etc.), lo respeta.
-    Si devuelve texto plano, lo convierte a HTML simple.
+    (respuesta_html, mensaje) si la clasificación y el estado de la conversación
+    determinan la respuesta, o None si el Manager debe redactarla. Aplica las
+    mismas reglas que sus instrucciones:
+    - a la tercera vez seguida que el estudiante insiste en lo mismo → --mentor--.
+    - enfermedad: frase empática + el `follow_up` tal cual, salvo que el
+      certificado ya esté pedido o subido (no se le vuelve a pedir igual: el
+      Manager responde a lo que el estudiante agrega).
+    - viaje de trabajo: no justificable, sugerir que hable con sus docentes.
     """
-    if text is None:
-        return "<p></p>"
+    if state.insisting:
+        return "<p>--mentor--</p>", obtener_mensaje_escalamiento()
+    kind = case["case"]
+    if kind not in _DIRECT_CASES:
+        return None
+    if kind == "escalamiento_inmediato":
+        return "<p>--mentor--</p>", case["note"]
+    if kind == "enfermedad":
+        if state.certificate or state.phase == CERTIFICADO_PEDIDO:
+            return None
+        reply = "<p>Espero que te mejores pronto.</p>" + case["follow_up"][0]
+    elif kind == "viaje_trabajo":
+        reply = f"<p>{case['note']} Te sugiero que al menos lo converses con tus docentes.</p>"
+    else:
+        reply = f"<p>{case['note']}</p>"
+    return reply, f"Respuesta determinística ({kind})"
+# ------------------------------------------------
 
-    t = str(text).strip()
 
-    # Si el modelo devuelve solo el handoff
-    if t == "--mentor--":
-        return "<p>--mentor--</p>"
+class _Turn(NamedTuple):
+    """
+    Resultado de un turno: `data` y `message` para success_response (+ uso de tokens
+    del Manager). `timed_out`: el Manager agotó el deadline y el turno no se guardó;
+    `truncated`: lo agotó a mitad de la respuesta y se guardó la parte ya entregada.
+    """
+    data: Dict[str, Any]
+    message: str
+    usage: Optional[Dict[str, int]] = None
+    timed_out: bool = False
+    truncated: bool = False
 
-    # Elimina fences de markdown si los hubiera
-    t = re.sub(r"```(?:html)?", "", t).replace("```", "").strip()
-    
-    # Arreglar tags malformados como "<pTexto" → "<p>Texto"
-    t = re.sub(r"<p([^>])", r"<p>\1", t)
-    
-    # Detectar si ya tiene tags HTML válidos
-    has_html = bool(re.search(r"<[a-zA-Z][^>]*>", t))
-    
-    if has_html:
-        # El LLM generó HTML intencionalmente, lo dejamos pasar
-        # Solo sanitizamos scripts y eventos peligrosos
-        t = re.sub(r'<script[^>]*>.*?</script>', '', t, flags=re.IGNORECASE | re.DOTALL)
-        t = re.sub(r'\son\w+\s*=\s*["\'][^"\']*["\']', '', t, flags=re.IGNORECASE)
-        
-        # Si ya hay estructura <p>, retornar como está
-        if "<p>" in t:
-            return t
-    
-    # Si NO hay HTML, es texto plano: convertir a párrafos
-    t = t.replace("\r\n", "\n")
-    
-    # Párrafos por doble salto de línea
-    paras = [seg.strip() for seg in re.split(r"\n{2,}", t) if seg.strip()]
-    if not paras:
-        return "<p></p>"
-
-    parts = []
-    for seg in paras:
-        # Convertir saltos simples en <br>
-        seg_html = seg.replace("\n", "<br>")
-        parts.append(f"<p>{seg_html}</p>")
-    
-    return "".join(parts)
+
+def _turn_status(turn: _Turn) -> Tuple[bool, int]:
+    """(success, code) del turno: deadline agotado → 504, así no queda como respuesta idempotente."""
+    return (False, 504) if turn.timed_out else (True, 200)
+
+
+def _turn_meta(gated, turn: _Turn) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {"session": {"queue_depth": gated.queue_depth, "coalesced": gated.coalesced}}
+    if turn.usage is not None:
+        meta["usage"] = turn.usage
+    if turn.truncated:
+        meta["deadline"] = {"exceeded": True, "partial": True}
+    return meta
+
+
+# ---------------- Entrada del Manager ----------------
+def _manager_input(
+    profile: str,
+    summary: str,
+    turns: Sequence[Mapping[str, str]],
+    turn_meta: str,
+    prompt: str,
+) -> List[Dict[str, str]]:
+    """
+    Conversación como lista de mensajes en un orden estable entre turnos:
+    perfil → ResumenPrevio (si aplica) → turnos previos → metadatos del turno
+    (EstadoSesion, ClasificacionCaso) → mensaje nuevo.
+    Todo lo que cambia en cada turno va al final, así el prefijo (instrucciones,
+    perfil e historial) se repite byte a byte y el proveedor puede reutilizar su
+    caché de prompts.
+    """
+    items = [{"role": "system", "content": profile}]
+    if summary:
+        items.append({"role": "system", "content": context_window.summary_line(summary).rstrip("\n")})
+    items.extend(
+        {"role": m["role"], "content": m["content"]}
+        for m in turns
+        if m["role"] in ("user", "assistant")   # los marcadores "system" del historial no se envían
+    )
+    items.append({"role": "system", "content": turn_meta})
+    items.append({"role": "user", "content": prompt})
+    return items
 # ------------------------------------------------
 
 
 @router.post("/agent/", response_model=AgentResponse, summary="Interactúa con el Manager")
 async def agent_endpoint(
+    http_request: Request,
     request: AgentRequest = Body(...),
-    run: Callable[[str], Awaitable[str]] = Depends(get_manager),
+    run: Callable[..., Awaitable[str]] = Depends(get_manager),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    token: Dict[str, Any] = Depends(get_token_payload),
 ) -> Dict[str, Any]:
     """
     Maneja el endpoint /agent/.
     - Si el usuario envía --reiniciar-- se limpia el contexto de esa sesión.
     - Revisa si el mensaje necesita ESCALAMIENTO inmediato (palabras críticas).
     - Si no hay escalamiento, intenta un FAST-PATH una sola vez: si existe un OCR recién subido,
-      responde con ese estado y marca 'ocr_notified' para evitar bucles.
+      responde con ese estado y pasa la conversación a `ocr_notificado` para evitar bucles.
+    - El estado de la conversación (fase, interacción, caso, documento, insistencias) se guarda
+      en la sesión y se actualiza en cada turno; el Manager lo recibe en la línea `EstadoSesion:`.
+    - Clasifica el caso de justificación en el servidor: los casos con respuesta fija
+      (escalamiento, mascota, viaje de trabajo, enfermedad) se responden sin LLM; en el
+      resto la clasificación va en el prompt como `ClasificacionCaso:`.
+    - Los requests de una misma sesión se atienden de a uno; un prompt idéntico que llega
+      mientras el primero sigue en vuelo (doble clic, reintento) reutiliza su respuesta.
+    - Con AGENT_DEBOUNCE_MS > 0, los mensajes de una sesión que llegan dentro de esa ventana
+      se unen en una sola corrida y todos reciben la misma respuesta (`meta.burst.merged`).
+    - Con header `Idempotency-Key`, un reintento con la misma clave recibe la respuesta ya
+      generada (o espera la que está en curso) sin volver a agregar el prompt ni llamar al LLM.
+      La clave vale solo para el mismo usuario (sujeto del token) y sesión.
+    - Si el cliente se desconecta antes de la respuesta, la corrida del Manager se cancela
+      y el turno no se guarda (ni el prompt ni la respuesta).
+    - El turno completo tiene un deadline (AGENT_DEADLINE_S) que se reparte entre el Manager
+      y sus herramientas; si se agota, se responde 504 con un texto de respaldo y el turno no
+      se guarda (un reintento con la misma Idempotency-Key vuelve a ejecutarse).
+    - Con SERVER_TIMING, los tiempos por etapa (auth, cola de la sesión, escalamiento,
+      Manager, cada agente y herramienta…) van en el header `Server-Timing`.
     
     **SEGURIDAD**: Datos sensibles (nombre, cédula, correo) se reciben en el body 
     para evitar exposición en URLs y logs del servidor.
     """
+    with request_deadline(settings.agent_deadline_s):
+        if idempotency_key:
+            work = idempotency_store.run(
+                "agent",
+                owner_of(token, request.session_id),
+                idempotency_key,
+                fingerprint(request.session_id, request.prompt),
+                lambda: _agent_response(request, run),
+            )
+        else:
+            work = _agent_response(request, run)
+        return await cancel_on_disconnect(http_request, work, endpoint="agent")
+
+
+async def _agent_response(
+    request: AgentRequest,
+    run: Callable[..., Awaitable[str]],
+) -> JSONResponse:
+    def gated_turn(prompt: str):
+        turn_request = request if prompt == request.prompt else request.model_copy(update={"prompt": prompt})
+        return session_gate.run(request.session_id, prompt, lambda: _agent_turn(turn_request, run))
+
+    try:
+        if burst_coalescer.enabled and not _es_comando(request.prompt):
+            burst = await burst_coalescer.submit(request.session_id, request.prompt, gated_turn)
+            gated, merged = burst.value, burst.merged
+        else:
+            gated, merged = await gated_turn(request.prompt), 1
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=str(error))
+
+    turn = gated.value
+    meta = _turn_meta(gated, turn)
+    if merged > 1:
+        meta["burst"] = {"merged": merged}
+    ok, code = _turn_status(turn)
+    return success_response(
+        success=ok,
+        code=code,
+        data=turn.data,
+        message=turn.message,
+        meta=meta,
+    )
+
+
+# ---------------- Streaming (SSE) ----------------
+def _sse(event: str, payload: Dict[str, Any]) -> str:
+    """Un evento Server-Sent Events con payload JSON."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _session_state(session_id: str) -> Dict[str, Any]:
+    """Resumen del estado ya confirmado de la sesión (tras el commit del turno)."""
+    snap = await view_session(session_id)
+    return {
+        "messages": len(snap.messages),
+        "uploaded_docs": sorted(snap.docs),
+        "ocr": snap.ocr is not None,
+        "conversation": state_of(snap).to_dict(),
+    }
+
+
+def _start_streamed_turn(
+    request: AgentRequest,
+    stream: Callable[..., AsyncIterator[str]],
+    on_delta: Callable[[str], None],
+) -> "asyncio.Task":
+    """
+    Lanza el turno en una tarea aparte (bajo el lock de la sesión y con su propio
+    deadline) y entrega a `on_delta` el HTML ya saneado a medida que el Manager responde.
+    """
+    async def run(manager_input: ManagerInput, intent: str = GENERAL) -> str:
+        sanitizer = StreamingHtmlSanitizer()
+        parts = []
+        async for delta in stream(manager_input, intent=intent):
+            parts.append(delta)
+            chunk = sanitizer.feed(delta)
+            if chunk:
+                on_delta(chunk)
+        tail = sanitizer.close()
+        if tail:
+            on_delta(tail)
+        return "".join(parts)
+
+    # La tarea hereda el deadline del contexto en que se crea
+    with request_deadline(settings.agent_deadline_s):
+        return asyncio.create_task(
+            session_gate.run(request.session_id, request.prompt, lambda: _agent_turn(request, run))
+        )
+
+
+async def _final_payload(gated, session_id: str) -> Dict[str, Any]:
+    """Respuesta completa de un turno en streaming (mismo formato que /agent/) + `meta.state`."""
+    turn = gated.value
+    ok, code = _turn_status(turn)
+    return APIResponse(
+        success=ok,
+        code=code,
+        message=turn.message,
+        data=turn.data,
+        meta={**_turn_meta(gated, turn), "state": await _session_state(session_id)},
+    ).model_dump()
+
+
+@router.post("/agent/stream/", summary="Interactúa con el Manager (streaming SSE)")
+async def agent_stream_endpoint(
+    request: AgentRequest = Body(...),
+    stream: Callable[..., AsyncIterator[str]] = Depends(get_manager_stream),
+) -> StreamingResponse:
+    """
+    Variante en streaming de /agent/ (text/event-stream). Mismo body y mismas reglas.
+    Eventos:
+    - `start`: se envía de inmediato.
+    - `delta`: fragmentos de HTML ya saneado a medida que el Manager responde.
+    - `final`: respuesta completa (mismo formato que /agent/) con `meta.state`,
+      el estado de la sesión ya confirmado. Es la versión autoritativa del mensaje.
+      Si el deadline se agota a mitad de la respuesta, queda lo ya enviado y el `final`
+      lo indica en `meta.deadline`.
+    - `error`: si el turno falla.
+    Si el cliente cierra el stream antes del `final`, el turno se cancela y no se guarda.
+    Los caminos sin LLM (reinicio, escalamiento, OCR, cierre) y los prompts
+    duplicados coalescidos solo emiten `start` y `final`.
+    """
+    deltas: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    turn_task = _start_streamed_turn(request, stream, deltas.put_nowait)
+    turn_task.add_done_callback(lambda _: deltas.put_nowait(None))
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            yield _sse("start", {"session_id": request.session_id})
+            while (chunk := await deltas.get()) is not None:
+                yield _sse("delta", {"html": chunk})
+        finally:
+            # Cliente desconectado a mitad del stream: se corta la corrida
+            if not turn_task.done():
+                turn_task.cancel()
+                cancellations.record("agent_stream")
+        try:
+            gated = turn_task.result()
+        except Exception as error:
+            yield _sse("error", {"code": 500, "detail": str(error)})
+            return
+        yield _sse("final", await _final_payload(gated, request.session_id))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+# ------------------------------------------------
+
+
+# ---------------- Canal WebSocket ----------------
+# Router aparte: el token llega en el primer mensaje del socket, no en el header
+ws_router = APIRouter()
+
+_WS_POLICY_VIOLATION = 1008
+
+
+class _WsClose(NamedTuple):
+    """Marca en la cola de salida: el sender cierra el socket después de los mensajes previos."""
+    code: int
+
+
+def _ws_error(code: int, detail: Any, message_id: Any = None) -> Dict[str, Any]:
+    return {"type": "error", "id": message_id, "code": code, "detail": detail}
+
+
+def _ws_error_of(error: Exception, message_id: Any = None) -> Dict[str, Any]:
+    if isinstance(error, HTTPException):
+        return _ws_error(error.status_code, error.detail, message_id)
+    return _ws_error(400, str(error), message_id)
+
+
+async def _ws_auth(
+    message: Mapping[str, Any],
+    profile: Optional[AgentProfile],
+) -> Tuple[str, AgentProfile]:
+    """Valida el token (y el perfil, obligatorio la primera vez) de un mensaje `auth`."""
+    token = str(message.get("token") or "")
+    await verify_token(token)
+    if message.get("profile") is not None or profile is None:
+        profile = AgentProfile.model_validate(message.get("profile") or {})
+    return token, profile
+
+
+async def _notify_ocr(session_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Si hay un OCR sin notificar, lo agrega como respuesta del mentor y pasa la
+    conversación a `ocr_notificado` (igual que el fast-path de /agent/, sin esperar
+    un mensaje del estudiante). Devuelve (respuesta_html, ocr) o None.
+    """
+    async with session_batch(session_id) as session:
+        ocr = session.ocr_result
+        state = session.state
+        if not ocr or state.phase != CERTIFICADO_RECIBIDO:
+            return None
+        respuesta_ok = f"<p>{ocr['summary']}</p>"
+        session.append_message("assistant", respuesta_ok)
+        session.set_state(state.assistant_turn(respuesta_ok).on(EV_OCR_NOTIFICADO))
+        return respuesta_ok, ocr
+
+
+@ws_router.websocket("/agent/ws/{session_id}")
+async def agent_ws_endpoint(
+    websocket: WebSocket,
+    session_id: str,
+    stream: Callable[..., AsyncIterator[str]] = Depends(get_manager_stream),
+) -> None:
+    """
+    Canal WebSocket de una sesión: se autentica una vez y atiende varios turnos
+    sobre la misma conexión, con las mismas reglas que /agent/stream/.
+    Mensajes del cliente (JSON):
+    - `{"type": "auth", "token": ..., "profile": {fullName, nickname, idCard, career,
+      email, student_gender, mentor_gender}}`: obligatorio como primer mensaje (dentro de
+      WS_AUTH_TIMEOUT_S); se puede repetir para renovar el token (el perfil es opcional).
+    - `{"type": "prompt", "prompt": ..., "id": ...}`: un turno; `id` vuelve en sus eventos.
+    - `{"type": "ping"}` → `{"type": "pong"}`.
+    Mensajes del servidor: `ready` (con `state`), `start`, `delta` (HTML saneado),
+    `final` (`response` con el mismo formato que /agent/), `error`, y `ocr`: cuando
+    /analyze-file/ termina de procesar un documento de la sesión, se notifica al
+    instante (queda en el historial y el próximo turno no lo repite).
+    Token inválido o sin autenticar a tiempo: `error` y cierre 1008. Cada `prompt`
+    revalida el token con `verify_token`; si ya no es válido (p. ej. expiró), `error`
+    401 hasta que llegue un `auth` nuevo.
+    Si la conexión se cierra, los turnos en curso se cancelan y no se guardan.
+    Con SHARD_NODES, la conexión debe llegar al worker dueño de la sesión (el ruteo
+    entre workers solo aplica a HTTP).
+    """
+    await websocket.accept()
+    # Todo frame sale por esta cola y un solo sender: nunca hay dos envíos a la vez
+    outbox: "asyncio.Queue[Any]" = asyncio.Queue()
+    turns: Set["asyncio.Task"] = set()
+
+    async def sender() -> None:
+        while True:
+            message = await outbox.get()
+            if isinstance(message, _WsClose):
+                await websocket.close(code=message.code)
+                return
+            await websocket.send_text(json.dumps(message, ensure_ascii=False))
+
+    async def reject(error: Dict[str, Any]) -> None:
+        """Envía el error, cierra con 1008 y espera a que el sender vacíe la cola."""
+        outbox.put_nowait(error)
+        outbox.put_nowait(_WsClose(_WS_POLICY_VIOLATION))
+        try:
+            await sender_task
+        except Exception:
+            pass  # el cliente ya se fue
+
+    async def push_ocr(events: "asyncio.Queue[Dict[str, Any]]") -> None:
+        # La primera vuelta cubre un OCR que llegó antes de conectarse. Toma el turno
+        # de la sesión sin pasar por la coalescencia de prompts (no es un mensaje).
+        while True:
+            async with session_gate.exclusive(session_id):
+                notified = await _notify_ocr(session_id)
+            if notified is not None:
+                respuesta, ocr = notified
+                outbox.put_nowait({
+                    "type": "ocr",
+                    "html": respuesta,
+                    "data": ocr,
+                    "state": await _session_state(session_id),
+                })
+            while (await events.get())["type"] != OCR_EVENT:
+                pass
+
+    async def turn(request: AgentRequest, message_id: Any) -> None:
+        outbox.put_nowait({"type": "start", "id": message_id, "session_id": session_id})
+        turn_task = _start_streamed_turn(
+            request,
+            stream,
+            lambda chunk: outbox.put_nowait({"type": "delta", "id": message_id, "html": chunk}),
+        )
+        try:
+            gated = await turn_task
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            outbox.put_nowait(_ws_error(500, str(error), message_id))
+            return
+        outbox.put_nowait({"type": "final", "id": message_id, "response": await _final_payload(gated, session_id)})
+
+    sender_task = asyncio.create_task(sender())
+    try:
+        try:
+            first = json.loads(await asyncio.wait_for(websocket.receive_text(), settings.ws_auth_timeout_s))
+            if not isinstance(first, dict) or first.get("type") != "auth":
+                raise HTTPException(status_code=401, detail="El primer mensaje debe ser 'auth'")
+            token, profile = await _ws_auth(first, None)
+        except WebSocketDisconnect:
+            raise
+        except asyncio.TimeoutError:
+            return await reject(_ws_error(408, "No se recibió 'auth' a tiempo"))
+        except Exception as error:
+            return await reject(_ws_error_of(error))
+
+        with session_events.subscribe(session_id) as events:
+            push_task = asyncio.create_task(push_ocr(events))
+            outbox.put_nowait({"type": "ready", "session_id": session_id, "state": await _session_state(session_id)})
+            try:
+                while True:
+                    try:
+                        message = json.loads(await websocket.receive_text())
+                    except ValueError:
+                        outbox.put_nowait(_ws_error(400, "Mensaje JSON inválido"))
+                        continue
+                    kind = message.get("type") if isinstance(message, dict) else None
+                    message_id = message.get("id") if isinstance(message, dict) else None
+
+                    if kind == "ping":
+                        outbox.put_nowait({"type": "pong"})
+                    elif kind == "auth":
+                        try:
+                            token, profile = await _ws_auth(message, profile)
+                        except Exception as error:
+                            return await reject(_ws_error_of(error, message_id))
+                    elif kind == "prompt":
+                        prompt = message.get("prompt")
+                        if not isinstance(prompt, str) or not prompt.strip():
+                            outbox.put_nowait(_ws_error(400, "'prompt' debe ser un texto no vacío", message_id))
+                            continue
+                        # Cada turno revalida el token con las reglas de /agent/ (expiración y
+                        # firma; el payload ya verificado sale de la caché hasta su 'exp')
+                        try:
+                            await verify_token(token)
+                        except HTTPException as error:
+                            outbox.put_nowait(_ws_error(error.status_code, f"{error.detail}; envía 'auth' de nuevo", message_id))
+                            continue
+                        request = AgentRequest(prompt=prompt, session_id=session_id, **profile.model_dump())
+                        task = asyncio.create_task(turn(request, message_id))
+                        turns.add(task)
+                        task.add_done_callback(turns.discard)
+                    else:
+                        outbox.put_nowait(_ws_error(400, f"Tipo de mensaje desconocido: {kind!r}", message_id))
+            finally:
+                push_task.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Conexión cerrada con turnos en vuelo: se cortan y no se guardan
+        for task in turns:
+            if not task.done():
+                task.cancel()
+                cancellations.record("agent_ws")
+        sender_task.cancel()
+# ------------------------------------------------
+
+
+async def _agent_turn(
+    request: AgentRequest,
+    run: Callable[..., Awaitable[str]],
+) -> _Turn:
+    """Un turno de conversación (se ejecuta bajo el lock de la sesión)."""
     # Extraer datos del request body
     prompt = request.prompt
     session_id = request.session_id
@@ -193,12 +633,14 @@ async def agent_endpoint(
     student_gender = request.student_gender
     mentor_gender = request.mentor_gender
     
-    try:
+    # Una lectura del estado al entrar y un solo commit al salir
+    async with session_batch(session_id) as session:
         # ——— REINICIO EXPLÍCITO ———
         if prompt.strip().lower() == "--reiniciar--":
-            clear_session(session_id)
-            append_message(session_id, "system", "[contexto reiniciado]")
-            return success_response(
+            session.clear()
+            session.append_message("system", "[contexto reiniciado]")
+            session.set_state(ConversationState())
+            return _Turn(
                 data={
                     "session_id": session_id,
                     "prompt": prompt,
@@ -208,11 +650,16 @@ async def agent_endpoint(
                 message="Contexto reiniciado",
             )
 
+        state = session.state
+
         # ——— PRE-ESCALAMIENTO ———
-        if detectar_escalamiento(prompt):
-            append_message(session_id, "user", prompt)
-            append_message(session_id, "assistant", "--mentor--")
-            return success_response(
+        with stage("escalation"):
+            escalar = detectar_escalamiento(prompt)
+        if escalar:
+            session.append_message("user", prompt)
+            session.append_message("assistant", "--mentor--")
+            session.set_state(state.user_turn(prompt).assistant_turn("--mentor--"))
+            return _Turn(
                 data={
                     "session_id": session_id,
                     "prompt": prompt,
@@ -222,24 +669,15 @@ async def agent_endpoint(
             )
 
         # ——— FAST-PATH: usar OCR solo UNA VEZ ———
-        docs = get_uploaded_docs(session_id)   # set(...) de tags
-        ocr  = get_ocr_result(session_id)      # {"certificate","summary","escalated","ts"} o None
+        ocr = session.ocr_result      # {"certificate","summary","escalated","ts"} o None
 
-        if (
-            ocr
-            and "ocr_notified" not in docs
-            and (
-                "certificado_validado" in docs
-                or "certificado_medico" in docs
-                or any(str(d).startswith("doc:") for d in docs)
-            )
-        ):
-            append_message(session_id, "user", prompt)
+        if ocr and state.phase == CERTIFICADO_RECIBIDO:
+            session.append_message("user", prompt)
             respuesta_ok = f"<p>{ocr['summary']}</p>"
-            append_message(session_id, "assistant", respuesta_ok)
-            add_uploaded_doc(session_id, "ocr_notified")
+            session.append_message("assistant", respuesta_ok)
+            session.set_state(state.user_turn(prompt).assistant_turn(respuesta_ok).on(EV_OCR_NOTIFICADO))
 
-            return success_response(
+            return _Turn(
                 data={
                     "session_id": session_id,
                     "prompt": prompt,
@@ -252,17 +690,17 @@ async def agent_endpoint(
         # ——— CIERRE DE CONVERSACIÓN: si ya se procesó el caso y el usuario agradece ———
         if (
             ocr
-            and "ocr_notified" in docs
+            and state.phase in (OCR_NOTIFICADO, CERRADO)
             and _es_mensaje_cierre(prompt)
         ):
-            append_message(session_id, "user", prompt)
+            session.append_message("user", prompt)
             respuesta_cierre = _generar_respuesta_cierre(nickname, mentor_gender)
-            append_message(session_id, "assistant", respuesta_cierre)
-            
-            # Marcar que el caso está cerrado para evitar reactivaciones
-            add_uploaded_doc(session_id, "caso_cerrado")
+            session.append_message("assistant", respuesta_cierre)
+
+            # Caso cerrado: evita reactivaciones
+            session.set_state(state.user_turn(prompt).assistant_turn(respuesta_cierre).on(EV_CIERRE))
 
-            return success_response(
+            return _Turn(
                 data={
                     "session_id": session_id,
                     "prompt": prompt,
@@ -272,40 +710,89 @@ async def agent_endpoint(
                 message="Respuesta de cierre de conversación",
             )
 
-        # 1) Recupera la historia previa
-        history = get_history(session_id)
+        # 1) Recupera la historia previa (incluirá el mensaje que se agrega abajo)
+        history = session.history
+
+        # 1.1) Clasificación del caso en el servidor (antes era una tool del Manager) y
+        #      transición del estado con el mensaje nuevo
+        with stage("classify"):
+            case = classify_case(prompt)
+            state = state.user_turn(prompt, case)
+            directa = _respuesta_directa(case, state)
+        asks_document = bool(case.get("required_doc"))
 
         # 2) Añade el nuevo mensaje de usuario a la historia
-        append_message(session_id, "user", prompt)
+        session.append_message("user", prompt)
 
-        # 3) Cuenta cuántas veces ya respondió Antonella
-        assistant_count = sum(1 for m in history if m["role"] == "assistant")
-        interaction = assistant_count + 1
+        if directa is not None:
+            respuesta, mensaje = directa
+            session.append_message("assistant", respuesta)
+            session.set_state(state.assistant_turn(respuesta, asks_document=asks_document))
+            return _Turn(
+                data={
+                    "session_id": session_id,
+                    "prompt": prompt,
+                    "response": respuesta,
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                },
+                message=mensaje,
+            )
 
-        # 4) Reconstruye el “chat style” con prefijos
-        full_prompt = f"Interaccion: {interaction}\n"
-        for msg in history:
-            prefix = "Estudiante:" if msg["role"] == "user" else "Mentor:"
-            full_prompt += f"{prefix} {msg['content']}\n"
+        # 3-4) Tamaño del transcript cacheado por sesión (solo se cuentan los mensajes nuevos). Si
+        #      la conversación excede CONTEXT_TOKEN_BUDGET, los turnos viejos van como ResumenPrevio.
+        with stage("context"):
+            transcript_tokens = transcript_cache.tokens(session_id, history)
+            summary, start = context_window.window(session_id, history, transcript_tokens)
 
-        # 5) Inyecta metadatos del usuario
-        full_prompt += (
+        # 5) Metadatos del usuario (estables en la sesión) y del turno (cambian cada vez):
+        #    el estado de la conversación ya resuelto, para no deducirlo del historial
+        profile = (
             f"DatosUsuario: nombre={fullName}, apodo={nickname}, "
-            f"cédula={idCard}, carrera={career}, correo={email}, estudiante_genero={student_gender}, mentor_genero={mentor_gender}\n"
-            "Mentor:"
+            f"cédula={idCard}, carrera={career}, correo={email}, estudiante_genero={student_gender}, mentor_genero={mentor_gender}"
         )
+        turn_meta = state.prompt_line()
+        if case["case"] != "desconocido":
+            turn_meta += f"\nClasificacionCaso: {json.dumps(case, ensure_ascii=False)}"
 
-        # 6) Lanza el agente con TODO el contexto
-        assistant_response = await run(full_prompt)
+        # 5.1) Intención del turno: el Manager recibe solo las secciones de reglas que aplican
+        if case["case"] != "desconocido":
+            intent = JUSTIFICACION
+        else:
+            previos = [m["content"] for m in reversed(history[-5:-1]) if m["role"] == "user"]
+            intent = detectar_intencion(prompt, previos[:2])
 
-        # 6.1) Sanea/normaliza el HTML antes de guardar y devolver
-        assistant_response = _sanitize_html(assistant_response)
+        # 6) Lanza el agente con TODO el contexto (el último mensaje del historial es el nuevo)
+        manager_input = _manager_input(profile, summary, history[start:-1], turn_meta, prompt)
+        with stage("manager"):
+            assistant_response = await run(manager_input, intent=intent)
+        usage = last_run_usage.get()
+        truncated = last_run_truncated.get()
 
-        # 7) Guarda la respuesta del agente en la historia
-        append_message(session_id, "assistant", assistant_response)
+        # 6.1) Deadline agotado: se devuelve el texto de respaldo sin guardar el turno
+        if assistant_response == TIMEOUT_REPLY:
+            session.discard()
+            return _Turn(
+                data={
+                    "session_id": session_id,
+                    "prompt": prompt,
+                    "response": TIMEOUT_REPLY,
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                },
+                message="El Manager no respondió a tiempo",
+                timed_out=True,
+            )
+
+        # 6.2) Sanea/normaliza el HTML antes de guardar y devolver
+        assistant_response = sanitize_html(assistant_response)
+        if truncated and assistant_response.rfind("<p>") > assistant_response.rfind("</p>"):
+            assistant_response += "</p>"  # respuesta parcial: se cierra el párrafo cortado
+
+        # 7) Guarda la respuesta del agente en la historia y avanza el estado
+        session.append_message("assistant", assistant_response)
+        session.set_state(state.assistant_turn(assistant_response, asks_document=asks_document))
 
         # 8) Devuelve la respuesta al cliente
-        return success_response(
+        return _Turn(
             data={
                 "session_id": session_id,
                 "prompt": prompt,
@@ -320,7 +807,7 @@ async def agent_endpoint(
                 "timestamp": datetime.now(timezone.utc).isoformat(),
             },
             message="Respuesta generada por el agente Manager",
+            usage=usage,
+            truncated=truncated,
         )
 
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=str(error))
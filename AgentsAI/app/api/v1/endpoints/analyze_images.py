@@ -1,10 +1,16 @@
 # app/api/v1/endpoints/analyze_images.py
 
 from app.utils.response      import success_response
-from fastapi import APIRouter, HTTPException, status, File, UploadFile, Form, Depends
+from fastapi import APIRouter, HTTPException, status, File, UploadFile, Form, Depends, Header, Request
+from typing import Any, Dict, Optional
 from app.services.azure_openai_client import azure_client
 from datetime import datetime
-from app.utils.session_store import get_uploaded_docs, add_uploaded_doc, set_ocr_result
+from app.utils.session_store import session_batch
+from app.utils.session_gate import session_gate
+from app.utils.idempotency import fingerprint, idempotency_store, owner_of
+from app.utils.cancellation import cancel_on_disconnect
+from app.utils.deadline import bounded, request_deadline
+from app.utils.stage_timer import stage
 from app.schemas.analyze_images import ImageAnalysisResponse
 from app.core.config import settings
 import logging
@@ -153,26 +159,82 @@ def _find_dates_in_text(analysis: str) -> list[str]:
 
 # ------------------------------------------------------------------------------------
 
+async def _persist_ocr_state(session_id: str, tags: list[str], result: dict) -> None:
+    """
+    Guarda etiquetas de documentos y el resultado OCR en un solo commit. Toma el
+    turno de la sesión (session_gate): si un turno del agente está en curso, espera
+    a que guarde su estado y aplica el documento encima, en vez de que ese turno
+    lo sobrescriba con el estado que leyó antes del OCR.
+    """
+    async with session_gate.exclusive(session_id), session_batch(session_id) as session:
+        for tag in tags:
+            session.add_uploaded_doc(tag)
+        # pasa la conversación a certificado_recibido: el agent notifica este resultado una
+        # vez (también si se sube otro archivo en la misma sesión)
+        session.set_ocr_result(result)
+
+# ------------------------------------------------------------------------------------
+
 @router.post(
     "/analyze-file/",
     response_model=ImageAnalysisResponse,
     summary="Analiza imágenes y documentos PDF para certificados médicos y deportivos"
 )
 async def analyze_image_file(
+    http_request: Request,
     session_id: str = Form(..., description="ID de la sesión para agrupar documentos"),
     image_file: UploadFile = File(
         ..., 
         description="Imagen (PNG/JPEG/GIF) o documento PDF hasta 10 MB"
-    )
+    ),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    token: Dict[str, Any] = Depends(get_token_payload),
 ):
     """
     Analiza archivos de imagen o PDF para identificar y validar certificados médicos,
     deportivos, actas de defunción y otros documentos oficiales.
     
+    Con header `Idempotency-Key`, un reintento con la misma clave (mismo usuario, archivo y
+    sesión) recibe el resultado ya calculado, o espera el que está en curso, sin repetir el análisis.
+    Si el cliente se desconecta a mitad del análisis, las llamadas a Azure OpenAI se cancelan
+    y no se guarda nada en la sesión.
+    El análisis tiene un deadline (ANALYZE_DEADLINE_S): si se agota antes de identificar el
+    documento, se responde 504 pidiendo volver a subirlo (no se guarda como resultado de la clave
+    de idempotencia); las extracciones opcionales que no alcancen quedan vacías.
+    Con SERVER_TIMING, cada llamada a Azure (`azure.ocr`, `azure.classify`, …) va en `Server-Timing`.
+
     **SEGURIDAD**: session_id se pasa en el body (Form) para evitar exposición en URLs/logs.
     """
-    # --- 1) validaciones ---
     content = await image_file.read()
+    with request_deadline(settings.analyze_deadline_s):
+        if idempotency_key:
+            work = idempotency_store.run(
+                "analyze-file",
+                owner_of(token, session_id),
+                idempotency_key,
+                fingerprint(session_id, content),
+                lambda: _analyze_file(session_id, image_file, content),
+            )
+        else:
+            work = _analyze_file(session_id, image_file, content)
+        return await cancel_on_disconnect(http_request, work, endpoint="analyze-file")
+
+
+# Respuesta de respaldo si el análisis agota su deadline antes de identificar el documento
+TIMEOUT_SUMMARY = (
+    "No alcancé a revisar tu documento en este momento. Por favor, vuelve a subirlo en unos minutos."
+)
+
+
+async def _complete(step: str, **kwargs):
+    """chat.completions.create acotado por el deadline del request; se mide como etapa `azure.<step>`."""
+    with stage(f"azure.{step}"):
+        async with bounded("analyze"):
+            return await azure_client.chat.completions.create(**kwargs)
+
+
+async def _analyze_file(session_id: str, image_file: UploadFile, content: bytes):
+    # --- 1) validaciones ---
     if len(content) > 10 * 1024 * 1024:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
@@ -271,9 +333,10 @@ async def analyze_image_file(
                 detail="PDF processing library not available. Please install PyPDF2 or pypdf."
             )
         try:
-            reader = PdfReader(io.BytesIO(content))
-            pages = [page.extract_text() or "" for page in reader.pages]
-            texto_pdf = "\n\n".join(pages).strip()
+            with stage("pdf_text"):
+                reader = PdfReader(io.BytesIO(content))
+                pages = [page.extract_text() or "" for page in reader.pages]
+                texto_pdf = "\n\n".join(pages).strip()
             
             if not texto_pdf.strip():
                 if fitz is not None:
@@ -324,7 +387,8 @@ async def analyze_image_file(
 
     # --- 5) llamada al modelo ---
     try:
-        resp = await azure_client.chat.completions.create(
+        resp = await _complete(
+            "ocr",
             model=settings.azure_openai_deployment_chat,
             messages=[
                 {
@@ -369,14 +433,12 @@ async def analyze_image_file(
 
             # Persistencia de estado OCR
             tag = "doc:no_certificado"
-            add_uploaded_doc(session_id, tag)
-            set_ocr_result(session_id, {
+            await _persist_ocr_state(session_id, [tag], {
                 "certificate": "Desconocido",
                 "summary": summary,
                 "escalated": escalated,
                 "ts": datetime.utcnow().isoformat()
             })
-            get_uploaded_docs(session_id).discard("ocr_notified")
 
             return success_response(data={
                 "analysis": analysis,
@@ -399,7 +461,8 @@ async def analyze_image_file(
             "Desconocido"
         }
         try:
-            classify = await azure_client.chat.completions.create(
+            classify = await _complete(
+                "classify",
                 model=settings.azure_openai_deployment_chat,
                 messages=[
                     {
@@ -424,6 +487,8 @@ async def analyze_image_file(
             raw_label = (classify.choices[0].message.content or "").strip()
             normalized = "".join(ch for ch in raw_label if ch.isalnum())
             certificate = normalized if normalized in allowed_labels else "Desconocido"
+        except TimeoutError:
+            raise  # sin tiempo no se puede decir que el documento es "Desconocido"
         except Exception as e:
             logger.warning(f"No se pudo clasificar el tipo de certificado: {e}")
             certificate = "Desconocido"
@@ -442,14 +507,12 @@ async def analyze_image_file(
 
             # Persistencia de estado OCR
             tag = "doc:CalamidadDomestica"
-            add_uploaded_doc(session_id, tag)
-            set_ocr_result(session_id, {
+            await _persist_ocr_state(session_id, [tag], {
                 "certificate": certificate,
                 "summary": summary,
                 "escalated": escalated,
                 "ts": datetime.utcnow().isoformat()
             })
-            get_uploaded_docs(session_id).discard("ocr_notified")
 
             return success_response(data={
                 "analysis": analysis,
@@ -478,14 +541,12 @@ async def analyze_image_file(
 
             # Persistencia de estado OCR
             tag = "doc:desconocido"
-            add_uploaded_doc(session_id, tag)
-            set_ocr_result(session_id, {
+            await _persist_ocr_state(session_id, [tag], {
                 "certificate": certificate,
                 "summary": summary,
                 "escalated": escalated,
                 "ts": datetime.utcnow().isoformat()
             })
-            get_uploaded_docs(session_id).discard("ocr_notified")
 
             return success_response(data={
                 "analysis": analysis,
@@ -499,7 +560,8 @@ async def analyze_image_file(
             })
 
         # --- 6b) resumen (para certificados reconocidos) ---
-        summary_resp = await azure_client.chat.completions.create(
+        summary_resp = await _complete(
+            "summary",
             model=settings.azure_openai_deployment_chat,
             messages=[
                 {
@@ -519,7 +581,8 @@ async def analyze_image_file(
         # --- 6c) validación estricta ---
         escalated = ""
         try:
-            check_resp = await azure_client.chat.completions.create(
+            check_resp = await _complete(
+                "check",
                 model=settings.azure_openai_deployment_chat,
                 messages=[
                     {
@@ -567,6 +630,8 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
                 escalated = "justificado"
             else:
                 escalated = ""
+        except TimeoutError:
+            raise  # sin tiempo no se puede decir que el documento no justifica la falta
         except Exception:
             logger.exception("No se pudo verificar requisitos mínimos; dejando 'escalated' vacío.")
             escalated = ""
@@ -574,7 +639,8 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
         # --- 6d) nombre completo (fullName) ---
         fullName = ""
         try:
-            name_resp = await azure_client.chat.completions.create(
+            name_resp = await _complete(
+                "name",
                 model=settings.azure_openai_deployment_chat,
                 messages=[
                     {
@@ -606,7 +672,8 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
         # --- 6e) fechas de inicio/fin (dateInit, dateEnd) ---
         date_init, date_end = "", ""
         try:
-            dates_resp = await azure_client.chat.completions.create(
+            dates_resp = await _complete(
+                "dates",
                 model=settings.azure_openai_deployment_chat,
                 messages=[
                     {
@@ -650,7 +717,8 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
         # --- 6f) IDENTIFICACIÓN del estudiante (cédula/pasaporte) ---
         identification = ""
         try:
-            id_resp = await azure_client.chat.completions.create(
+            id_resp = await _complete(
+                "id",
                 model=settings.azure_openai_deployment_chat,
                 messages=[
                     {
@@ -691,23 +759,19 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
                     identification = cand
 
         # --- Persistencia de estado OCR ---
-        tag = f"doc:{certificate}"
-        add_uploaded_doc(session_id, tag)
+        tags = [f"doc:{certificate}"]
         if certificate in {"CitaMedicaSinReposo", "CitaMedicaConReposo", "CitaMedicaHijosMenores"}:
-            add_uploaded_doc(session_id, "certificado_medico")
+            tags.append("certificado_medico")
         if escalated == "justificado":
-            add_uploaded_doc(session_id, "certificado_validado")
+            tags.append("certificado_validado")
 
-        set_ocr_result(session_id, {
+        await _persist_ocr_state(session_id, tags, {
             "certificate": certificate,
             "summary": summary,
             "escalated": escalated,  # 'justificado' o ''
             "ts": datetime.utcnow().isoformat()
         })
 
-        # permitir nueva notificación en el agent si se sube otro archivo en misma sesión
-        get_uploaded_docs(session_id).discard("ocr_notified")
-
         return success_response(data={
             "analysis": analysis,
             "summary": summary,
@@ -719,6 +783,20 @@ Indica solo 'OK' si TODAS las piezas requeridas están presentes. Si falta algun
             "identification": identification 
         })
 
+    except TimeoutError:
+        # No se guarda estado OCR: el documento no llegó a revisarse
+        logger.warning("Análisis de documento sin tiempo (deadline agotado)")
+        # 504: no es un resultado, así que Idempotency-Key no lo guarda y el reintento se ejecuta
+        return success_response(success=False, code=status.HTTP_504_GATEWAY_TIMEOUT, message="El análisis no terminó a tiempo", data={
+            "analysis": "",
+            "summary": TIMEOUT_SUMMARY,
+            "certificate": "",
+            "escalated": "",
+            "fullName": "",
+            "dateInit": "",
+            "dateEnd": "",
+            "identification": ""
+        })
     except Exception as e:
         logger.error(f"Error procesando el archivo o generando summary: {e}", exc_info=True)
         raise HTTPException(
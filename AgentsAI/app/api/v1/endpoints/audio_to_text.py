@@ -7,6 +7,7 @@ from typing import Optional
 import os
 
 from app.utils.response import success_response
+from app.utils.stage_timer import stage
 
 router = APIRouter()
 
@@ -16,6 +17,7 @@ async def transcribe_audio(
     """
     Endpoint para transcribir archivos de audio usando Azure OpenAI.
     Máximo 25 MB por archivo.
+    Con SERVER_TIMING, la transcripción se mide como etapa `azure.transcribe`.
     """
     
     # Validar tamaño del archivo (25 MB máximo)
@@ -52,7 +54,7 @@ async def transcribe_audio(
             temp_file_path = temp_file.name
         
         # Transcribir audio usando Azure OpenAI
-        with open(temp_file_path, "rb") as audio_file_obj:
+        with open(temp_file_path, "rb") as audio_file_obj, stage("azure.transcribe"):
             transcript = await azure_client.audio.transcriptions.create(
                 model="gpt-4o-mini-transcribe",
                 file=audio_file_obj,
@@ -4,12 +4,14 @@ from __future__ import annotations
 import json
 import logging
 from datetime import datetime, timezone
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Mapping, Sequence, Tuple
 
-from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi import APIRouter, HTTPException, Body, Depends, Request
 from app.services.azure_openai_client import azure_openai_client
 from app.utils.response import success_response
-from app.utils.session_store import get_session_messages, get_ocr_result
+from app.utils.session_store import view_session
+from app.utils.cancellation import cancel_on_disconnect
+from app.utils.stage_timer import stage
 from app.utils.escalamiento_detector import detectar_escalamiento  # detección determinística
 from app.core.config import settings
 from app.core.security import User
@@ -22,7 +24,7 @@ router = APIRouter(
 )
 
 
-def _render_history_for_summary(messages: List[Dict[str, str]]) -> str:
+def _render_history_for_summary(messages: Sequence[Mapping[str, str]]) -> str:
     """
     Convierte la lista de mensajes de la sesión en un texto plano
     tipo chat: 'Estudiante:' / 'Mentor:' para que el modelo resuma mejor.
@@ -40,7 +42,7 @@ def _render_history_for_summary(messages: List[Dict[str, str]]) -> str:
     return "\n".join(lines)
 
 
-def _detect_local_escalation(messages: List[Dict[str, str]], fallback_text: Optional[str]) -> Tuple[bool, str]:
+def _detect_local_escalation(messages: Sequence[Mapping[str, str]], fallback_text: Optional[str]) -> Tuple[bool, str]:
     """
     Reglas determinísticas de escalado:
     - Si algún mensaje del asistente contiene '--mentor--' -> escalado True.
@@ -237,7 +239,7 @@ async def _classify_theme(conversation_text: str) -> str:
 # NUEVO: inferencia de prioridad (baja | media | alta)
 # =========================
 def _infer_priority(
-    messages: List[Dict[str, str]],
+    messages: Sequence[Mapping[str, str]],
     conversation_text: str,
     summary_payload: Dict,
     ocr_info: Optional[Dict],
@@ -279,15 +281,22 @@ def _infer_priority(
 
 @router.post("/summary/", response_model=SummaryResponse, summary="Resume las conversaciones de un chat")
 async def summarize(
+    http_request: Request,
     request: SummaryRequest = Body(...),
 ):
     """
     Si se pasa session_id, el resumen se arma con el historial guardado.
     Si no, puedes pasar un texto de conversación en 'conversation'.
     Además, se detecta determinísticamente (servidor) si hubo escalamiento.
+    Si el cliente se desconecta, las llamadas a Azure OpenAI en curso se cancelan.
+    Con SERVER_TIMING, cada etapa (lectura de sesión, llamadas a Azure) va en `Server-Timing`.
     
     **SEGURIDAD**: session_id se recibe en el body para evitar exposición en URLs y logs.
     """
+    return await cancel_on_disconnect(http_request, _summarize(request), endpoint="summary")
+
+
+async def _summarize(request: SummaryRequest):
     # Extraer datos del request body
     session_id = request.session_id
     conversation = request.conversation
@@ -299,14 +308,17 @@ async def summarize(
                 detail="Debes enviar 'session_id' o 'conversation'.",
             )
 
-        messages: List[Dict[str, str]] = []
+        messages: Sequence[Mapping[str, str]] = []
         convo_text = ""
         ocr_info: Optional[Dict] = None
 
         if session_id:
-            messages = get_session_messages(session_id)
-            convo_text = _render_history_for_summary(messages)
-            ocr_info = get_ocr_result(session_id)
+            # Historial + OCR en una sola lectura, sin copiar el historial
+            with stage("session_load"):
+                snapshot = await view_session(session_id)
+                messages = snapshot.messages
+                convo_text = _render_history_for_summary(messages)
+            ocr_info = snapshot.ocr
         else:
             convo_text = conversation or ""
 
@@ -326,22 +338,26 @@ async def summarize(
             )
 
         # 1) Resumen del modelo
-        summary_payload = await _summarize_with_aoai(convo_text, ocr_info)
+        with stage("azure.summary"):
+            summary_payload = await _summarize_with_aoai(convo_text, ocr_info)
 
         # 2) Detección local (determinística) de escalado
-        local_escalado, _ = _detect_local_escalation(messages, conversation)
+        with stage("escalation"):
+            local_escalado, _ = _detect_local_escalation(messages, conversation)
 
         # 3) Fusión: si local detecta escalado, forzamos 'escalated' y generamos motivo con IA si falta
         if local_escalado:
             summary_payload["escalated"] = True
             motive = (summary_payload.get("escalation_reason") or "").strip()
             if not motive:
-                motive_llm = await _infer_escalation_reason_llm(convo_text)
+                with stage("azure.escalation_reason"):
+                    motive_llm = await _infer_escalation_reason_llm(convo_text)
                 summary_payload["escalation_reason"] = motive_llm or "sensitive reasons detected in the conversation"
 
         # 4) Clasificar temática (si hay overview no vacío)
         if (summary_payload.get("overview") or "").strip():
-            theme = await _classify_theme(convo_text)
+            with stage("azure.theme"):
+                theme = await _classify_theme(convo_text)
         else:
             theme = ""  # si overview está vacío, theme vacío
         summary_payload["theme"] = theme
@@ -34,6 +34,69 @@ class Settings(BaseSettings):
     openai_vs_faq_id: str = Field(..., env="OPENAI_VS_FAQ_ID")
     openai_vs_inquirer_id: str = Field(..., env="OPENAI_VS_INQUIRER_ID")
  
+    # Validación de tokens (Azure AD): refresco del JWKS, espaciado mínimo entre
+    # refetch por kid desconocido, payloads verificados en caché hasta su 'exp'
+    # (0 = desactivado) e hilos que la verificación RS256 puede ocupar a la vez
+    jwks_ttl_s: int = Field(default=3600, env="JWKS_TTL_S")
+    jwks_min_refetch_s: int = Field(default=30, env="JWKS_MIN_REFETCH_S")
+    auth_token_cache_size: int = Field(default=1024, env="AUTH_TOKEN_CACHE_SIZE")
+    auth_thread_limit: int = Field(default=8, env="AUTH_THREAD_LIMIT")
+
+    # Threadpool de anyio (dependencias/endpoints síncronos y run_in_threadpool)
+    threadpool_max_workers: int = Field(default=40, env="THREADPOOL_MAX_WORKERS")
+
+    # Session store (memory | sqlite | redis)
+    session_store_backend: str = Field(default="memory", env="SESSION_STORE_BACKEND")
+    session_store_sqlite_path: str = Field(default="sessions.db", env="SESSION_STORE_SQLITE_PATH")
+    session_store_redis_url: str = Field(default="redis://localhost:6379/0", env="SESSION_STORE_REDIS_URL")
+    session_store_redis_prefix: str = Field(default="mentores:session", env="SESSION_STORE_REDIS_PREFIX")
+    # Backend en memoria: expiración por inactividad y presupuesto global (0 = sin límite)
+    session_idle_ttl_s: int = Field(default=6 * 3600, env="SESSION_IDLE_TTL_S")
+    session_max_bytes: int = Field(default=256 * 1024 * 1024, env="SESSION_MAX_BYTES")
+    session_sweep_interval_s: int = Field(default=60, env="SESSION_SWEEP_INTERVAL_S")
+    # Compresión zlib de historiales inactivos (0 = desactivada)
+    session_compress_idle_s: int = Field(default=0, env="SESSION_COMPRESS_IDLE_S")
+    session_compress_min_bytes: int = Field(default=4096, env="SESSION_COMPRESS_MIN_BYTES")
+    # Journal local para reinicio en caliente del backend en memoria ("" = desactivado)
+    session_journal_path: str = Field(default="", env="SESSION_JOURNAL_PATH")
+    session_journal_fsync_ms: int = Field(default=50, env="SESSION_JOURNAL_FSYNC_MS")
+    session_journal_compact_bytes: int = Field(default=64 * 1024 * 1024, env="SESSION_JOURNAL_COMPACT_BYTES")
+
+    # Ventana de contexto del Manager (tokens estimados del transcript; 0 = sin límite)
+    context_token_budget: int = Field(default=4000, env="CONTEXT_TOKEN_BUDGET")
+    context_recent_messages: int = Field(default=12, env="CONTEXT_RECENT_MESSAGES")
+    context_stale_messages: int = Field(default=8, env="CONTEXT_STALE_MESSAGES")
+
+    # Ventana de debounce por sesión en /agents/agent/ (ms; 0 = desactivado): los
+    # mensajes que llegan dentro de la ventana se unen en una sola corrida del Manager
+    agent_debounce_ms: int = Field(default=0, env="AGENT_DEBOUNCE_MS")
+
+    # Respuestas guardadas por Idempotency-Key (/agents/agent/ y /analizeimages/analyze-file/)
+    idempotency_ttl_s: int = Field(default=86400, env="IDEMPOTENCY_TTL_S")
+
+    # Deadline por request (s; 0 = sin límite): el turno del agente y el análisis de
+    # documentos reparten este presupuesto entre sus llamadas y responden con un texto
+    # de respaldo si se agota. Cada herramienta además tiene su propio tope.
+    agent_deadline_s: float = Field(default=30.0, env="AGENT_DEADLINE_S")
+    analyze_deadline_s: float = Field(default=60.0, env="ANALYZE_DEADLINE_S")
+    faq_search_timeout_s: float = Field(default=8.0, env="FAQ_SEARCH_TIMEOUT_S")
+
+    # Tiempos por etapa en el header Server-Timing (y en `meta.timings` si SERVER_TIMING_META)
+    server_timing: bool = Field(default=False, env="SERVER_TIMING")
+    server_timing_meta: bool = Field(default=False, env="SERVER_TIMING_META")
+
+    # Canal WebSocket del agente: segundos para recibir el mensaje de autenticación
+    ws_auth_timeout_s: float = Field(default=10.0, env="WS_AUTH_TIMEOUT_S")
+
+    # Afinidad de sesión entre workers/nodos (vacío = un solo worker)
+    shard_nodes: str = Field(default="", env="SHARD_NODES")
+    shard_self: str = Field(default="", env="SHARD_SELF")
+    # Secreto compartido entre nodos para firmar X-Shard-Forwarded (obligatorio con SHARD_NODES)
+    shard_secret: str = Field(default="", env="SHARD_SECRET")
+    shard_mode: str = Field(default="forward", env="SHARD_MODE")
+    shard_vnodes: int = Field(default=128, env="SHARD_VNODES")
+    shard_forward_timeout_s: float = Field(default=120.0, env="SHARD_FORWARD_TIMEOUT_S")
+
     # CORS settings
     cors_origins: List[AnyHttpUrl] = []
 
@@ -0,0 +1,233 @@
+# app/core/jwks.py
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+import httpx
+import jwt
+from jwt import PyJWK
+from jwt.algorithms import RSAAlgorithm
+
+logger = logging.getLogger(__name__)
+
+# Firma: url -> documento JWKS ({"keys": [...]}), síncrono o asíncrono
+JWKSFetcher = Callable[[str], Union[Dict[str, Any], Awaitable[Dict[str, Any]]]]
+
+
+# ============================================================
+# Descarga de JWKS
+# ============================================================
+async def fetch_jwks_http(url: str, timeout: float = 5.0) -> Dict[str, Any]:
+    """Descarga un documento JWKS con un cliente HTTP asíncrono (no bloquea el event loop)."""
+    async with httpx.AsyncClient(timeout=timeout, headers={"User-Agent": "MentoresAI/1.0"}) as client:
+        resp = await client.get(url)
+        resp.raise_for_status()
+        return resp.json()
+
+
+def _keys_from_jwks(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte un documento JWKS en {kid: llave pública lista para jwt.decode}."""
+    out: Dict[str, Any] = {}
+    for jwk in doc.get("keys") or []:
+        kid = jwk.get("kid")
+        if not kid or jwk.get("use", "sig") != "sig":
+            continue
+        try:
+            out[kid] = PyJWK(jwk).key
+        except jwt.PyJWTError as e:
+            logger.warning("[jwks] llave ignorada kid=%s: %s", kid, e)
+    return out
+
+
+# ============================================================
+# Almacén de llaves por kid
+# ============================================================
+class JWKSKeyStore:
+    """
+    Almacén de llaves de firma a nivel de proceso, indexado por `kid`.
+
+    - `prefetch()` carga todas las URLs JWKS al arrancar.
+    - `get_signing_key(kid)` es una búsqueda en dict; solo se vuelve a descargar
+      cuando aparece un `kid` desconocido (rotación de llaves en Azure AD).
+    - Una tarea en segundo plano refresca el conjunto cada `ttl_s` segundos.
+    - Anti-estampida: un solo refetch a la vez; las corrutinas que esperaban el
+      lock reutilizan el resultado, y los refetch por kid desconocido se limitan
+      a uno cada `min_refetch_interval_s` (un token basura no fuerza descargas).
+
+    Las descargas son asíncronas: ningún hilo queda bloqueado esperando a Azure AD.
+    `fetcher` puede ser una función normal o una corrutina (p. ej. `LocalJWKS.fetch`).
+    """
+
+    def __init__(
+        self,
+        jwks_urls: Iterable[str],
+        *,
+        ttl_s: float = 3600,
+        min_refetch_interval_s: float = 30,
+        fetcher: Optional[JWKSFetcher] = None,
+    ) -> None:
+        self._urls: List[str] = list(dict.fromkeys(u for u in jwks_urls if u))
+        self._ttl_s = ttl_s
+        self._min_refetch_interval_s = min_refetch_interval_s
+        self._fetcher: JWKSFetcher = fetcher or fetch_jwks_http
+
+        # El dict se reemplaza completo en cada refresh: lecturas sin lock.
+        self._keys: Dict[str, Any] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._generation = 0
+        self._fetched_at = 0.0
+        self._last_unknown_refetch = float("-inf")
+
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    # -------- Lectura --------
+    async def get_signing_key(self, kid: Optional[str]) -> Optional[Any]:
+        """Devuelve la llave para `kid` o None si no existe (tras un refetch acotado)."""
+        if not kid:
+            return None
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        await self._refetch_for_unknown_kid(kid)
+        return self._keys.get(kid)
+
+    def kids(self) -> List[str]:
+        return list(self._keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "fetches": self.fetches,
+            "fetch_errors": self.fetch_errors,
+            "age_s": round(time.monotonic() - self._fetched_at, 1) if self._fetched_at else None,
+        }
+
+    # -------- Refresh --------
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def prefetch(self) -> None:
+        """Carga inicial (startup). No lanza: sin red se reintenta bajo demanda."""
+        await self.refresh()
+
+    async def refresh(self) -> None:
+        """Refresca todas las URLs; si otra corrutina ya lo hizo mientras esperábamos, no repite."""
+        generation = self._generation
+        async with self._get_lock():
+            if self._generation != generation:
+                return
+            await self._refresh_locked()
+
+    async def _refetch_for_unknown_kid(self, kid: str) -> None:
+        generation = self._generation
+        async with self._get_lock():
+            if kid in self._keys or self._generation != generation:
+                return
+            now = time.monotonic()
+            if now - self._last_unknown_refetch < self._min_refetch_interval_s:
+                return
+            self._last_unknown_refetch = now
+            logger.info("[jwks] kid desconocido (%s), refrescando llaves", kid)
+            await self._refresh_locked()
+
+    async def _refresh_locked(self) -> None:
+        collected: Dict[str, Any] = {}
+        failed = False
+        for url in self._urls:
+            try:
+                doc = self._fetcher(url)
+                if inspect.isawaitable(doc):
+                    doc = await doc
+                collected.update(_keys_from_jwks(doc))
+                self.fetches += 1
+            except Exception as e:
+                failed = True
+                self.fetch_errors += 1
+                logger.warning("[jwks] fallo descargando %s: %s", url, e)
+
+        if failed:
+            # Conserva las llaves conocidas si alguna URL no respondió
+            collected = {**self._keys, **collected}
+        if collected or not self._keys:
+            self._keys = collected
+        self._generation += 1
+        self._fetched_at = time.monotonic()
+
+    # -------- Refresco en segundo plano --------
+    def start_background_refresh(self) -> None:
+        """Debe llamarse dentro del event loop (startup de FastAPI)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._refresh_loop(), name="jwks-refresh")
+
+    async def stop_background_refresh(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._ttl_s)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("[jwks] error en refresco periódico")
+
+
+# ============================================================
+# JWKS local (pruebas y benchmarks sin red)
+# ============================================================
+class LocalJWKS:
+    """
+    Emisor RS256 local que sirve su propio JWKS. Permite ejercitar
+    `get_token_payload` sin Azure AD:
+
+        local = LocalJWKS()
+        store = JWKSKeyStore(["https://local/keys"], fetcher=local.fetch)
+        token = local.issue({"iss": ..., "aud": ..., "exp": ...})
+    """
+
+    def __init__(self, kid: str = "local-key-1") -> None:
+        self._private_keys: Dict[str, Any] = {}
+        self.kid = kid
+        self.fetch_count = 0
+        self.rotate(kid)
+
+    def rotate(self, kid: str) -> None:
+        """Agrega una nueva llave y la deja como activa para `issue`."""
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self._private_keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = kid
+
+    def jwks(self) -> Dict[str, Any]:
+        keys = []
+        for kid, private in self._private_keys.items():
+            jwk = json.loads(RSAAlgorithm.to_jwk(private.public_key()))
+            jwk.update({"kid": kid, "use": "sig", "alg": "RS256"})
+            keys.append(jwk)
+        return {"keys": keys}
+
+    def fetch(self, url: str) -> Dict[str, Any]:
+        self.fetch_count += 1
+        return self.jwks()
+
+    def issue(self, claims: Dict[str, Any], kid: Optional[str] = None) -> str:
+        kid = kid or self.kid
+        return jwt.encode(claims, self._private_keys[kid], algorithm="RS256", headers={"kid": kid})
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.utils import stage_timer
+
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, enable_hsts: bool = False):
         super().__init__(app)
@@ -32,5 +34,34 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
 
         return res
 
-def setup_middlewares(app: FastAPI, *, prod: bool = False) -> None:
+class ServerTimingMiddleware:
+    """
+    Mide las etapas de cada request (app.utils.stage_timer) y las envía en el
+    header `Server-Timing` (más `total`). ASGI puro: no agrega tareas ni copias
+    del body. Las etapas que terminan después de iniciar la respuesta
+    (streaming) no alcanzan a ir en el header.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = stage_timer.start()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", timings.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+def setup_middlewares(app: FastAPI, *, prod: bool = False, server_timing: bool = False) -> None:
     app.add_middleware(SecurityHeadersMiddleware, enable_hsts=prod)
+    if server_timing:
+        app.add_middleware(ServerTimingMiddleware)
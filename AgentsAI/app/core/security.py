@@ -4,14 +4,19 @@ from __future__ import annotations
 import os
 import re
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import anyio
 import jwt
-from jwt import PyJWKClient, InvalidIssuerError, InvalidAudienceError
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer
 from pydantic import BaseModel
 
+from app.core.config import settings
+from app.core.jwks import JWKSKeyStore
+from app.core.token_cache import VerifiedTokenCache
+from app.utils.stage_timer import stage
+
 logger = logging.getLogger(__name__)
 
 # ============================================================
@@ -113,67 +118,149 @@ def _jwks_url_from_issuer(issuer: str) -> str:
     return f"{issuer.rstrip('/')}/discovery/keys"
 
 
-def _decode_no_verify(token: str) -> Dict[str, Any]:
-    try:
-        return jwt.decode(token, options={"verify_signature": False})
-    except Exception:
-        return {}
-
-
-def _try_decode_with(issuer: str, audience: str, token: str) -> Dict[str, Any]:
-    jwks_url = _jwks_url_from_issuer(issuer)
-    jwks_client = PyJWKClient(jwks_url)
-    signing_key = jwks_client.get_signing_key_from_jwt(token).key
-    return jwt.decode(
-        token,
-        signing_key,
-        algorithms=["RS256"],
-        audience=audience,
-        issuer=issuer,
+# Un solo almacén de llaves por proceso (indexado por kid). Las variantes con/sin
+# '/' final del issuer comparten URL, así que cada JWKS se descarga una vez.
+key_store = JWKSKeyStore(
+    [_jwks_url_from_issuer(iss) for iss in ISSUER_CANDIDATES],
+    ttl_s=settings.jwks_ttl_s,
+    min_refetch_interval_s=settings.jwks_min_refetch_s,
+)
+
+
+# El frontend reenvía el mismo Bearer en cada turno del chat: se verifica una vez.
+token_cache = VerifiedTokenCache(max_entries=settings.auth_token_cache_size)
+
+
+# Cupo de hilos exclusivo para verificar firmas: bajo ráfaga, la autenticación
+# no puede acaparar el threadpool que usan los endpoints de agente y análisis.
+_auth_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def _get_auth_limiter() -> anyio.CapacityLimiter:
+    global _auth_limiter
+    if _auth_limiter is None:
+        _auth_limiter = anyio.CapacityLimiter(settings.auth_thread_limit)
+    return _auth_limiter
+
+
+def auth_limiter_stats() -> Dict[str, Any]:
+    limiter = _get_auth_limiter()
+    return {
+        "total": limiter.total_tokens,
+        "borrowed": limiter.borrowed_tokens,
+        "waiting": limiter.statistics().tasks_waiting,
+    }
+
+
+def set_key_store(store: JWKSKeyStore) -> None:
+    """Reemplaza el almacén de llaves (p. ej. por uno respaldado por LocalJWKS)."""
+    global key_store
+    key_store = store
+
+
+# Ruteo directo: el 'iss'/'aud' del token elige en O(1) la única pareja a verificar.
+_ISSUERS = frozenset(ISSUER_CANDIDATES)
+_AUDIENCES = frozenset(AUDIENCE_CANDIDATES)
+
+
+def _decode_no_verify(token: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Devuelve (header, claims) sin verificar firma; lanza jwt.PyJWTError si está malformado."""
+    decoded = jwt.decode_complete(token, options={"verify_signature": False})
+    return decoded["header"], decoded["payload"]
+
+
+def _route_candidates(claims: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Mapea el 'iss'/'aud' (no verificados) del token a la pareja candidata que le
+    corresponde. Devuelve (None, None) si el issuer no es uno de los aceptados.
+    """
+    iss = claims.get("iss")
+    if not isinstance(iss, str) or iss not in _ISSUERS:
+        return None, None
+
+    aud = claims.get("aud")
+    auds = [aud] if isinstance(aud, str) else (aud if isinstance(aud, list) else [])
+    for a in auds:
+        if isinstance(a, str) and a in _AUDIENCES:
+            return iss, a
+    return iss, None
+
+
+def _unauthorized(claims: Dict[str, Any], error: Any) -> HTTPException:
+    actual_iss = claims.get("iss")
+    actual_aud = claims.get("aud")
+    detail = (
+        f"No se pudo validar el token. iss='{actual_iss}', aud='{actual_aud}'. "
+        f"Esperado iss ∈ {ISSUER_CANDIDATES} y aud ∈ {AUDIENCE_CANDIDATES}."
     )
+    return HTTPException(status_code=401, detail=f"{detail} ({error})")
 
 
-def get_token_payload(credentials=Security(security)) -> Dict[str, Any]:
+def _verify_signature(token: str, key: Any, audience: str, issuer: str) -> Dict[str, Any]:
+    """Verificación RS256 pura (CPU). Se ejecuta fuera del event loop."""
+    return jwt.decode(token, key, algorithms=["RS256"], audience=audience, issuer=issuer)
+
+
+async def get_token_payload(credentials=Security(security)) -> Dict[str, Any]:
     """
-    Valida el JWT Bearer recibido contra una lista de (issuer, audience) candidatos.
+    Valida el JWT Bearer recibido contra los (issuer, audience) candidatos.
     Acepta variantes con/sin '/' final y v2.0. Lanza 401 con detalle claro si falla.
+
+    El 'iss'/'aud' del token se lee una sola vez (sin verificar) para elegir la
+    pareja candidata; un issuer desconocido se rechaza antes de tocar llaves.
+    Así un token rechazado cuesta lo mismo (o menos) que uno válido.
+    La llave de firma sale de `key_store` (dict por kid), sin ir a la red por request,
+    y un token ya verificado se sirve desde `token_cache` hasta su 'exp'.
+
+    Es una dependencia async: FastAPI no la manda al threadpool. Las descargas de
+    JWKS son asíncronas y solo la verificación de firma usa un hilo, dentro del
+    cupo `AUTH_THREAD_LIMIT`. Su duración se mide como etapa `auth` (Server-Timing).
     """
-    token = credentials.credentials
+    return await verify_token(credentials.credentials)
+
+
+async def verify_token(token: str) -> Dict[str, Any]:
+    """Valida un JWT con las mismas reglas que `get_token_payload` (canales sin header, p. ej. WebSocket)."""
+    with stage("auth"):
+        return await _verify_token(token)
 
+
+async def _verify_token(token: str) -> Dict[str, Any]:
     if not ISSUER_CANDIDATES or not AUDIENCE_CANDIDATES:
         raise HTTPException(
             status_code=500,
             detail="Configuración de seguridad incompleta (ISSUER/AUDIENCE).",
         )
 
-    last_error: Optional[Exception] = None
-
-    for iss in ISSUER_CANDIDATES:
-        try:
-            jwks_client = PyJWKClient(_jwks_url_from_issuer(iss))
-            key = jwks_client.get_signing_key_from_jwt(token).key
-        except Exception as e:
-            last_error = e
-            continue
-
-        for aud in AUDIENCE_CANDIDATES:
-            try:
-                payload = jwt.decode(
-                    token, key, algorithms=["RS256"], audience=aud, issuer=iss
-                )
-                return payload
-            except (InvalidAudienceError, InvalidIssuerError, jwt.PyJWTError) as e:
-                last_error = e
-                continue
-
-    decoded = _decode_no_verify(token)
-    actual_iss = decoded.get("iss")
-    actual_aud = decoded.get("aud")
-    detail = (
-        f"No se pudo validar el token. iss='{actual_iss}', aud='{actual_aud}'. "
-        f"Esperado iss ∈ {ISSUER_CANDIDATES} y aud ∈ {AUDIENCE_CANDIDATES}."
-    )
-    raise HTTPException(status_code=401, detail=f"{detail} ({last_error})")
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
+    try:
+        header, claims = _decode_no_verify(token)
+    except jwt.PyJWTError as e:
+        raise _unauthorized({}, e)
+
+    iss, aud = _route_candidates(claims)
+    if iss is None:
+        raise _unauthorized(claims, "issuer no aceptado")
+    if aud is None:
+        raise _unauthorized(claims, "audience no aceptada")
+
+    kid = header.get("kid")
+    key = await key_store.get_signing_key(kid)
+    if key is None:
+        raise _unauthorized(claims, f"llave de firma desconocida (kid={kid})")
+
+    try:
+        payload = await anyio.to_thread.run_sync(
+            _verify_signature, token, key, aud, iss, limiter=_get_auth_limiter()
+        )
+    except jwt.PyJWTError as e:
+        raise _unauthorized(claims, e)
+
+    token_cache.put(token, payload)
+    return payload
 
 
 # ============================================================
@@ -202,7 +289,7 @@ def require_roles(required: List[str]):
     """
     required = [r.strip() for r in (required or []) if r and r.strip()]
 
-    def _checker(payload: Dict[str, Any] = Depends(get_token_payload)) -> Dict[str, Any]:
+    async def _checker(payload: Dict[str, Any] = Depends(get_token_payload)) -> Dict[str, Any]:
         user_roles = _extract_roles(payload)
         user_scopes = _extract_scopes(payload)
 
@@ -0,0 +1,368 @@
+# app/core/sharding.py
+"""
+Afinidad de sesión entre workers/nodos con hashing consistente.
+
+Cada `session_id` tiene un dueño en el anillo (`HashRing`); los requests de
+/agents/agent/ (y su variante /stream/), /analizeimages/analyze-file/ y /summary/summary/ que llegan a
+otro nodo se reenvían (o redirigen con 307) al dueño. Así el estado de la
+sesión (historial, OCR, locks por sesión) vive caliente en un solo proceso.
+
+- Nodos virtuales (`vnodes`): la carga se reparte de forma pareja y, cuando un
+  nodo entra o sale, solo se mueven ~1/N de las sesiones.
+- Cada worker se identifica por su URL base (p. ej. un puerto por worker).
+- Anti-bucle: un request reenviado lleva `X-Shard-Forwarded` y el receptor lo
+  atiende localmente aunque su anillo opine distinto (membresía desfasada).
+  El header va firmado con SHARD_SECRET (compartido entre nodos): si llega de
+  un cliente sin la firma correcta se descarta y el request se enruta normal.
+- Si el dueño no responde, el request se atiende localmente (degradado, pero
+  disponible).
+- La respuesta del dueño se retransmite chunk a chunk (el SSE de /stream/ no
+  se bufferiza) y, si el cliente se desconecta, se cierra la conexión con el
+  dueño para que este cancele el turno.
+
+Configuración: SHARD_NODES (URLs separadas por coma), SHARD_SELF (URL de este
+worker), SHARD_SECRET, SHARD_MODE (forward | redirect), SHARD_VNODES,
+SHARD_FORWARD_TIMEOUT_S.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = "x-shard-forwarded"
+OWNER_HEADER = "x-shard-owner"
+
+# Headers hop-by-hop que no se copian al reenviar
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+    FORWARDED_HEADER,
+}
+
+_MULTIPART_FIELD = re.compile(
+    rb'Content-Disposition:\s*form-data;\s*name="session_id"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--',
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# ============================================================
+# Anillo de hashing consistente
+# ============================================================
+class HashRing:
+    """Anillo con `vnodes` puntos por nodo; `owner(key)` es una búsqueda binaria."""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 128) -> None:
+        self.vnodes = vnodes
+        self._nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.set_nodes(nodes)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def set_nodes(self, nodes: Iterable[str]) -> None:
+        """Reemplaza la membresía completa (join/leave)."""
+        self._nodes = sorted({n.rstrip("/") for n in nodes if n})
+        ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self._nodes
+            for i in range(self.vnodes)
+        )
+        # Se reemplazan ambas listas juntas: las lecturas no necesitan lock
+        self._points, self._owners = [p for p, _ in ring], [n for _, n in ring]
+
+    def add(self, node: str) -> None:
+        self.set_nodes([*self._nodes, node])
+
+    def remove(self, node: str) -> None:
+        node = node.rstrip("/")
+        self.set_nodes(n for n in self._nodes if n != node)
+
+    def owner(self, key: str) -> Optional[str]:
+        points, owners = self._points, self._owners
+        if not points:
+            return None
+        i = bisect.bisect(points, _hash(key))
+        return owners[i % len(owners)]
+
+
+# ============================================================
+# Extracción del session_id del body
+# ============================================================
+def extract_session_id(content_type: str, body: bytes) -> Optional[str]:
+    """session_id desde JSON, multipart/form-data o x-www-form-urlencoded."""
+    content_type = (content_type or "").lower()
+    try:
+        if content_type.startswith("application/json"):
+            value = json.loads(body or b"{}").get("session_id")
+        elif content_type.startswith("multipart/form-data"):
+            m = _MULTIPART_FIELD.search(body)
+            value = m.group(1).decode("utf-8") if m else None
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            value = (parse_qs(body.decode("utf-8")).get("session_id") or [None])[0]
+        else:
+            value = None
+    except (ValueError, AttributeError, UnicodeDecodeError):
+        return None
+    return str(value) if value else None
+
+
+# ============================================================
+# Router de sesiones (middleware ASGI)
+# ============================================================
+class ShardRouter:
+    """Decide el dueño de cada sesión y reenvía/redirige cuando no es este worker."""
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        self_url: str,
+        *,
+        secret: str,
+        mode: str = "forward",
+        vnodes: int = 128,
+        forward_timeout_s: float = 120.0,
+        paths: Iterable[str] = (),
+    ) -> None:
+        if mode not in ("forward", "redirect"):
+            raise ValueError(f"SHARD_MODE desconocido: {mode!r}")
+        if not secret:
+            raise ValueError("ShardRouter requiere un secreto compartido entre nodos")
+        self.self_url = self_url.rstrip("/")
+        self.mode = mode
+        self.ring = HashRing(nodes, vnodes=vnodes)
+        self.paths = frozenset(paths)
+        self.forward_timeout_s = forward_timeout_s
+        # Firma del header anti-bucle: el secreto en sí nunca viaja
+        self._forward_token = hmac.new(secret.encode("utf-8"), b"shard-forwarded", hashlib.sha256).hexdigest()
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Métricas
+        self.local = 0
+        self.forwarded = 0
+        self.redirected = 0
+        self.forward_errors = 0
+        self.rejected_forwards = 0
+        self.client_disconnects = 0
+
+    def owner(self, session_id: str) -> str:
+        return self.ring.owner(session_id) or self.self_url
+
+    def is_local(self, session_id: str) -> bool:
+        return self.owner(session_id) == self.self_url
+
+    def is_forwarded(self, value: bytes) -> bool:
+        """True si `X-Shard-Forwarded` trae la firma de otro nodo del anillo."""
+        return hmac.compare_digest(value, self._forward_token.encode("latin-1"))
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.forward_timeout_s)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def forward(
+        self, owner: str, method: str, path_qs: str, headers: List[Tuple[bytes, bytes]], body: bytes
+    ) -> httpx.Response:
+        """Envía el request al dueño y devuelve la respuesta en modo stream (cerrarla con `aclose`)."""
+        out_headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in headers
+            if k.decode("latin-1").lower() not in _HOP_HEADERS
+        ]
+        out_headers.append((FORWARDED_HEADER, self._forward_token))
+        client = self._get_client()
+        request = client.build_request(method, owner + path_qs, headers=out_headers, content=body)
+        return await client.send(request, stream=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "self": self.self_url,
+            "nodes": self.ring.nodes,
+            "mode": self.mode,
+            "local": self.local,
+            "forwarded": self.forwarded,
+            "redirected": self.redirected,
+            "forward_errors": self.forward_errors,
+            "rejected_forwards": self.rejected_forwards,
+            "client_disconnects": self.client_disconnects,
+        }
+
+
+class ShardRoutingMiddleware:
+    """
+    Middleware ASGI: para las rutas con estado de sesión lee el body, obtiene
+    el `session_id` y, si el dueño es otro worker, reenvía o redirige. Si el
+    dueño es este worker, el body se reentrega intacto a la app.
+    """
+
+    def __init__(self, app, router: ShardRouter) -> None:
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.router.paths:
+            return await self.app(scope, receive, send)
+        headers = scope.get("headers") or []
+        forwarded = [v for k, v in headers if k.lower() == FORWARDED_HEADER.encode()]
+        if forwarded:
+            if len(forwarded) == 1 and self.router.is_forwarded(forwarded[0]):
+                self.router.local += 1
+                return await self.app(scope, receive, send)
+            # Header puesto por un cliente: se quita y el request se enruta como cualquier otro
+            self.router.rejected_forwards += 1
+            headers = [(k, v) for k, v in headers if k.lower() != FORWARDED_HEADER.encode()]
+            scope = {**scope, "headers": headers}
+
+        body = await _read_body(receive)
+        content_type = next((v.decode("latin-1") for k, v in headers if k.lower() == b"content-type"), "")
+        session_id = extract_session_id(content_type, body)
+        owner = self.router.owner(session_id) if session_id else self.router.self_url
+
+        if owner != self.router.self_url:
+            path_qs = scope.get("raw_path", scope["path"].encode()).decode("latin-1")
+            if scope.get("query_string"):
+                path_qs += "?" + scope["query_string"].decode("latin-1")
+            if self.router.mode == "redirect":
+                self.router.redirected += 1
+                return await _send_response(send, 307, [(b"location", (owner + path_qs).encode()), (OWNER_HEADER.encode(), owner.encode())], b"")
+            try:
+                resp = await self.router.forward(owner, scope["method"], path_qs, headers, body)
+            except httpx.HTTPError as e:
+                self.router.forward_errors += 1
+                logger.warning("[shard] dueño %s no disponible (%s); se atiende localmente", owner, e)
+            else:
+                self.router.forwarded += 1
+                out = [
+                    (k.encode("latin-1"), v.encode("latin-1"))
+                    for k, v in resp.headers.multi_items()
+                    if k.lower() not in _HOP_HEADERS
+                ]
+                out.append((OWNER_HEADER.encode(), owner.encode()))
+                try:
+                    await self._relay(resp, out, receive, send)
+                finally:
+                    await resp.aclose()
+                return
+
+        self.router.local += 1
+        await self.app(scope, _replay(body, receive), send)
+
+
+    async def _relay(self, resp: httpx.Response, headers: List[Tuple[bytes, bytes]], receive, send) -> None:
+        """
+        Retransmite la respuesta del dueño tal como llega (bytes crudos, sin
+        bufferizar) mientras escucha `http.disconnect`; si el cliente se va
+        primero se deja de leer y `aclose()` corta la conexión con el dueño.
+        """
+        await send({"type": "http.response.start", "status": resp.status_code, "headers": headers})
+
+        async def pump() -> None:
+            try:
+                async for chunk in resp.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            except httpx.HTTPError as e:
+                # Ya se enviaron los headers: solo queda cortar la respuesta
+                self.router.forward_errors += 1
+                logger.warning("[shard] se cortó la respuesta del dueño (%s)", e)
+                return
+            await send({"type": "http.response.body", "body": b""})
+
+        relay = asyncio.create_task(pump(), name="shard-relay")
+        watcher = asyncio.create_task(_wait_disconnect(receive), name="shard-disconnect")
+        try:
+            await asyncio.wait({relay, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not relay.done():
+                relay.cancel()
+                self.router.client_disconnects += 1
+            try:
+                await relay
+            except asyncio.CancelledError:
+                pass
+
+
+async def _wait_disconnect(receive) -> None:
+    """Consume `receive()` hasta `http.disconnect` (el body ya se leyó)."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _read_body(receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _replay(body: bytes, upstream):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Tras el body, el receive real: así se detecta cuando el cliente se desconecta
+        return await upstream()
+
+    return receive
+
+
+async def _send_response(send, status: int, headers: List[Tuple[bytes, bytes]], body: bytes) -> None:
+    headers = [*headers, (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_shard_router(settings) -> Optional[ShardRouter]:
+    """ShardRouter según la configuración, o None si hay un solo worker (sin SHARD_NODES)."""
+    nodes = [n.strip() for n in (settings.shard_nodes or "").split(",") if n.strip()]
+    if len(nodes) < 2:
+        return None
+    if not settings.shard_self:
+        raise ValueError("SHARD_SELF es obligatorio cuando se define SHARD_NODES")
+    if not settings.shard_secret:
+        raise ValueError("SHARD_SECRET es obligatorio cuando se define SHARD_NODES")
+    prefix = settings.api_prefix
+    return ShardRouter(
+        nodes,
+        settings.shard_self,
+        secret=settings.shard_secret,
+        mode=settings.shard_mode,
+        vnodes=settings.shard_vnodes,
+        forward_timeout_s=settings.shard_forward_timeout_s,
+        paths=(
+            f"{prefix}/agents/agent/",
+            f"{prefix}/agents/agent/stream/",
+            f"{prefix}/analizeimages/analyze-file/",
+            f"{prefix}/summary/summary/",
+        ),
+    )
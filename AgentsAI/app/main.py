@@ -1,19 +1,32 @@
 import uvicorn
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+import anyio.to_thread
 
 from app.core.config import settings
 from app.core.logging_config import LoggingConfig
 from app.services.azure_openai_client import azure_openai_client
-from app.api.v1.endpoints.agent import router as agent_router
+from app.api.v1.endpoints.agent import router as agent_router, ws_router as agent_ws_router
 from app.api.v1.endpoints.analyze_images import router as analyze_images_router
 from app.api.v1.endpoints.audio_to_text import router as audio_to_text_router
 from app.api.v1.endpoints.summary import router as summary_router
 from app.api.v1.endpoints.auth import router as auth_router
 from app.core.middleware import setup_middlewares
+from app.core import security
+from app.core.sharding import ShardRoutingMiddleware, create_shard_router
+from app.utils import session_store
+from app.utils.session_gate import session_gate
+from app.utils.session_events import session_events
+from app.utils.burst_coalescer import burst_coalescer
+from app.utils.idempotency import idempotency_store
+from app.utils.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected, cancellations
+from app.utils.deadline import deadline_stats
+from app.utils.transcript_cache import transcript_cache
+from app.utils.context_window import context_window
+from app.agents.manager_agent import run_stats as manager_run_stats
 from app.utils.response import unauthorized_response, success_response
 
 
@@ -62,7 +75,57 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-setup_middlewares(app, prod=not settings.debug)
+setup_middlewares(app, prod=not settings.debug, server_timing=settings.server_timing)
+
+# Afinidad de sesión: cada session_id se atiende en el worker dueño (SHARD_NODES)
+shard_router = create_shard_router(settings)
+if shard_router is not None:
+    app.add_middleware(ShardRoutingMiddleware, router=shard_router)
+
+
+def _threadpool_stats() -> dict:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "total": limiter.total_tokens,
+        "borrowed": limiter.borrowed_tokens,
+        "waiting": limiter.statistics().tasks_waiting,
+    }
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """Dimensiona el threadpool compartido de anyio según THREADPOOL_MAX_WORKERS."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_max_workers
+
+
+@app.on_event("startup")
+async def prefetch_signing_keys():
+    """Precarga el JWKS de Azure AD y arranca su refresco periódico."""
+    await security.key_store.prefetch()
+    security.key_store.start_background_refresh()
+
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    """Expira sesiones inactivas del backend en memoria (SESSION_IDLE_TTL_S)."""
+    session_store.start_session_sweeper()
+
+
+@app.on_event("shutdown")
+async def stop_signing_key_refresh():
+    await security.key_store.stop_background_refresh()
+
+
+@app.on_event("shutdown")
+async def stop_session_sweeper():
+    await session_store.stop_session_sweeper()
+    session_store.close_session_store()
+
+
+@app.on_event("shutdown")
+async def close_shard_router():
+    if shard_router is not None:
+        await shard_router.aclose()
 
 
 @app.exception_handler(HTTPException)
@@ -89,9 +152,16 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(status_code=exc.status_code, content=payload)
 
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    """El cliente ya no está: respuesta vacía 499 (solo queda en logs)."""
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
 # Include routers
 app.include_router(auth_router, prefix="/api/v1", tags=["Auth"])
 app.include_router(agent_router, prefix="/api/v1/agents", tags=["Agents"])
+app.include_router(agent_ws_router, prefix="/api/v1/agents", tags=["Agents"])
 app.include_router(analyze_images_router, prefix="/api/v1/analizeimages", tags=["IA services"])
 app.include_router(audio_to_text_router, prefix="/api/v1/audiototext", tags=["IA services"])
 app.include_router(summary_router, prefix="/api/v1/summary", tags=["IA services"])  
@@ -114,7 +184,38 @@ async def health_check():
         "status": "healthy", 
         "timestamp": datetime.now(timezone.utc).isoformat() + "Z", 
         "version": settings.version,
-        "environment": "development" if settings.debug else "production"
+        "environment": "development" if settings.debug else "production",
+    }
+
+
+@app.get("/health/details", tags=["Health"], dependencies=[Depends(security.get_token_payload)])
+async def health_details():
+    """
+    Diagnóstico interno (requiere Bearer): ocupación del threadpool y del cupo de
+    auth, sesiones, colas, cachés, deadlines, cancelaciones y topología de shards.
+    Se separa de /health para no exponerlo sin autenticación.
+    """
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+        "version": settings.version,
+        "threadpool": _threadpool_stats(),
+        "auth_threads": security.auth_limiter_stats(),
+        "sessions": session_store.session_store_stats(),
+        "session_gate": session_gate.stats(),
+        "session_events": session_events.stats(),
+        "burst": burst_coalescer.stats(),
+        "idempotency": idempotency_store.stats(),
+        "cancellations": cancellations.stats(),
+        "deadlines": {
+            "agent_s": settings.agent_deadline_s,
+            "analyze_s": settings.analyze_deadline_s,
+            **deadline_stats.stats(),
+        },
+        "transcripts": transcript_cache.stats(),
+        "context_window": context_window.stats(),
+        "manager_turns": manager_run_stats.stats(),
+        "sharding": shard_router.stats() if shard_router is not None else None,
     }
 
 
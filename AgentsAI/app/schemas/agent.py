@@ -15,6 +15,17 @@ class AgentRequest(BaseModel):
     mentor_gender: str = Field(..., description="Género del mentor (M/F)")
 
 
+class AgentProfile(BaseModel):
+    """Datos del estudiante que el canal WebSocket recibe una sola vez, al autenticarse"""
+    fullName: str = Field(..., description="Nombre completo del usuario")
+    nickname: str = Field(..., description="Apodo o alias")
+    idCard: str = Field(..., description="Cédula de identidad")
+    career: str = Field(..., description="Carrera académica")
+    email: str = Field(..., description="Correo electrónico")
+    student_gender: str = Field(..., description="Género del estudiante (M/F)")
+    mentor_gender: str = Field(..., description="Género del mentor (M/F)")
+
+
 class AgentResponse(BaseModel):
     """Response del agente conversacional"""
     session_id: str
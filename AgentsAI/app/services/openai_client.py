@@ -1,5 +1,6 @@
+import asyncio
 import os
-from openai import OpenAI
+from openai import APITimeoutError, OpenAI
 from typing import Optional
 from app.core.config import settings
 
@@ -17,7 +18,13 @@ class OpenAIClient:
         
         self.client = OpenAI(api_key=self.api_key)
     
-    async def vector_search(self, query: str, vector_store_id: str, max_num_results: int = 2) -> list:
+    async def vector_search(
+        self,
+        query: str,
+        vector_store_id: str,
+        max_num_results: int = 2,
+        timeout: Optional[float] = None,
+    ) -> list:
         """
         Perform vector search
         
@@ -25,17 +32,23 @@ class OpenAIClient:
             query: Search query
             vector_store_id: ID of the vector store to search in
             top_k: Number of top results to return
+            timeout: Seconds for the HTTP call (None = client default)
             
         Returns:
             List of search results
         """
+        options = {} if timeout is None else {"timeout": timeout, "max_retries": 0}
         try:
-            response = self.client.vector_stores.search(
+            # El cliente es síncrono: en un hilo para no bloquear el event loop
+            response = await asyncio.to_thread(
+                self.client.with_options(**options).vector_stores.search,
                 query=query,
                 vector_store_id=vector_store_id,
                 max_num_results=max_num_results
             )
             return response.data
+        except APITimeoutError as e:
+            raise TimeoutError(f"Vector search timed out: {str(e)}") from e
         except Exception as e:
             raise Exception(f"Error performing vector search: {str(e)}")
 
@@ -0,0 +1,139 @@
+# app/utils/burst_coalescer.py
+"""
+Coalescencia de ráfagas de mensajes por sesión (debounce).
+
+Los estudiantes suelen escribir "hola", "tengo una pregunta" y la pregunta
+real en pocos segundos; sin esto cada mensaje es una corrida completa del
+Manager. Con una ventana `window_s` > 0:
+
+- El primer mensaje de una sesión abre una ráfaga y espera `window_s`.
+- Cada mensaje que llega dentro de la ventana se suma a la ráfaga y reinicia
+  la espera (sin pasar de `max_wait_s` desde el primero).
+- Al cerrarse, los mensajes se unen (uno por línea) en una sola corrida y
+  todos los requests pendientes reciben la misma respuesta.
+
+La corrida se ejecuta en su propia tarea: si un cliente se desconecta, el
+resto de la ráfaga no se pierde; si se desconectan todos, la corrida se
+cancela. Con `window_s` = 0 está desactivado.
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Set, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+@dataclass
+class BurstResult(Generic[T]):
+    value: T
+    merged: int   # mensajes unidos en la corrida (1 = sin ráfaga)
+
+
+class _Burst:
+    __slots__ = ("prompts", "future", "deadline", "first_at", "waiters", "task")
+
+    def __init__(self, future: asyncio.Future, now: float) -> None:
+        self.prompts: List[str] = []
+        self.future = future
+        self.first_at = now
+        self.deadline = now
+        self.waiters = 0   # requests que aún esperan el resultado
+        self.task: Optional[asyncio.Task] = None
+
+
+class BurstCoalescer:
+    """Debounce por `session_id`. Usar desde el event loop."""
+
+    def __init__(self, window_s: float = 0.0, max_wait_s: Optional[float] = None) -> None:
+        self.window_s = window_s
+        self.max_wait_s = max_wait_s if max_wait_s is not None else 3 * window_s
+        self._open: Dict[str, _Burst] = {}
+        self._tasks: Set[asyncio.Task] = set()   # referencia fuerte a las corridas en curso
+
+        # Métricas
+        self.bursts = 0
+        self.messages = 0
+        self.cancelled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_s > 0
+
+    async def submit(
+        self,
+        session_id: str,
+        prompt: str,
+        fn: Callable[[str], Awaitable[T]],
+    ) -> BurstResult[T]:
+        """
+        Suma `prompt` a la ráfaga abierta de la sesión (o abre una) y espera el
+        resultado de `fn(prompts_unidos)`. `fn` es la del primer request de la ráfaga.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.messages += 1
+
+        burst = self._open.get(session_id)
+        if burst is None:
+            future: asyncio.Future = loop.create_future()
+            # Evita "Future exception was never retrieved" si todos se desconectaron
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            burst = self._open[session_id] = _Burst(future, now)
+            self.bursts += 1
+            task = burst.task = asyncio.create_task(self._fire(session_id, burst, fn), name="agent-burst")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        burst.prompts.append(prompt)
+        burst.deadline = min(now + self.window_s, burst.first_at + self.max_wait_s)
+        burst.waiters += 1
+        try:
+            value = await asyncio.shield(burst.future)
+        except asyncio.CancelledError:
+            # Nadie espera ya la respuesta: se cancela la corrida (y su commit)
+            if burst.waiters == 1 and burst.task is not None and not burst.task.done():
+                burst.task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            burst.waiters -= 1
+        return BurstResult(value, len(burst.prompts))
+
+    async def _fire(self, session_id: str, burst: _Burst, fn: Callable[[str], Awaitable[Any]]) -> None:
+        loop = asyncio.get_running_loop()
+        while (wait := burst.deadline - loop.time()) > 0:
+            await asyncio.sleep(wait)
+        # Se cierra antes de ejecutar: lo que llegue ahora abre la siguiente ráfaga
+        if self._open.get(session_id) is burst:
+            del self._open[session_id]
+        try:
+            value = await fn("\n".join(burst.prompts))
+        except asyncio.CancelledError:
+            burst.future.cancel()
+            raise
+        except Exception as error:  # se entrega a todos los que esperan
+            burst.future.set_exception(error)
+        else:
+            burst.future.set_result(value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": int(self.window_s * 1000),
+            "open": len(self._open),
+            "bursts": self.bursts,
+            "messages": self.messages,
+            "runs_saved": self.messages - self.bursts,
+            "cancelled": self.cancelled,
+        }
+
+
+def _from_settings() -> BurstCoalescer:
+    return BurstCoalescer(window_s=settings.agent_debounce_ms / 1000)
+
+
+# Instancia compartida del proceso
+burst_coalescer = _from_settings()
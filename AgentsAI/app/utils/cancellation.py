@@ -0,0 +1,91 @@
+# app/utils/cancellation.py
+"""
+Cancelación cooperativa del trabajo de un request cuando el cliente se desconecta.
+
+Si el estudiante cierra el chat (o el backend que llama se rinde por timeout),
+seguir esperando al Manager o a Azure solo gasta tokens y cupos de
+concurrencia. `cancel_on_disconnect` ejecuta el trabajo en su propia tarea y
+escucha `http.disconnect` en paralelo; si llega primero:
+
+- cancela la tarea (el `CancelledError` se propaga por el SDK/httpx y corta
+  la llamada en curso),
+- las escrituras de sesión pendientes se descartan (`session_batch` no hace
+  commit si el bloque termina con excepción),
+- suma el request al contador por endpoint y lanza `ClientDisconnected`
+  (el handler de la app responde 499, que nadie va a leer).
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Dict, TypeVar
+
+from fastapi import Request
+
+T = TypeVar("T")
+
+# Código de "client closed request" (nginx): solo queda en logs/métricas
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de recibir la respuesta."""
+
+    def __init__(self, endpoint: str) -> None:
+        super().__init__(f"cliente desconectado ({endpoint})")
+        self.endpoint = endpoint
+
+
+class CancellationStats:
+    """Trabajo cancelado por desconexión del cliente, por endpoint."""
+
+    def __init__(self) -> None:
+        self.by_endpoint: Dict[str, int] = {}
+
+    def record(self, endpoint: str) -> None:
+        self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cancelled": sum(self.by_endpoint.values()),
+            "by_endpoint": dict(self.by_endpoint),
+        }
+
+
+# Instancia compartida del proceso
+cancellations = CancellationStats()
+
+
+async def _wait_disconnect(request: Request) -> None:
+    """Consume `receive()` hasta `http.disconnect` (el body ya fue leído por FastAPI)."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[T], *, endpoint: str) -> T:
+    """
+    Espera `work`; si el cliente se desconecta antes, lo cancela, registra la
+    cancelación y lanza `ClientDisconnected`.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(_wait_disconnect(request), name=f"disconnect-{endpoint}")
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()  # el propio handler se canceló (apagado del servidor)
+        raise
+    finally:
+        watcher.cancel()
+
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass  # terminó con error justo al cancelarse: el cliente ya no está
+        cancellations.record(endpoint)
+        raise ClientDisconnected(endpoint)
+    return task.result()
@@ -0,0 +1,203 @@
+# app/utils/context_window.py
+"""
+Ventana de contexto con presupuesto de tokens para el prompt del Manager.
+
+- Mientras el transcript completo quepa en `token_budget`, se envía tal cual.
+- Si no cabe: los últimos `recent_messages` mensajes van siempre literales y
+  los anteriores se reemplazan por un resumen acumulado (`ResumenPrevio:`).
+- El resumen se cachea por sesión y se regenera en segundo plano (nunca en el
+  camino del request) cuando quedan `stale_messages` o más mensajes fuera de
+  la ventana reciente sin resumir. Es incremental: resumen anterior + mensajes
+  nuevos → resumen nuevo.
+- Mientras el resumen se pone al día, los mensajes aún no resumidos van
+  literales desde el más reciente hasta agotar el presupuesto.
+
+El tamaño del prompt (y la latencia del Manager) queda acotado sin importar
+cuán larga sea la conversación. Los tokens se estiman como caracteres / 4.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.services.azure_openai_client import azure_openai_client
+from app.utils.transcript_cache import estimate_tokens, render_line
+
+logger = logging.getLogger(__name__)
+
+# Firma: (resumen_anterior, mensajes_nuevos) -> resumen_nuevo
+Summarizer = Callable[[str, List[Mapping[str, str]]], Awaitable[str]]
+
+
+async def summarize_turns(previous: str, messages: List[Mapping[str, str]]) -> str:
+    """Resumen acumulado con Azure OpenAI (mismo deployment que /summary)."""
+    turns = "".join(render_line(m) for m in messages)
+    resp = await azure_openai_client().chat.completions.create(
+        model=settings.azure_openai_deployment_chat,
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Eres un asistente que mantiene un resumen acumulado de un chat entre un "
+                    "estudiante y su mentor(a) de la UDLA. Integra el resumen anterior con los "
+                    "mensajes nuevos en un solo párrafo breve (máximo 120 palabras). Conserva: "
+                    "el caso o trámite en curso, documentos pedidos o subidos, fechas, decisiones, "
+                    "escalamientos (--mentor--) y cuántas veces el estudiante insistió en lo mismo. "
+                    "Devuelve solo el resumen, sin HTML."
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Resumen anterior:\n{previous or '(vacío)'}\n\nMensajes nuevos:\n{turns}",
+            },
+        ],
+        temperature=0.2,
+        max_tokens=300,
+    )
+    return (resp.choices[0].message.content or "").strip().replace("\n", " ")
+
+
+class _RollingSummary:
+    __slots__ = ("text", "covered", "last", "task")
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.covered = 0   # mensajes del historial incluidos en `text`
+        self.last: Optional[Mapping[str, str]] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class ContextWindow:
+    """Recorta el transcript al presupuesto de tokens usando resúmenes por sesión."""
+
+    def __init__(
+        self,
+        token_budget: int = 4000,
+        recent_messages: int = 12,
+        stale_messages: int = 8,
+        summarizer: Optional[Summarizer] = None,
+        max_entries: int = 2048,
+    ) -> None:
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.stale_messages = stale_messages
+        self.summarizer: Summarizer = summarizer or summarize_turns
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _RollingSummary]" = OrderedDict()
+
+        # Métricas
+        self.full = 0
+        self.compacted = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def window(
+        self, session_id: str, history: Sequence[Mapping[str, str]], transcript_tokens: int
+    ) -> Tuple[str, int]:
+        """
+        Devuelve (resumen, inicio): el Manager recibe `resumen` (vacío si no hace
+        falta) y `history[inicio:]` literal. `transcript_tokens` es el tamaño del
+        transcript completo (cacheado por TranscriptCache), así que el caso común cuesta O(1).
+        """
+        if not self.token_budget or transcript_tokens <= self.token_budget:
+            self.full += 1
+            return "", 0
+        self.compacted += 1
+
+        n = len(history)
+        cut = max(0, n - self.recent_messages)
+        entry = self._entry(session_id, history)
+
+        if cut - entry.covered >= self.stale_messages and (entry.task is None or entry.task.done()):
+            self._schedule(session_id, entry, list(history[entry.covered:cut]), cut)
+
+        remaining = self.token_budget - estimate_tokens(self.summary_line(entry.text))
+        start = n
+        for i in range(n - 1, entry.covered - 1, -1):
+            cost = estimate_tokens(render_line(history[i]))
+            if i < cut and cost > remaining:
+                break  # mensajes viejos aún sin resumir que ya no caben
+            start = i
+            remaining -= cost
+        return entry.text, start
+
+    @staticmethod
+    def summary_line(summary: str) -> str:
+        return f"ResumenPrevio: {summary}\n" if summary else ""
+
+    def _entry(self, session_id: str, history: Sequence[Mapping[str, str]]) -> _RollingSummary:
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            self._entries.move_to_end(session_id)
+            valid = entry.covered <= len(history) and (
+                not entry.covered or history[entry.covered - 1] == entry.last
+            )
+            if valid:
+                return entry
+            if entry.task is not None:
+                entry.task.cancel()  # el historial cambió (reinicio): el resumen ya no aplica
+        entry = self._entries[session_id] = _RollingSummary()
+        while len(self._entries) > self.max_entries:
+            _, old = self._entries.popitem(last=False)
+            if old.task is not None:
+                old.task.cancel()
+        return entry
+
+    def _schedule(
+        self,
+        session_id: str,
+        entry: _RollingSummary,
+        new_messages: List[Mapping[str, str]],
+        cut: int,
+    ) -> None:
+        previous = entry.text
+        last = new_messages[-1]
+
+        async def regenerate() -> None:
+            try:
+                text = await self.summarizer(previous, new_messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.summary_errors += 1
+                logger.exception("[context] no se pudo regenerar el resumen de la sesión")
+                return
+            if self._entries.get(session_id) is entry and text:
+                entry.text, entry.covered, entry.last = text, cut, last
+                self.summaries += 1
+
+        # Contexto vacío: la tarea sobrevive al request y no debe arrastrar sus ContextVars
+        # (deadline, Server-Timing, uso de tokens del turno que la disparó)
+        entry.task = asyncio.create_task(regenerate(), name="context-summary", context=contextvars.Context())
+
+    def discard(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None and entry.task is not None:
+            entry.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "token_budget": self.token_budget,
+            "recent_messages": self.recent_messages,
+            "sessions": len(self._entries),
+            "full": self.full,
+            "compacted": self.compacted,
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+        }
+
+
+def _from_settings() -> ContextWindow:
+    return ContextWindow(
+        token_budget=settings.context_token_budget,
+        recent_messages=settings.context_recent_messages,
+        stale_messages=settings.context_stale_messages,
+    )
+
+
+# Instancia compartida del proceso
+context_window = _from_settings()
@@ -0,0 +1,235 @@
+# app/utils/conversation_state.py
+"""
+Estado explícito de la conversación de una sesión (máquina de estados).
+
+Antes el flujo se deducía releyendo el transcript en cada turno (número de
+interacción, si ya se pidió o subió el certificado, insistencias) y con
+etiquetas sueltas en los documentos de la sesión (`ocr_notified`,
+`caso_cerrado`). Ahora es un `ConversationState` tipado que se guarda como
+una parte más de la sesión (`state`) y se actualiza de forma determinística:
+
+- `user_turn(prompt, case)`   mensaje nuevo del estudiante (caso e insistencias),
+- `assistant_turn(reply)`     respuesta enviada (interacción, escalamiento, pedido de documento,
+                              respuesta repetida),
+- `document(ocr)`             resultado de /analyze-file/ (`set_ocr_result`),
+- `on(evento)`                transición de fase según `_TRANSITIONS`.
+
+Fases:
+  inicio → caso_abierto → certificado_pedido → certificado_recibido
+         → ocr_notificado → cerrado;  cualquier fase → escalado (--mentor--).
+
+El Manager recibe el estado en una sola línea (`prompt_line`) y el endpoint
+resuelve sin LLM las transiciones ya decididas (notificar el OCR, cierre,
+tercera insistencia).
+
+Insistencia: el estudiante repite lo mismo si escribe de nuevo exactamente el
+mismo pedido (normalizado) o si vuelve a escribir después de que el mentor le
+dio dos veces seguidas la misma respuesta. Hablar del mismo caso con otras
+palabras no cuenta, y las confirmaciones cortas ("sí", "ok", "gracias") no
+suman ni reinician la cuenta. Las sesiones guardadas antes de existir esta parte se
+migran una vez con `derive` desde el historial y las etiquetas antiguas.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+# Fases
+INICIO = "inicio"
+CASO_ABIERTO = "caso_abierto"
+CERTIFICADO_PEDIDO = "certificado_pedido"
+CERTIFICADO_RECIBIDO = "certificado_recibido"
+OCR_NOTIFICADO = "ocr_notificado"
+CERRADO = "cerrado"
+ESCALADO = "escalado"
+
+# Eventos
+EV_CASO = "caso"                       # el mensaje se clasificó como un caso de justificación
+EV_PIDE_DOCUMENTO = "pide_documento"   # la respuesta pidió el documento del caso
+EV_DOCUMENTO = "documento"             # /analyze-file/ procesó un documento
+EV_OCR_NOTIFICADO = "ocr_notificado"   # se respondió con el resultado del OCR
+EV_CIERRE = "cierre"                   # agradecimiento/cierre tras notificar el OCR
+EV_ESCALAMIENTO = "escalamiento"       # respuesta --mentor--
+
+# (fase, evento) -> fase siguiente; un par que no está deja la fase igual
+_TRANSITIONS: Dict[Tuple[str, str], str] = {
+    **{(fase, EV_CASO): CASO_ABIERTO for fase in (INICIO, CASO_ABIERTO, OCR_NOTIFICADO, CERRADO, ESCALADO)},
+    (INICIO, EV_PIDE_DOCUMENTO): CERTIFICADO_PEDIDO,
+    (CASO_ABIERTO, EV_PIDE_DOCUMENTO): CERTIFICADO_PEDIDO,
+    **{(fase, EV_DOCUMENTO): CERTIFICADO_RECIBIDO for fase in (
+        INICIO, CASO_ABIERTO, CERTIFICADO_PEDIDO, CERTIFICADO_RECIBIDO, OCR_NOTIFICADO, CERRADO, ESCALADO,
+    )},
+    (CERTIFICADO_RECIBIDO, EV_OCR_NOTIFICADO): OCR_NOTIFICADO,
+    (OCR_NOTIFICADO, EV_CIERRE): CERRADO,
+    (CERRADO, EV_CIERRE): CERRADO,
+    **{(fase, EV_ESCALAMIENTO): ESCALADO for fase in (
+        INICIO, CASO_ABIERTO, CERTIFICADO_PEDIDO, CERTIFICADO_RECIBIDO, OCR_NOTIFICADO, CERRADO,
+    )},
+}
+
+# A la tercera vez seguida que el estudiante insiste en lo mismo se escala al mentor
+INSISTENCIA_MAX = 3
+
+# Mensajes formados solo por estas palabras son confirmaciones: no cuentan como insistencia
+_CONFIRMATIONS = frozenset({
+    "si", "sí", "no", "ok", "okay", "oki", "vale", "listo", "lista", "claro", "bueno", "dale",
+    "ya", "perfecto", "entendido", "entiendo", "de", "acuerdo", "gracias", "muchas", "mil",
+    "hola", "buenos", "buenas", "dias", "días", "tardes", "noches", "por", "favor", "porfa",
+})
+
+# Etiquetas que antes guardaban parte de este estado en los documentos de la sesión
+LEGACY_TAGS = frozenset({"ocr_notified", "caso_cerrado"})
+
+_NO_CASE = ("", "desconocido")
+_NORMALIZE = re.compile(r"[^\w]+")
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE.sub(" ", text.lower()).strip()
+
+
+def _fingerprint(text: str) -> str:
+    """Huella corta del texto normalizado (pedido del estudiante o respuesta del mentor)."""
+    return hashlib.blake2b(_normalize(text).encode("utf-8"), digest_size=6).hexdigest()
+
+
+def _is_confirmation(prompt: str) -> bool:
+    words = _normalize(prompt).split()
+    return all(w in _CONFIRMATIONS for w in words)
+
+
+@dataclass(frozen=True)
+class ConversationState:
+    """Estado de la conversación; inmutable (cada transición devuelve uno nuevo)."""
+    phase: str = INICIO
+    interaction: int = 0        # respuestas del mentor ya enviadas
+    case: str = ""              # último caso de justificación clasificado
+    certificate: str = ""       # tipo del último documento analizado
+    validated: bool = False     # el documento justifica la falta
+    topic: str = ""             # huella del último pedido del estudiante (sin confirmaciones)
+    insistence: int = 0         # veces seguidas que el estudiante repite lo mismo
+    reply: str = ""             # huella de la última respuesta del mentor
+    looping: bool = False       # las dos últimas respuestas del mentor fueron iguales
+
+    # -------- Transiciones --------
+    def on(self, event: str) -> "ConversationState":
+        return replace(self, phase=_TRANSITIONS.get((self.phase, event), self.phase))
+
+    def user_turn(self, prompt: str, case: Optional[Mapping[str, Any]] = None) -> "ConversationState":
+        kind = case["case"] if case else ""
+        state = self
+        if not _is_confirmation(prompt):
+            topic = _fingerprint(prompt)
+            repeated = topic == self.topic or self.looping
+            state = replace(self, topic=topic, insistence=self.insistence + 1 if repeated else 1)
+        if kind in _NO_CASE or (kind == self.case and self.certificate):
+            return state  # el mismo caso ya con documento no reabre la conversación
+        return replace(state, case=kind).on(EV_CASO)
+
+    def assistant_turn(self, reply: str, *, asks_document: bool = False) -> "ConversationState":
+        fingerprint = _fingerprint(reply)
+        state = replace(
+            self,
+            interaction=self.interaction + 1,
+            reply=fingerprint,
+            looping=fingerprint == self.reply,
+        )
+        if "--mentor--" in reply:
+            return state.on(EV_ESCALAMIENTO)
+        if asks_document:
+            return state.on(EV_PIDE_DOCUMENTO)
+        return state
+
+    def document(self, ocr: Mapping[str, Any]) -> "ConversationState":
+        return replace(
+            self,
+            certificate=ocr.get("certificate") or "",
+            validated=ocr.get("escalated") == "justificado",
+        ).on(EV_DOCUMENTO)
+
+    # -------- Consultas --------
+    @property
+    def insisting(self) -> bool:
+        return self.insistence >= INSISTENCIA_MAX
+
+    def prompt_line(self) -> str:
+        """Estado compacto para el Manager (una línea, va con los metadatos del turno)."""
+        parts = [f"fase={self.phase}", f"interaccion={self.interaction + 1}"]
+        if self.case:
+            parts.append(f"caso={self.case}")
+        if self.certificate:
+            parts.append(f"documento={self.certificate}{' (validado)' if self.validated else ''}")
+        if self.insistence > 1:
+            parts.append(f"insistencia={self.insistence}")
+        return "EstadoSesion: " + ", ".join(parts)
+
+    # -------- Serialización (parte `state` de la sesión) --------
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ConversationState":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def derive(
+    history: Sequence[Mapping[str, str]],
+    docs: Iterable[str],
+    ocr: Optional[Mapping[str, Any]],
+) -> ConversationState:
+    """
+    Estado de una sesión guardada sin la parte `state` (migración): se deduce
+    una sola vez del historial y de las etiquetas antiguas de documentos.
+    """
+    docs = set(docs)
+    interaction = 0
+    replies = []
+    for m in history:
+        if m["role"] == "assistant":
+            interaction += 1
+            replies.append(m["content"])
+    last_reply = replies[-1] if replies else ""
+
+    # Insistencia: mensajes seguidos del estudiante con el mismo texto al final del historial
+    topic, insistence = "", 0
+    for m in reversed(history):
+        if m["role"] == "system":
+            break
+        if m["role"] != "user" or _is_confirmation(m["content"]):
+            continue
+        current = _fingerprint(m["content"])
+        if topic and current != topic:
+            break
+        topic, insistence = current, insistence + 1
+
+    if "caso_cerrado" in docs:
+        phase = CERRADO
+    elif ocr and "ocr_notified" in docs:
+        phase = OCR_NOTIFICADO
+    elif ocr:
+        phase = CERTIFICADO_RECIBIDO
+    elif "--mentor--" in last_reply:
+        phase = ESCALADO
+    else:
+        phase = INICIO
+
+    return ConversationState(
+        phase=phase,
+        interaction=interaction,
+        certificate=(ocr or {}).get("certificate", "") or "",
+        validated=bool(ocr and ocr.get("escalated") == "justificado"),
+        topic=topic,
+        insistence=insistence,
+        reply=_fingerprint(last_reply) if replies else "",
+        looping=len(replies) > 1 and _fingerprint(replies[-1]) == _fingerprint(replies[-2]),
+    )
+
+
+def state_of(snapshot: Any) -> ConversationState:
+    """`ConversationState` de un `SessionSnapshot` (lo deduce si la sesión aún no lo tiene)."""
+    if snapshot.state is not None:
+        return ConversationState.from_dict(snapshot.state)
+    return derive(snapshot.messages, snapshot.docs, snapshot.ocr)
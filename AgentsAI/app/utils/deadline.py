@@ -0,0 +1,89 @@
+# app/utils/deadline.py
+"""
+Presupuesto de tiempo (deadline) por request, propagado a herramientas y llamadas.
+
+El endpoint fija el deadline con `request_deadline(segundos)`; queda en un
+ContextVar, así que lo heredan las tareas que se crean dentro (el Runner del
+Agents SDK, sus herramientas, la corrida de una ráfaga). Cada dependencia
+lenta toma solo lo que queda:
+
+- `budget(cap)`: segundos para la próxima llamada (`cap` acotado por lo que
+  queda); sirve como `timeout=` de clientes síncronos (requests, OpenAI).
+- `bounded(stage, cap)`: acota un bloque async; si se agota lanza
+  `TimeoutError` y lo cuenta por etapa. Quien llama responde con su texto
+  de respaldo.
+
+Así la latencia de un turno queda acotada por configuración aunque Azure,
+el vector store o Banner se cuelguen. Sin deadline (0), todo se comporta
+como antes.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+# Instante límite (time.monotonic) del request en curso
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineStats:
+    """Etapas que agotaron el presupuesto y respondieron con su texto de respaldo."""
+
+    def __init__(self) -> None:
+        self.by_stage: Dict[str, int] = {}
+
+    def record(self, stage: str) -> None:
+        self.by_stage[stage] = self.by_stage.get(stage, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exceeded": sum(self.by_stage.values()),
+            "by_stage": dict(self.by_stage),
+        }
+
+
+# Instancia compartida del proceso
+deadline_stats = DeadlineStats()
+
+
+@contextmanager
+def request_deadline(budget_s: float) -> Iterator[None]:
+    """Fija el deadline del request (`budget_s` <= 0: sin deadline). Nunca lo extiende."""
+    if budget_s <= 0:
+        yield
+        return
+    at = time.monotonic() + budget_s
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Segundos que quedan del deadline (None si el request no tiene)."""
+    at = _deadline.get()
+    return None if at is None else max(0.0, at - time.monotonic())
+
+
+def budget(cap: Optional[float] = None) -> Optional[float]:
+    """Tiempo para la próxima llamada: `cap` acotado por lo que queda (None = sin límite)."""
+    left = remaining()
+    if left is None:
+        return cap
+    return left if cap is None else min(cap, left)
+
+
+@asynccontextmanager
+async def bounded(stage: str, cap: Optional[float] = None) -> AsyncIterator[None]:
+    """Acota el bloque a `budget(cap)`; si se agota, lo cuenta y lanza `TimeoutError`."""
+    try:
+        async with asyncio.timeout(budget(cap)):
+            yield
+    except TimeoutError:
+        deadline_stats.record(stage)
+        raise
@@ -1,10 +1,18 @@
 # app/utils/dep_agents.py
 
-from typing import Callable, Awaitable
-from app.agents.manager_agent import run_manager
+from typing import AsyncIterator, Callable, Awaitable
+from app.agents.manager_agent import run_manager, stream_manager
 
-def get_manager() -> Callable[[str], Awaitable[str]]:
+def get_manager() -> Callable[..., Awaitable[str]]:
     """
-    Dependencia que provee la función para ejecutar el Manager.
+    Dependencia que provee la función para ejecutar el Manager:
+    `run(input: ManagerInput, intent: str = "general") -> str`.
     """
     return run_manager
+
+
+def get_manager_stream() -> Callable[..., AsyncIterator[str]]:
+    """
+    Dependencia que provee el Manager en modo streaming (fragmentos de texto).
+    """
+    return stream_manager
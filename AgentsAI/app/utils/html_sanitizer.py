@@ -0,0 +1,258 @@
+# app/utils/html_sanitizer.py
+"""
+Saneamiento del HTML que genera el LLM, en una sola pasada y por fragmentos.
+
+Un tokenizador compilado recorre el texto una vez y reconoce:
+- fences de markdown (```html / ```): se eliminan,
+- "<pTexto" (tag malformado): se corrige a "<p>Texto"; <p …> pierde sus atributos,
+- <script>…</script>: se elimina completo (sin cierre, hasta el final),
+- tags: solo pasan los de la lista permitida (<p>, <br>, <a> y sus cierres);
+  <a> conserva solo href (http, https o mailto), target y rel, y los demás
+  pierden sus atributos; el resto de tags se descarta (su texto queda),
+- texto: todo "<" que no abre un tag reconocido (p. ej. un tag sin ">" al final)
+  sale como "&lt;", así el navegador nunca lo interpreta como tag.
+
+Modo de salida (igual que el saneador original del endpoint del agente):
+- "html": la respuesta trae <p>; se devuelve tal cual (con lo anterior aplicado).
+- "text": texto plano; cada bloque separado por una línea en blanco va en <p>
+  y los saltos simples se convierten en <br>.
+
+`sanitize_html(texto)` es la versión por lotes (el modo se decide viendo todo el
+texto). `StreamingHtmlSanitizer` hace lo mismo incrementalmente: `feed(delta)`
+devuelve lo que ya es definitivo y retiene la cola que aún podría cambiar (un tag
+sin cerrar, backticks de un posible fence, un <script> abierto, espacios finales).
+En streaming el modo se decide con el primer contenido (<p> → "html"); para las
+respuestas que empiezan con <p> o no lo usan, el resultado es idéntico al de lotes.
+"""
+from __future__ import annotations
+
+import html
+import re
+from typing import List, Optional
+
+_TOKEN = re.compile(
+    r"[^<`]+|[<`](?![a-zA-Z/`])"  # texto: se recorre en C y el bucle lo salta
+    r"|(?P<fence>```(?:html)?)"
+    r"|(?P<script>(?is:<script[^>]*>.*?(?:</script>|\Z)))"
+    r"|(?P<pattrs><p\s[^>]*>)"
+    r"|(?P<pfix><p(?=[^>]))"
+    r"|(?P<allowed>(?i:</?(?:p|br|a)(?![a-zA-Z0-9])[^>]*>))"
+    r"|(?P<tag></?[a-zA-Z][^>]*>)"
+)
+_PARAGRAPH = re.compile(r"<p(?=.)", re.DOTALL)
+_SCRIPT_BLOCK = re.compile(r"<script[^>]*>.*?</script>", re.IGNORECASE | re.DOTALL)
+# Tag permitido: (cierre, nombre, atributos)
+_ALLOWED_TAG = re.compile(r"<(/?)(p|br|a)(.*)>", re.IGNORECASE | re.DOTALL)
+# Atributo con valor entre comillas dobles, simples, sin comillas o sin valor
+_ATTR = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+_LINK_ATTRS = ("href", "target", "rel")
+_LINK_SCHEMES = ("http:", "https:", "mailto:")
+# Caracteres que el navegador ignora dentro de una URL (permiten "java\tscript:")
+_URL_IGNORED = re.compile(r"[\x00-\x20\x7f]+")
+# Texto plano: tramo de espacios con una línea en blanco (separa párrafos)
+_PARAGRAPH_BREAK = re.compile(r"\s*\n\n\s*")
+
+# Retención en streaming
+_TAG_PREFIX = re.compile(r"<(?:/?(?:[a-zA-Z][^>]*)?)?\Z")
+_SCRIPT_OPEN = re.compile(r"<script[^>]*>", re.IGNORECASE)
+_SCRIPT_CLOSE = re.compile(r"</script>", re.IGNORECASE)
+_FENCE_PREFIXES = ("```htm", "```ht", "```h", "```", "``", "`")  # el más largo primero
+
+HTML = "html"
+TEXT = "text"
+
+
+def sanitize_html(text: Optional[str]) -> str:
+    """
+    Sanitiza la salida del LLM permitiendo tags seguros: <p>, </p>, <br>, <a>.
+    Previene ataques XSS pero permite HTML que el LLM genera intencionalmente.
+
+    Si el LLM devuelve HTML válido (con <p>, <a>, etc.), lo respeta.
+    Si devuelve texto plano, lo convierte a HTML simple.
+    """
+    if text is None:
+        return "<p></p>"
+    t = str(text)
+    sanitizer = StreamingHtmlSanitizer(mode=HTML if _has_paragraph(t) else TEXT)
+    sanitizer._pending = t
+    return sanitizer.close()
+
+
+def _has_paragraph(text: str) -> bool:
+    """¿La respuesta trae <p> (o "<pTexto")? Decide el modo de la versión por lotes."""
+    if "<p" not in text:
+        return False
+    if _SCRIPT_OPEN.search(text):
+        text = _SCRIPT_BLOCK.sub("", text)
+    return _PARAGRAPH.search(text) is not None
+
+
+class StreamingHtmlSanitizer:
+    """Sanea HTML incrementalmente: `feed(delta)` devuelve lo que ya es seguro emitir."""
+
+    def __init__(self, mode: Optional[str] = None) -> None:
+        self._pending = ""        # texto recibido aún no tokenizado
+        self._mode = mode         # HTML | TEXT (None: se decide con el primer contenido)
+        self._gap = ""            # espacios/saltos retenidos (su salida depende de lo que siga)
+        self._started = False     # html: ya hubo contenido; los espacios dejan de ser iniciales
+        self._open_p = False      # text: hay un <p> abierto
+        self._emitted = False
+
+    def feed(self, delta: str) -> str:
+        self._pending += delta
+        return self._drain(final=False)
+
+    def close(self) -> str:
+        out = self._drain(final=True)
+        if self._mode == TEXT and self._open_p:
+            out += "</p>"
+            self._open_p = False
+        self._gap = ""
+        if not self._emitted and not out:
+            out = "<p></p>"
+        self._emitted = True
+        return out
+
+    # -------- Internos --------
+    def _drain(self, final: bool) -> str:
+        text = self._pending
+        cut = len(text) if final else self._safe_cut(text)
+        self._pending = text[cut:]
+
+        out: List[str] = []
+        pos = 0
+        for m in _TOKEN.finditer(text, 0, cut):
+            kind = m.lastgroup
+            if kind is None:
+                continue
+            if m.start() > pos:
+                self._text(text[pos:m.start()], out)
+            if kind == "allowed":
+                raw = m.group()
+                self._content(_allowed_tag(raw), out, paragraph=raw == "<p>")
+            elif kind == "tag":
+                self._barrier(out)
+            elif kind == "pfix" or kind == "pattrs":
+                self._content("<p>", out, paragraph=True)
+            elif kind == "script":
+                self._barrier(out)
+            pos = m.end()
+        if pos < cut:
+            self._text(text[pos:cut], out)
+
+        chunk = "".join(out)
+        if chunk:
+            self._emitted = True
+        return chunk
+
+    def _safe_cut(self, text: str) -> int:
+        """Posición hasta la que el texto ya no puede cambiar con lo que falta por llegar."""
+        cut = len(text)
+        # Todo lo que esté dentro de <script> se retiene hasta su cierre
+        for opened in _SCRIPT_OPEN.finditer(text):
+            if _SCRIPT_CLOSE.search(text, opened.end()) is None:
+                cut = opened.start()
+                break
+        # Tag sin cerrar antes del corte ("<pTexto" ya es definitivo). Se busca después
+        # del <script>: en "<a href=…<script>" el <a …> sigue abierto y no es texto.
+        head = text[:cut]
+        lt = head.find("<", head.rfind(">") + 1)
+        while lt != -1:
+            if _TAG_PREFIX.match(head, lt) and not _is_pfix(head, lt):
+                cut = lt
+                break
+            lt = head.find("<", lt + 1)
+        if "`" in text[max(0, cut - 7):cut]:
+            for prefix in _FENCE_PREFIXES:
+                if text.endswith(prefix, 0, cut):
+                    cut -= len(prefix)
+                    break
+        return cut
+
+    def _text(self, text: str, out: List[str]) -> None:
+        if "<" in text:
+            text = text.replace("<", "&lt;")
+        body = text.lstrip()
+        lead = text[:len(text) - len(body)]
+        trimmed = body.rstrip()
+        if not trimmed:
+            self._gap += text
+            return
+        self._gap += lead
+        if self._mode is None:
+            self._mode = TEXT
+        trail = body[len(trimmed):]
+        if self._mode == TEXT and "\n" in trimmed:
+            trimmed = _render_breaks(trimmed)
+        self._content(trimmed, out)
+        self._gap = trail
+
+    def _content(self, unit: str, out: List[str], paragraph: bool = False) -> None:
+        if self._mode is None:
+            self._mode = HTML if paragraph else TEXT
+        if self._mode == HTML:
+            if self._started:
+                out.append(self._gap)
+            self._started = True
+        elif not self._open_p:
+            out.append("<p>")  # los espacios iniciales del párrafo se descartan
+            self._open_p = True
+        elif self._gap:
+            out.append(_render_breaks(self._gap))
+        self._gap = ""
+        out.append(unit)
+
+    def _barrier(self, out: List[str]) -> None:
+        """<script> o tag no permitido: no emite nada, pero en html cuenta como contenido."""
+        if self._mode == TEXT:
+            return
+        if self._started:
+            if self._mode == HTML:
+                out.append(self._gap)
+                self._gap = ""
+        else:
+            self._gap = ""
+        self._started = True
+
+
+def _allowed_tag(raw: str) -> str:
+    """
+    Tag de la lista permitida, reconstruido. Sin atributos pasa tal cual; <a>
+    conserva solo `_LINK_ATTRS` (href con esquema permitido) y los demás tags
+    quedan sin atributos.
+    """
+    closing, name, attrs = _ALLOWED_TAG.match(raw).groups()
+    if not attrs.strip(" /"):
+        return raw
+    if closing or name.lower() != "a":
+        return f"<{closing}{name}>"
+    kept = []
+    for m in _ATTR.finditer(attrs):
+        attr = m.group(1).lower()
+        value = next((v for v in m.group(2, 3, 4) if v is not None), None)
+        if attr not in _LINK_ATTRS or value is None:
+            continue
+        if attr == "href" and not _safe_url(value):
+            continue
+        kept.append(f' {attr}="{html.escape(html.unescape(value))}"')
+    return f"<{name}{''.join(kept)}>"
+
+
+def _safe_url(value: str) -> bool:
+    """¿El href usa un esquema permitido? Se evalúa como el navegador (entidades y espacios)."""
+    url = _URL_IGNORED.sub("", html.unescape(value)).lower()
+    return url.startswith(_LINK_SCHEMES)
+
+
+def _render_breaks(text: str) -> str:
+    """Modo texto: línea en blanco → párrafo nuevo, salto simple → <br>."""
+    text = text.replace("\r\n", "\n")
+    if "\n\n" in text:
+        text = _PARAGRAPH_BREAK.sub("</p><p>", text)
+    return text.replace("\n", "<br>")
+
+
+def _is_pfix(text: str, lt: int) -> bool:
+    """"<p" seguido de algo que no es ">" ni espacio: se corrige a "<p>" sin esperar más."""
+    after = lt + 2
+    return text.startswith("<p", lt) and after < len(text) and text[after] != ">" and not text[after].isspace()
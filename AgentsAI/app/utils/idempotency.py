@@ -0,0 +1,177 @@
+# app/utils/idempotency.py
+"""
+Claves de idempotencia (`Idempotency-Key`) para endpoints caros.
+
+- La primera ejecución con una clave guarda su respuesta (status, body y tipo)
+  durante `ttl_s`; los reintentos con la misma clave reciben esa respuesta sin
+  volver a ejecutar nada (header `Idempotent-Replayed: true`).
+- Si el reintento llega mientras la primera ejecución sigue en curso, espera su
+  resultado en lugar de recalcular.
+- Solo se guardan respuestas 2xx: si la ejecución falla, el siguiente intento
+  con esa clave vuelve a ejecutarse.
+- La misma clave con otro contenido (otro prompt/archivo) → 422.
+- Las claves son de cada llamador (`owner_of`: sujeto del token verificado y
+  sesión): otro estudiante con la misma clave no ve la respuesta guardada.
+
+Las claves se guardan en memoria del proceso; con varios workers, la
+afinidad por `session_id` (app.core.sharding) lleva los reintentos al mismo.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import Response
+
+from app.core.config import settings
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+@dataclass
+class _Stored:
+    fingerprint: str
+    status_code: int
+    body: bytes
+    media_type: Optional[str]
+    expires_at: float
+
+
+def owner_of(token_payload: Dict[str, Any], session_id: str) -> str:
+    """Dueño de una clave: el sujeto del token verificado y la sesión del request."""
+    subject = token_payload.get("sub") or token_payload.get("oid") or ""
+    return f"{subject}|{session_id}"
+
+
+def fingerprint(*parts: Any) -> str:
+    """Huella del contenido del request (para detectar claves reutilizadas con otro contenido)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class IdempotencyStore:
+    """Respuestas por (endpoint, dueño, clave) con TTL + ejecuciones en vuelo. Usar desde el event loop."""
+
+    def __init__(self, ttl_s: float = 86400.0, max_entries: int = 10000) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._done: "OrderedDict[Tuple[str, str, str], _Stored]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str, str], Tuple[str, asyncio.Future]] = {}
+
+        # Métricas
+        self.executed = 0
+        self.replayed = 0
+        self.joined = 0
+        self.conflicts = 0
+
+    async def run(
+        self,
+        scope: str,
+        owner: str,
+        key: str,
+        fp: str,
+        fn: Callable[[], Awaitable[Response]],
+    ) -> Response:
+        k = (scope, owner, key)
+        while True:
+            stored = self._lookup(k)
+            if stored is not None:
+                self._check(stored.fingerprint, fp)
+                self.replayed += 1
+                return self._replay(stored)
+
+            inflight = self._inflight.get(k)
+            if inflight is None:
+                break
+            self._check(inflight[0], fp)
+            self.joined += 1
+            try:
+                await asyncio.shield(inflight[1])
+            except asyncio.CancelledError:
+                if inflight[1].cancelled():
+                    continue  # la primera ejecución se canceló: este request toma su lugar
+                raise
+            except Exception:
+                pass  # falló: se reintenta (o se toma el lugar) en la siguiente vuelta
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[k] = (fp, future)
+        self.executed += 1
+        try:
+            response = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            self._inflight.pop(k, None)
+
+        if 200 <= response.status_code < 300:
+            self._store(k, fp, response)
+        future.set_result(None)
+        return response
+
+    # -------- Internos --------
+    def _lookup(self, k: Tuple[str, str, str]) -> Optional[_Stored]:
+        stored = self._done.get(k)
+        if stored is None:
+            return None
+        if stored.expires_at <= time.monotonic():
+            del self._done[k]
+            return None
+        return stored
+
+    def _store(self, k: Tuple[str, str, str], fp: str, response: Response) -> None:
+        self._done[k] = _Stored(
+            fingerprint=fp,
+            status_code=response.status_code,
+            body=bytes(response.body),
+            media_type=response.media_type,
+            expires_at=time.monotonic() + self.ttl_s,
+        )
+        self._done.move_to_end(k)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    def _check(self, stored_fp: str, fp: str) -> None:
+        if stored_fp != fp:
+            self.conflicts += 1
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key ya usada con un contenido distinto",
+            )
+
+    @staticmethod
+    def _replay(stored: _Stored) -> Response:
+        return Response(
+            content=stored.body,
+            status_code=stored.status_code,
+            media_type=stored.media_type,
+            headers={REPLAYED_HEADER: "true"},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_s": self.ttl_s,
+            "stored": len(self._done),
+            "inflight": len(self._inflight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "joined": self.joined,
+            "conflicts": self.conflicts,
+        }
+
+
+# Instancia compartida del proceso
+idempotency_store = IdempotencyStore(ttl_s=settings.idempotency_ttl_s)
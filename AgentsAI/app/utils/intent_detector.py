@@ -0,0 +1,60 @@
+from typing import Iterable
+
+
+# Intenciones que seleccionan las secciones de instrucciones del Manager
+ESTADO = "estado"
+JUSTIFICACION = "justificacion"
+FAQ = "faq"
+GENERAL = "general"
+
+
+def detectar_intencion(query: str, previos: Iterable[str] = ()) -> str:
+    """
+    Señal local y barata (sin LLM) de la intención del mensaje, para enviar al
+    Manager solo las reglas que aplican:
+    - estado: pregunta por el estado/resultado de una justificación ya enviada.
+    - justificacion: quiere justificar una falta o está en ese trámite.
+    - faq: pregunta general de procesos o procedimientos.
+    - general: cualquier otra cosa (saludos, charla); lleva todas las reglas.
+
+    Si el mensaje no da señal (p. ej. "el 3 de marzo", "sí, ya lo tengo"), se usa
+    la de los mensajes previos del estudiante (`previos`, del más reciente al más antiguo).
+    """
+    intencion = _intencion_mensaje(query)
+    if intencion in (GENERAL, FAQ):
+        for previo in previos:
+            anterior = _intencion_mensaje(previo)
+            if anterior in (ESTADO, JUSTIFICACION):
+                return anterior if intencion == GENERAL else intencion
+            if anterior != GENERAL:
+                break
+    return intencion
+
+
+def _intencion_mensaje(query: str) -> str:
+    q = query.lower()
+
+    palabras_tramite = ["justific", "solicitud", "mi caso", "certificado", "justificativo"]
+    palabras_estado = [
+        "estado", "cómo va", "como va", "aprobaron", "aprobado", "aprobada", "revisaron",
+        "qué pasó con", "que paso con", "que pasó con", "resultado", "ya respondieron", "en qué va", "en que va",
+    ]
+    if any(p in q for p in palabras_estado) and any(t in q for t in palabras_tramite):
+        return ESTADO
+
+    palabras_justificacion = [
+        "justific", "falta", "falté", "falte", "faltar", "inasistencia", "no asistí", "no asisti",
+        "no pude asistir", "no pude ir", "no fui", "certificado", "enferm", "médico", "medico",
+        "ausencia", "ausente",
+    ]
+    if any(p in q for p in palabras_justificacion):
+        return JUSTIFICACION
+
+    palabras_faq = [
+        "?", "cómo", "como puedo", "dónde", "donde", "cuándo", "cuando", "qué necesito", "que necesito",
+        "requisito", "proceso", "trámite", "tramite", "procedimiento", "horario", "plazo",
+    ]
+    if any(p in q for p in palabras_faq):
+        return FAQ
+
+    return GENERAL
@@ -3,6 +3,8 @@ from datetime import datetime, timezone
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 from app.schemas.response import APIResponse
+from app.core.config import settings
+from app.utils import stage_timer
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,7 +34,12 @@ def success_response(
 ) -> JSONResponse:
     """
     Genera una respuesta de éxito estandarizada.
+    Con SERVER_TIMING_META, agrega los tiempos por etapa del request en `meta.timings`.
     """
+    if settings.server_timing_meta and (meta is None or isinstance(meta, dict)):
+        timings = stage_timer.current()
+        if timings is not None:
+            meta = {**(meta or {}), "timings": timings.as_meta()}
     try:
         response = APIResponse(
             success=success,
@@ -0,0 +1,944 @@
+# app/utils/session_backends.py
+"""
+Backends intercambiables para el estado de sesión (historial, documentos,
+perfil, OCR y estado de la conversación). Todos cumplen el protocolo `SessionStore`:
+
+- `load(session_id, parts)`   → una sola lectura por request (SessionSnapshot)
+- `commit(session_id, writes)` → una sola escritura atómica por request (SessionWrites)
+
+Implementaciones:
+- InMemorySessionStore: dicts del proceso (comportamiento histórico, 1 worker).
+- SQLiteSessionStore:   archivo local embebido; sobrevive reinicios y se comparte
+                        entre workers de la misma máquina.
+- RedisSessionStore:    cualquier servidor que hable el protocolo Redis; permite
+                        escalar a varios nodos. Acepta un cliente inyectado
+                        (p. ej. fakeredis) para pruebas locales.
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple, Union
+
+from app.utils.session_journal import SessionJournal
+
+try:
+    import redis  # type: ignore
+except ImportError:
+    redis = None
+
+# Partes del estado de una sesión
+MESSAGES = "messages"
+DOCS = "docs"
+PROFILE = "profile"
+OCR = "ocr"
+STATE = "state"   # ConversationState serializado (app.utils.conversation_state)
+ALL_PARTS = (MESSAGES, DOCS, PROFILE, OCR, STATE)
+
+
+# ============================================================
+# Mensajes
+# ============================================================
+# Roles internados: cada mensaje guarda un código entero, no su propio str
+_ROLES: List[str] = ["user", "assistant", "system"]
+_ROLE_CODES: Dict[str, int] = {r: i for i, r in enumerate(_ROLES)}
+_roles_lock = threading.Lock()
+
+
+def _role_code(role: str) -> int:
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        with _roles_lock:
+            code = _ROLE_CODES.get(role)
+            if code is None:
+                code = len(_ROLES)
+                _ROLES.append(sys.intern(role))
+                _ROLE_CODES[_ROLES[code]] = code
+    return code
+
+
+class Message:
+    """
+    Mensaje de chat compacto (`__slots__`, rol como código entero).
+
+    Compatible con el uso histórico como dict: `m["role"]`, `m.get("content")`
+    y `dict(m)` siguen funcionando.
+    """
+
+    __slots__ = ("_role", "content")
+
+    def __init__(self, role: str, content: str) -> None:
+        self._role = _role_code(role)
+        self.content = content
+
+    @classmethod
+    def of(cls, value: Union["Message", Dict[str, str]]) -> "Message":
+        if isinstance(value, Message):
+            return value
+        return cls(value["role"], value["content"])
+
+    @property
+    def role(self) -> str:
+        return _ROLES[self._role]
+
+    # -------- Compatibilidad con dict --------
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return _ROLES[self._role]
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> Tuple[str, str]:
+        return ("role", "content")
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Message):
+            return self._role == other._role and self.content == other.content
+        if isinstance(other, dict):
+            return other == self.to_dict()
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+
+class MessagesView(Sequence):
+    """
+    Vista de solo lectura sobre el historial, sin copiarlo.
+
+    Fija la longitud al crearse: como el historial solo crece por `append`
+    (los reinicios reemplazan la lista, no la vacían), la vista es estable
+    aunque lleguen mensajes nuevos mientras se usa.
+    """
+
+    __slots__ = ("_items", "_len")
+
+    def __init__(self, items: Sequence, length: Optional[int] = None) -> None:
+        self._items = items
+        self._len = len(items) if length is None else length
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._items[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        return self._items[index]
+
+    def __iter__(self) -> Iterator[Message]:
+        items = self._items
+        for i in range(self._len):
+            yield items[i]
+
+    def __repr__(self) -> str:
+        return f"MessagesView({len(self)} mensajes)"
+
+
+@dataclass
+class SessionSnapshot:
+    """Estado leído de una sesión (solo se rellenan las partes pedidas)."""
+    messages: Sequence = field(default_factory=list)
+    docs: Set[str] = field(default_factory=set)
+    profile: Optional[Dict[str, str]] = None
+    ocr: Optional[Dict[str, Any]] = None
+    state: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class SessionWrites:
+    """
+    Escrituras acumuladas de un request. Orden de aplicación:
+    1) `clear` (partes a borrar), 2) mensajes, 3) docs (add, luego discard),
+    4) perfil, OCR y estado.
+    """
+    clear: Set[str] = field(default_factory=set)
+    messages: List[Message] = field(default_factory=list)
+    add_docs: Set[str] = field(default_factory=set)
+    discard_docs: Set[str] = field(default_factory=set)
+    profile: Optional[Dict[str, str]] = None
+    ocr: Optional[Dict[str, Any]] = None
+    state: Optional[Dict[str, Any]] = None
+
+    def is_empty(self) -> bool:
+        return not (
+            self.clear or self.messages or self.add_docs or self.discard_docs
+            or self.profile is not None or self.ocr is not None or self.state is not None
+        )
+
+
+class SessionStore(Protocol):
+    # True si load/commit hacen I/O bloqueante (la fachada async los corre en un hilo)
+    blocking: bool
+
+    def load(self, session_id: str, parts: Iterable[str] = ALL_PARTS) -> SessionSnapshot: ...
+
+    def commit(self, session_id: str, writes: SessionWrites) -> None: ...
+
+    def clear_all(self) -> None: ...
+
+
+# ============================================================
+# Memoria del proceso
+# ============================================================
+_ENTRY_OVERHEAD = 64  # bytes aproximados por etiqueta/dict (objetos Python)
+_MESSAGE_OVERHEAD = sys.getsizeof(Message("user", "")) - sys.getsizeof("") + 8  # objeto + puntero en la lista
+
+
+def _approx_bytes(part: str, value: Any) -> int:
+    """Estimación barata del tamaño residente de una parte de la sesión."""
+    if not value:
+        return 0
+    if part == MESSAGES:
+        return sum(_MESSAGE_OVERHEAD + sys.getsizeof(m["content"]) for m in value)
+    if part == DOCS:
+        return sum(_ENTRY_OVERHEAD + len(t) for t in value)
+    return _ENTRY_OVERHEAD + len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class _ColdTranscript:
+    """Historial inactivo comprimido con zlib (JSON de pares [código_rol, contenido])."""
+
+    __slots__ = ("blob", "count")
+
+    def __init__(self, messages: List[Message]) -> None:
+        raw = json.dumps([(m._role, m.content) for m in messages], ensure_ascii=False)
+        self.blob = zlib.compress(raw.encode("utf-8"), 6)
+        self.count = len(messages)
+
+    def thaw(self) -> List[Message]:
+        out: List[Message] = []
+        for code, content in json.loads(zlib.decompress(self.blob).decode("utf-8")):
+            m = Message.__new__(Message)
+            m._role = code
+            m.content = content
+            out.append(m)
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.blob) + _ENTRY_OVERHEAD
+
+
+class _IdleSchedule:
+    """
+    Heap de vencimientos (una entrada por sesión). `pop_due` solo visita las
+    entradas vencidas; si la sesión se usó después, se reprograma.
+    """
+
+    def __init__(self, delay_s: float) -> None:
+        self.delay_s = delay_s
+        self._heap: List[Tuple[float, str]] = []
+        self._scheduled: Set[str] = set()
+
+    def schedule(self, session_id: str, last_access: float) -> None:
+        if session_id not in self._scheduled:
+            heapq.heappush(self._heap, (last_access + self.delay_s, session_id))
+            self._scheduled.add(session_id)
+
+    def pop_due(self, now: float, last_access: Dict[str, float]) -> List[str]:
+        due: List[str] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, sid = heapq.heappop(heap)
+            self._scheduled.discard(sid)
+            last = last_access.get(sid)
+            if last is None:
+                continue  # ya eliminada (reinicio, clear o presupuesto)
+            deadline = last + self.delay_s
+            if deadline <= now:
+                due.append(sid)
+            else:
+                heapq.heappush(heap, (deadline, sid))
+                self._scheduled.add(sid)
+        return due
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._scheduled.clear()
+
+
+class InMemorySessionStore:
+    """
+    Estado en dicts del proceso. Rápido, pero se pierde al reiniciar.
+    No hace I/O: se llama directo desde el event loop (`blocking = False`).
+
+    Para que la memoria no crezca sin límite durante el semestre:
+    - Cada sesión registra su último acceso (load/commit).
+    - `idle_ttl_s`: las sesiones inactivas se eliminan en `sweep_expired()`.
+      Las expiraciones viven en un heap con una entrada por sesión; el barrido
+      solo revisa las que ya vencieron (no recorre todas las sesiones).
+    - `max_bytes`: presupuesto global (estimado) para los dicts de la sesión. Al
+      superarlo se expulsan las sesiones menos usadas recientemente (LRU).
+    - `compress_idle_s`: los historiales de al menos `compress_min_bytes` que
+      llevan ese tiempo sin uso se guardan comprimidos con zlib y se
+      descomprimen en el siguiente acceso (opcional, 0 = desactivado).
+    - `journal`: si se pasa un `SessionJournal`, cada commit y cada expulsión
+      se registran en disco y `restore()` recupera el estado tras un reinicio.
+    - `pin`/`unpin`: una sesión con un request en curso (`session_batch` abierto,
+      p. ej. un turno bajo `session_gate` esperando al LLM) no se expulsa ni por
+      inactividad ni por presupuesto; su commit no debe recrearla a medias.
+    """
+
+    blocking = False
+
+    def __init__(
+        self,
+        *,
+        idle_ttl_s: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        compress_idle_s: Optional[float] = None,
+        compress_min_bytes: int = 4096,
+        journal: Optional[SessionJournal] = None,
+    ) -> None:
+        # Historias de chat (lista de Message, o _ColdTranscript si está comprimida)
+        self._sessions: Dict[str, Union[List[Message], _ColdTranscript]] = {}
+        # Documentos subidos (acta / cédula / certificados) por sesión
+        self._uploaded_docs: Dict[str, Set[str]] = {}
+        # Perfiles de usuario por sesión
+        self._profiles: Dict[str, Dict[str, str]] = {}
+        # Resultados de OCR/analizar-imágenes por sesión
+        self._ocr_results: Dict[str, Dict[str, Any]] = {}
+        # Estado de la conversación por sesión
+        self._states: Dict[str, Dict[str, Any]] = {}
+
+        self.idle_ttl_s = idle_ttl_s or None
+        self.max_bytes = max_bytes or None
+        self.compress_min_bytes = compress_min_bytes
+
+        # sid -> último acceso (monotonic); el orden del dict es el orden LRU
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        # sid -> {parte: bytes}
+        self._sizes: Dict[str, Dict[str, int]] = {}
+        self._total_bytes = 0
+        self._expiry = _IdleSchedule(self.idle_ttl_s) if self.idle_ttl_s else None
+        self._cold = _IdleSchedule(compress_idle_s) if compress_idle_s else None
+        self._lock = threading.RLock()
+        self._journal = journal
+        # sid -> requests en curso que la leyeron y aún no hacen commit
+        self._pinned: Dict[str, int] = {}
+
+        # Métricas
+        self.evictions_ttl = 0
+        self.evictions_budget = 0
+        self.compressions = 0
+        self.decompressions = 0
+
+    def _maps(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            MESSAGES: self._sessions,
+            DOCS: self._uploaded_docs,
+            PROFILE: self._profiles,
+            OCR: self._ocr_results,
+            STATE: self._states,
+        }
+
+    def _messages(self, session_id: str) -> List[Message]:
+        """Historial vivo de la sesión; descomprime si estaba en frío."""
+        msgs = self._sessions.get(session_id)
+        if isinstance(msgs, _ColdTranscript):
+            msgs = msgs.thaw()
+            self._sessions[session_id] = msgs
+            self._set_size(session_id, MESSAGES, _approx_bytes(MESSAGES, msgs))
+            self.decompressions += 1
+        return msgs if msgs is not None else []
+
+    # -------- Protocolo SessionStore --------
+    def load(self, session_id: str, parts: Iterable[str] = ALL_PARTS) -> SessionSnapshot:
+        parts = set(parts)
+        snap = SessionSnapshot()
+        with self._lock:
+            if MESSAGES in parts:
+                snap.messages = list(self._messages(session_id))
+            self._fill(snap, session_id, parts)
+        return snap
+
+    def view(self, session_id: str, parts: Iterable[str] = ALL_PARTS) -> SessionSnapshot:
+        """
+        Como `load`, pero `messages` es una `MessagesView` sobre el historial
+        interno (sin copiar la lista). Pensado para lecturas largas (summary).
+        """
+        parts = set(parts)
+        snap = SessionSnapshot()
+        with self._lock:
+            if MESSAGES in parts:
+                snap.messages = MessagesView(self._messages(session_id))
+            self._fill(snap, session_id, parts)
+        return snap
+
+    def _fill(self, snap: SessionSnapshot, session_id: str, parts: Set[str]) -> None:
+        if DOCS in parts:
+            snap.docs = set(self._uploaded_docs.get(session_id, ()))
+        if PROFILE in parts:
+            snap.profile = self._profiles.get(session_id)
+        if OCR in parts:
+            snap.ocr = self._ocr_results.get(session_id)
+        if STATE in parts:
+            snap.state = self._states.get(session_id)
+        if session_id in self._last_access:
+            self._touch(session_id)
+
+    def commit(self, session_id: str, writes: SessionWrites) -> None:
+        with self._lock:
+            self._apply(session_id, writes)
+            if self._journal is not None:
+                self._journal.append(_writes_record(session_id, writes))
+            if self.max_bytes:
+                self._enforce_budget(keep=session_id)
+
+    def _apply(self, session_id: str, writes: SessionWrites) -> None:
+        maps = self._maps()
+        for part in writes.clear:
+            maps[part].pop(session_id, None)
+
+        if writes.messages:
+            msgs = self._messages(session_id)
+            if session_id not in self._sessions:
+                self._sessions[session_id] = msgs
+            msgs.extend(Message.of(m) for m in writes.messages)
+        if writes.add_docs or writes.discard_docs:
+            docs = self._uploaded_docs.setdefault(session_id, set())
+            docs |= writes.add_docs
+            docs -= writes.discard_docs
+        if writes.profile is not None:
+            self._profiles[session_id] = writes.profile
+        if writes.ocr is not None:
+            self._ocr_results[session_id] = writes.ocr
+        if writes.state is not None:
+            self._states[session_id] = writes.state
+
+        self._account(session_id, writes)
+
+    def clear_all(self) -> None:
+        with self._lock:
+            self._clear_all()
+            if self._journal is not None:
+                self._journal.append({"*": 1})
+
+    def _clear_all(self) -> None:
+        for m in self._maps().values():
+            m.clear()
+        self._last_access.clear()
+        self._sizes.clear()
+        self._total_bytes = 0
+        for schedule in (self._expiry, self._cold):
+            if schedule is not None:
+                schedule.clear()
+
+    # -------- Requests en curso --------
+    def pin(self, session_id: str) -> None:
+        with self._lock:
+            self._pinned[session_id] = self._pinned.get(session_id, 0) + 1
+
+    def unpin(self, session_id: str) -> None:
+        with self._lock:
+            count = self._pinned.get(session_id, 0) - 1
+            if count > 0:
+                self._pinned[session_id] = count
+            else:
+                self._pinned.pop(session_id, None)
+
+    # -------- Contabilidad de acceso y tamaño --------
+    def _touch(self, session_id: str) -> None:
+        now = time.monotonic()
+        self._last_access[session_id] = now
+        self._last_access.move_to_end(session_id)
+        if self._expiry is not None:
+            self._expiry.schedule(session_id, now)
+        if self._cold is not None and isinstance(self._sessions.get(session_id), list):
+            self._cold.schedule(session_id, now)
+
+    def _set_size(self, session_id: str, part: str, nbytes: int) -> None:
+        sizes = self._sizes.setdefault(session_id, {})
+        self._total_bytes += nbytes - sizes.get(part, 0)
+        sizes[part] = nbytes
+
+    def _account(self, session_id: str, writes: SessionWrites) -> None:
+        sizes = self._sizes.setdefault(session_id, {})
+        before = sum(sizes.values())
+        maps = self._maps()
+        for part in ALL_PARTS:
+            if part in writes.clear:
+                sizes.pop(part, None)
+        if writes.messages:
+            # Solo se suma lo agregado: no se recorre el historial completo
+            sizes[MESSAGES] = sizes.get(MESSAGES, 0) + _approx_bytes(MESSAGES, writes.messages)
+        if writes.add_docs or writes.discard_docs:
+            sizes[DOCS] = _approx_bytes(DOCS, self._uploaded_docs.get(session_id))
+        if writes.profile is not None:
+            sizes[PROFILE] = _approx_bytes(PROFILE, writes.profile)
+        if writes.ocr is not None:
+            sizes[OCR] = _approx_bytes(OCR, writes.ocr)
+        if writes.state is not None:
+            sizes[STATE] = _approx_bytes(STATE, writes.state)
+        self._total_bytes += sum(sizes.values()) - before
+
+        if any(session_id in maps[p] for p in ALL_PARTS):
+            self._touch(session_id)
+        else:
+            self._forget(session_id)
+
+    def _forget(self, session_id: str) -> None:
+        """Quita la sesión de los dicts de estado y de la contabilidad (sus entradas en los heaps quedan obsoletas)."""
+        for m in self._maps().values():
+            m.pop(session_id, None)
+        self._total_bytes -= sum(self._sizes.pop(session_id, {}).values())
+        self._last_access.pop(session_id, None)
+
+    def _evict(self, session_id: str) -> None:
+        self._forget(session_id)
+        if self._journal is not None:
+            self._journal.append({"s": session_id, "c": list(ALL_PARTS)})
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        # En orden LRU; la sesión del commit y las que tienen un request en curso se conservan
+        # (si solo quedan esas, se tolera pasar el presupuesto)
+        for victim in list(self._last_access):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if victim == keep or victim in self._pinned:
+                continue
+            self._evict(victim)
+            self.evictions_budget += 1
+
+    # -------- Expiración y compresión por inactividad --------
+    def sweep_expired(self, now: Optional[float] = None) -> int:
+        """Elimina las sesiones inactivas más de `idle_ttl_s`. Devuelve cuántas expiraron."""
+        if self._expiry is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = []
+            for sid in self._expiry.pop_due(now, self._last_access):
+                if sid in self._pinned:
+                    self._touch(sid)  # request en curso: se reprograma
+                    continue
+                self._evict(sid)
+                expired.append(sid)
+            self.evictions_ttl += len(expired)
+        return len(expired)
+
+    def compress_cold(self, now: Optional[float] = None) -> int:
+        """Comprime los historiales largos sin uso desde `compress_idle_s`. Devuelve cuántos."""
+        if self._cold is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        compressed = 0
+        with self._lock:
+            for sid in self._cold.pop_due(now, self._last_access):
+                msgs = self._sessions.get(sid)
+                if not isinstance(msgs, list):
+                    continue
+                if self._sizes.get(sid, {}).get(MESSAGES, 0) < self.compress_min_bytes:
+                    continue
+                cold = _ColdTranscript(msgs)
+                self._sessions[sid] = cold
+                self._set_size(sid, MESSAGES, cold.nbytes)
+                compressed += 1
+            self.compressions += compressed
+        return compressed
+
+    # -------- Journal (reinicio en caliente) --------
+    def restore(self) -> int:
+        """
+        Recupera el estado desde el journal (snapshot + registros) y arranca
+        su fsync agrupado. Las sesiones restauradas cuentan como recién usadas.
+        Devuelve la cantidad de registros leídos.
+        """
+        if self._journal is None:
+            return 0
+        with self._lock:
+            count = self._journal.replay(self._restore_session, self._replay_record)
+            if self.max_bytes:
+                self._enforce_budget()
+        self._journal.start()
+        return count
+
+    def _restore_session(self, record: Dict[str, Any]) -> None:
+        writes = SessionWrites(
+            messages=[Message(r, c) for r, c in record.get("m", ())],
+            add_docs=set(record.get("d", ())),
+            profile=record.get("p"),
+            ocr=record.get("o"),
+            state=record.get("e"),
+        )
+        self._apply(record["s"], writes)
+
+    def _replay_record(self, record: Dict[str, Any]) -> None:
+        if "*" in record:
+            self._clear_all()
+            return
+        self._apply(record["s"], _record_writes(record))
+
+    def compact(self) -> bool:
+        """
+        Escribe un snapshot del estado y recorta el journal. El lock solo se
+        toma para copiar referencias y para rotar el journal; la serialización
+        ocurre fuera (llamar desde un hilo, p. ej. asyncio.to_thread).
+        """
+        if self._journal is None:
+            return False
+        with self._lock:
+            checkpoint = self._journal.checkpoint()
+            sessions = [
+                (
+                    sid,
+                    self._sessions.get(sid),
+                    set(self._uploaded_docs.get(sid, ())),
+                    self._profiles.get(sid),
+                    self._ocr_results.get(sid),
+                    self._states.get(sid),
+                )
+                for sid in self._last_access
+            ]
+            # Copias superficiales: los historiales solo crecen, basta fijar su largo
+            sessions = [
+                (sid, msgs if isinstance(msgs, _ColdTranscript) else MessagesView(msgs or ()), docs, profile, ocr, state)
+                for sid, msgs, docs, profile, ocr, state in sessions
+            ]
+        self._journal.write_snapshot(
+            (_session_record(*entry) for entry in sessions),
+            checkpoint,
+        )
+        with self._lock:
+            self._journal.rotate(checkpoint)
+        return True
+
+    def maybe_compact(self) -> bool:
+        """Compacta si el journal superó su umbral (`compact_bytes`)."""
+        if self._journal is None or not self._journal.needs_compaction():
+            return False
+        return self.compact()
+
+    def close(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+
+    # -------- Métricas --------
+    def memory_usage(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Bytes estimados por parte para una sesión (None si no existe)."""
+        with self._lock:
+            sizes = self._sizes.get(session_id)
+            if sizes is None or session_id not in self._last_access:
+                return None
+            msgs = self._sessions.get(session_id)
+            cold = isinstance(msgs, _ColdTranscript)
+            return {
+                **{part: sizes.get(part, 0) for part in ALL_PARTS},
+                "total": sum(sizes.values()),
+                "message_count": msgs.count if cold else len(msgs or ()),
+                "compressed": cold,
+            }
+
+    def largest_sessions(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Las `limit` sesiones con más bytes estimados: [(session_id, bytes)]."""
+        with self._lock:
+            totals = ((sid, sum(sizes.values())) for sid, sizes in self._sizes.items())
+            return heapq.nlargest(limit, totals, key=lambda t: t[1])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._last_access),
+            "in_use": len(self._pinned),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_s": self.idle_ttl_s,
+            "evictions_ttl": self.evictions_ttl,
+            "evictions_budget": self.evictions_budget,
+            "compressions": self.compressions,
+            "decompressions": self.decompressions,
+            "journal": self._journal.stats() if self._journal is not None else None,
+        }
+
+
+def _writes_record(session_id: str, writes: SessionWrites) -> Dict[str, Any]:
+    """SessionWrites -> registro compacto del journal (solo campos no vacíos)."""
+    record: Dict[str, Any] = {"s": session_id}
+    if writes.clear:
+        record["c"] = sorted(writes.clear)
+    if writes.messages:
+        record["m"] = [(m["role"], m["content"]) for m in writes.messages]
+    if writes.add_docs:
+        record["a"] = sorted(writes.add_docs)
+    if writes.discard_docs:
+        record["x"] = sorted(writes.discard_docs)
+    if writes.profile is not None:
+        record["p"] = writes.profile
+    if writes.ocr is not None:
+        record["o"] = writes.ocr
+    if writes.state is not None:
+        record["e"] = writes.state
+    return record
+
+
+def _record_writes(record: Dict[str, Any]) -> SessionWrites:
+    return SessionWrites(
+        clear=set(record.get("c", ())),
+        messages=[Message(r, c) for r, c in record.get("m", ())],
+        add_docs=set(record.get("a", ())),
+        discard_docs=set(record.get("x", ())),
+        profile=record.get("p"),
+        ocr=record.get("o"),
+        state=record.get("e"),
+    )
+
+
+def _session_record(sid: str, msgs: Any, docs: Set[str], profile: Any, ocr: Any, state: Any) -> Dict[str, Any]:
+    """Estado completo de una sesión para el snapshot."""
+    if isinstance(msgs, _ColdTranscript):
+        msgs = msgs.thaw()
+    record: Dict[str, Any] = {"s": sid}
+    if msgs:
+        record["m"] = [(m.role, m.content) for m in msgs]
+    if docs:
+        record["d"] = sorted(docs)
+    if profile is not None:
+        record["p"] = profile
+    if ocr is not None:
+        record["o"] = ocr
+    if state is not None:
+        record["e"] = state
+    return record
+
+
+# ============================================================
+# SQLite embebido
+# ============================================================
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_messages (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_session_messages_sid ON session_messages (session_id, seq);
+CREATE TABLE IF NOT EXISTS session_docs (
+    session_id TEXT NOT NULL,
+    tag        TEXT NOT NULL,
+    PRIMARY KEY (session_id, tag)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS session_kv (
+    session_id TEXT NOT NULL,
+    part       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    PRIMARY KEY (session_id, part)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteSessionStore:
+    """
+    Estado en un archivo SQLite (modo WAL). Cada `load` es una transacción de
+    lectura y cada `commit` una transacción de escritura. Las llamadas bloquean:
+    la fachada async (`session_batch`) las ejecuta en un hilo.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SQLITE_SCHEMA)
+
+    def load(self, session_id: str, parts: Iterable[str] = ALL_PARTS) -> SessionSnapshot:
+        parts = set(parts)
+        snap = SessionSnapshot()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                if MESSAGES in parts:
+                    cur.execute(
+                        "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY seq",
+                        (session_id,),
+                    )
+                    snap.messages = [Message(r, c) for r, c in cur.fetchall()]
+                if DOCS in parts:
+                    cur.execute("SELECT tag FROM session_docs WHERE session_id = ?", (session_id,))
+                    snap.docs = {t for (t,) in cur.fetchall()}
+                kv_parts = [p for p in (PROFILE, OCR, STATE) if p in parts]
+                if kv_parts:
+                    cur.execute(
+                        f"SELECT part, data FROM session_kv WHERE session_id = ? "
+                        f"AND part IN ({','.join('?' * len(kv_parts))})",
+                        (session_id, *kv_parts),
+                    )
+                    for part, data in cur.fetchall():
+                        setattr(snap, part, json.loads(data))
+            finally:
+                cur.execute("COMMIT")
+        return snap
+
+    def commit(self, session_id: str, writes: SessionWrites) -> None:
+        if writes.is_empty():
+            return
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if MESSAGES in writes.clear:
+                    cur.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                if DOCS in writes.clear:
+                    cur.execute("DELETE FROM session_docs WHERE session_id = ?", (session_id,))
+                for part in (PROFILE, OCR, STATE):
+                    if part in writes.clear:
+                        cur.execute(
+                            "DELETE FROM session_kv WHERE session_id = ? AND part = ?",
+                            (session_id, part),
+                        )
+
+                if writes.messages:
+                    cur.executemany(
+                        "INSERT INTO session_messages (session_id, role, content) VALUES (?, ?, ?)",
+                        [(session_id, m["role"], m["content"]) for m in writes.messages],
+                    )
+                if writes.add_docs:
+                    cur.executemany(
+                        "INSERT OR IGNORE INTO session_docs (session_id, tag) VALUES (?, ?)",
+                        [(session_id, t) for t in writes.add_docs],
+                    )
+                if writes.discard_docs:
+                    cur.executemany(
+                        "DELETE FROM session_docs WHERE session_id = ? AND tag = ?",
+                        [(session_id, t) for t in writes.discard_docs],
+                    )
+                for part, value in ((PROFILE, writes.profile), (OCR, writes.ocr), (STATE, writes.state)):
+                    if value is not None:
+                        cur.execute(
+                            "INSERT OR REPLACE INTO session_kv (session_id, part, data) VALUES (?, ?, ?)",
+                            (session_id, part, json.dumps(value, ensure_ascii=False)),
+                        )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def clear_all(self) -> None:
+        with self._lock:
+            self._conn.executescript(
+                "DELETE FROM session_messages; DELETE FROM session_docs; DELETE FROM session_kv;"
+            )
+
+
+# ============================================================
+# Protocolo Redis
+# ============================================================
+def _text(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class RedisSessionStore:
+    """
+    Estado en un servidor Redis (o compatible). Llaves por sesión:
+      {prefix}:{sid}:messages  LIST de JSON
+      {prefix}:{sid}:docs      SET
+      {prefix}:{sid}:profile   STRING JSON
+      {prefix}:{sid}:ocr       STRING JSON
+      {prefix}:{sid}:state     STRING JSON
+    `load` usa un pipeline (un round trip) y `commit` un MULTI/EXEC.
+    Si `ttl_s` está definido, cada commit renueva la expiración de la sesión.
+    El cliente es síncrono (redis-py): la fachada async (`session_batch`)
+    ejecuta cada llamada en un hilo.
+    """
+
+    blocking = True
+
+    def __init__(self, client: Any, *, prefix: str = "mentores:session", ttl_s: Optional[int] = None) -> None:
+        self._r = client
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "RedisSessionStore":
+        if redis is None:
+            raise RuntimeError("El backend 'redis' requiere el paquete redis (pip install redis).")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, session_id: str, part: str) -> str:
+        return f"{self.prefix}:{session_id}:{part}"
+
+    def load(self, session_id: str, parts: Iterable[str] = ALL_PARTS) -> SessionSnapshot:
+        wanted = [p for p in ALL_PARTS if p in set(parts)]
+        pipe = self._r.pipeline(transaction=False)
+        for part in wanted:
+            key = self._key(session_id, part)
+            if part == MESSAGES:
+                pipe.lrange(key, 0, -1)
+            elif part == DOCS:
+                pipe.smembers(key)
+            else:
+                pipe.get(key)
+        results = pipe.execute()
+
+        snap = SessionSnapshot()
+        for part, raw in zip(wanted, results):
+            if part == MESSAGES:
+                snap.messages = [Message.of(json.loads(_text(m))) for m in raw or ()]
+            elif part == DOCS:
+                snap.docs = {_text(t) for t in raw or ()}
+            elif raw is not None:
+                setattr(snap, part, json.loads(_text(raw)))
+        return snap
+
+    def commit(self, session_id: str, writes: SessionWrites) -> None:
+        if writes.is_empty():
+            return
+        pipe = self._r.pipeline(transaction=True)
+        if writes.clear:
+            pipe.delete(*(self._key(session_id, p) for p in writes.clear))
+        if writes.messages:
+            pipe.rpush(
+                self._key(session_id, MESSAGES),
+                *(json.dumps({"role": m["role"], "content": m["content"]}, ensure_ascii=False) for m in writes.messages),
+            )
+        if writes.add_docs:
+            pipe.sadd(self._key(session_id, DOCS), *writes.add_docs)
+        if writes.discard_docs:
+            pipe.srem(self._key(session_id, DOCS), *writes.discard_docs)
+        if writes.profile is not None:
+            pipe.set(self._key(session_id, PROFILE), json.dumps(writes.profile, ensure_ascii=False))
+        if writes.ocr is not None:
+            pipe.set(self._key(session_id, OCR), json.dumps(writes.ocr, ensure_ascii=False))
+        if writes.state is not None:
+            pipe.set(self._key(session_id, STATE), json.dumps(writes.state, ensure_ascii=False))
+        if self.ttl_s:
+            for part in ALL_PARTS:
+                pipe.expire(self._key(session_id, part), self.ttl_s)
+        pipe.execute()
+
+    def clear_all(self) -> None:
+        batch: List[Any] = []
+        for key in self._r.scan_iter(match=f"{self.prefix}:*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self._r.delete(*batch)
+                batch.clear()
+        if batch:
+            self._r.delete(*batch)
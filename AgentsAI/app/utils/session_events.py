@@ -0,0 +1,91 @@
+# app/utils/session_events.py
+"""
+Pub/sub en proceso por `session_id`, para empujar eventos de la sesión a las
+conexiones abiertas (canal WebSocket del agente) sin que el estudiante tenga
+que mandar otro mensaje.
+
+- `subscribe(session_id)`: context manager que entrega una `asyncio.Queue`
+  con los eventos de esa sesión mientras la conexión vive.
+- `publish(session_id, kind, data)`: lo llama `SessionBatch.flush()` después
+  del commit (p. ej. `set_ocr_result` → evento "ocr"). Se puede llamar desde
+  cualquier hilo: la entrega se agenda en el loop de cada suscriptor.
+
+Es por proceso: con SHARD_NODES, la conexión debe llegar al worker dueño de
+la sesión, que es el mismo que procesa /analyze-file/ de esa sesión.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Tipos de evento
+OCR = "ocr"
+
+_Subscriber = Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Dict[str, Any]]"]
+
+
+class SessionEvents:
+    """Suscriptores por sesión; los eventos que no caben en una cola llena se descartan."""
+
+    def __init__(self, max_pending: int = 32) -> None:
+        self.max_pending = max_pending
+        self._subscribers: Dict[str, List[_Subscriber]] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @contextmanager
+    def subscribe(self, session_id: str) -> Iterator["asyncio.Queue[Dict[str, Any]]"]:
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(self.max_pending)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.setdefault(session_id, []).append(subscriber)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(session_id, [])
+                subscribers.remove(subscriber)
+                if not subscribers:
+                    self._subscribers.pop(session_id, None)
+
+    def publish(self, session_id: str, kind: str, data: Dict[str, Any]) -> int:
+        """Agenda el evento para cada suscriptor de la sesión. Devuelve cuántos había."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        self.published += 1
+        event = {"type": kind, "data": data}
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                self.dropped += 1  # loop ya cerrado
+        return len(subscribers)
+
+    def _deliver(self, queue: "asyncio.Queue[Dict[str, Any]]", event: Dict[str, Any]) -> None:
+        try:
+            queue.put_nowait(event)
+            self.delivered += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribers = sum(len(s) for s in self._subscribers.values())
+            sessions = len(self._subscribers)
+        return {
+            "sessions": sessions,
+            "subscribers": subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+# Instancia compartida del proceso
+session_events = SessionEvents()
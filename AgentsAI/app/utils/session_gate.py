@@ -0,0 +1,139 @@
+# app/utils/session_gate.py
+"""
+Serialización por sesión y deduplicación de requests en vuelo.
+
+- Un lock asyncio por `session_id`: dos requests de la misma sesión nunca leen
+  el mismo historial ni intercalan sus escrituras; el segundo espera su turno.
+- Single-flight: si llega un prompt idéntico para la misma sesión mientras el
+  primero sigue en vuelo (en cola o ejecutándose), espera ese mismo resultado
+  en lugar de lanzar otra corrida del agente (doble clic, reintentos).
+- Profundidad de cola por sesión: cuántos requests había delante al llegar.
+- `exclusive(session_id)`: el mismo turno por sesión sin coalescencia, para
+  escrituras que no son un prompt (resultado del OCR, avisos por WebSocket).
+  Así no pisan el estado que un turno del agente en curso va a guardar.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from app.utils.stage_timer import record
+
+T = TypeVar("T")
+
+
+@dataclass
+class GateResult(Generic[T]):
+    value: T
+    queue_depth: int   # requests de la sesión por delante al llegar (0 = sin espera)
+    coalesced: bool    # True si reutilizó el resultado de un request idéntico en vuelo
+
+
+class _SessionSlot:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.depth = 0  # requests en cola + en ejecución
+
+
+class SessionGate:
+    """Lock por sesión + coalescencia de prompts idénticos. Usar desde el event loop."""
+
+    def __init__(self) -> None:
+        self._slots: Dict[str, _SessionSlot] = {}
+        self._inflight: Dict[Tuple[str, bytes], asyncio.Future] = {}
+
+        # Métricas
+        self.runs = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    @staticmethod
+    def _key(session_id: str, prompt: str) -> Tuple[str, bytes]:
+        return session_id, hashlib.sha256(prompt.strip().encode("utf-8")).digest()
+
+    def queue_depth(self, session_id: str) -> int:
+        slot = self._slots.get(session_id)
+        return slot.depth if slot else 0
+
+    async def run(
+        self,
+        session_id: str,
+        prompt: str,
+        fn: Callable[[], Awaitable[T]],
+    ) -> GateResult[T]:
+        key = self._key(session_id, prompt)
+        while True:
+            leader = self._inflight.get(key)
+            if leader is None:
+                break
+            try:
+                value = await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if leader.cancelled():
+                    continue  # el request original se canceló: este toma su lugar
+                raise
+            self.coalesced += 1
+            return GateResult(value, self.queue_depth(session_id), True)
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Evita "Future exception was never retrieved" si nadie más esperaba
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+
+        try:
+            async with self.exclusive(session_id) as depth:
+                self.runs += 1
+                value = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return GateResult(value, depth, False)
+        finally:
+            self._inflight.pop(key, None)
+
+    @asynccontextmanager
+    async def exclusive(self, session_id: str) -> AsyncIterator[int]:
+        """Espera el turno de la sesión y lo retiene durante el bloque; entrega la profundidad de cola."""
+        slot = self._slots.get(session_id)
+        if slot is None:
+            slot = self._slots[session_id] = _SessionSlot()
+        depth = slot.depth
+        slot.depth += 1
+        self.max_depth = max(self.max_depth, slot.depth)
+        waited_from = time.perf_counter()
+        try:
+            async with slot.lock:
+                record("session_wait", time.perf_counter() - waited_from)
+                yield depth
+        finally:
+            slot.depth -= 1
+            if slot.depth == 0 and self._slots.get(session_id) is slot:
+                del self._slots[session_id]
+
+    def stats(self) -> Dict[str, Any]:
+        busiest: Optional[Tuple[str, int]] = max(
+            ((sid, s.depth) for sid, s in self._slots.items()), key=lambda t: t[1], default=None
+        )
+        return {
+            "active_sessions": len(self._slots),
+            "inflight": len(self._inflight),
+            "max_queue_depth_now": busiest[1] if busiest else 0,
+            "max_queue_depth_seen": self.max_depth,
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+        }
+
+
+# Instancia compartida del proceso
+session_gate = SessionGate()
@@ -0,0 +1,273 @@
+# app/utils/session_journal.py
+"""
+Journal local (append-only) del backend de sesiones en memoria.
+
+Cada commit de `InMemorySessionStore` (append_message, add/discard de docs,
+set_profile, set_ocr_result, set_state, clear_session, expulsiones) se escribe
+como un registro. Al reiniciar el worker se carga el último snapshot y se
+reaplica el journal, así los flujos de justificación (OCR, estado de la
+conversación, `certificado_validado`) sobreviven a un deploy o a un OOM.
+
+Formato (little endian):
+  journal:   MAGIC(4) | época(u64) | registros...
+  snapshot:  MAGIC(4) | época_journal(u64) | offset_journal(u64) | registros...
+  registro:  largo(u32) | crc32(u32) | JSON utf-8
+
+- Durabilidad: cada registro se escribe con un solo `os.write` (sobrevive a la
+  caída del proceso); el `fsync` se agrupa cada `fsync_interval_s` en un hilo
+  aparte (protege ante caída de la máquina sin pagar un fsync por request).
+- Compactación en tres pasos, sin retener el lock del store mientras se
+  serializa: (1) bajo el lock, copia superficial del estado y posición actual
+  del journal; (2) fuera del lock, escribe `<path>.snap` (atómico con
+  os.replace) indicando qué época/offset del journal ya incluye; (3) bajo el
+  lock, reescribe el journal con la época siguiente conservando solo la cola
+  posterior a ese offset. Si el proceso muere entre (2) y (3), el replay lee
+  el journal viejo desde el offset registrado: nada se pierde ni se duplica.
+- La lectura usa mmap y recorre los registros por offset (sin copiar el
+  archivo); un registro incompleto o con CRC inválido al final se descarta.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_JOURNAL_MAGIC = b"MSJ1"
+_SNAPSHOT_MAGIC = b"MSS1"
+_FILE_HEADER = struct.Struct("<4sQ")
+_SNAPSHOT_HEADER = struct.Struct("<4sQQ")
+_RECORD_HEADER = struct.Struct("<II")
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _open_private(path: str):
+    """Abre para escritura con permisos 0600 (el estado incluye datos personales)."""
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb")
+
+
+class _RecordFile:
+    """
+    Lector de un archivo de registros vía mmap. `header` queda en None si el
+    archivo no existe. Tras iterar, `end` es el offset del último registro
+    válido (para truncar una cola corrupta).
+    """
+
+    def __init__(self, path: str, header: struct.Struct, magic: bytes) -> None:
+        self.path = path
+        self.header: Optional[tuple] = None
+        self.start = self.end = header.size
+        try:
+            self._size = os.path.getsize(path)
+        except FileNotFoundError:
+            self._size = 0
+        if self._size >= header.size:
+            with open(path, "rb") as f:
+                fields = header.unpack(f.read(header.size))
+            if fields[0] != magic:
+                raise ValueError(f"{path}: cabecera inválida")
+            self.header = fields[1:]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.header is None:
+            return
+        size = self._size
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            pos = self.end = self.start
+            while pos + _RECORD_HEADER.size <= size:
+                length, crc = _RECORD_HEADER.unpack_from(mm, pos)
+                start = pos + _RECORD_HEADER.size
+                end = start + length
+                if end > size:
+                    break  # registro truncado (caída a mitad de escritura)
+                payload = mm[start:end]
+                if zlib.crc32(payload) != crc:
+                    break
+                yield json.loads(payload)
+                pos = self.end = end
+
+
+class SessionJournal:
+    """Journal append-only + snapshot compactado de las sesiones en memoria."""
+
+    def __init__(self, path: str, *, fsync_interval_s: float = 0.05, compact_bytes: int = 64 * 1024 * 1024) -> None:
+        self.path = path
+        self.snapshot_path = path + ".snap"
+        self.fsync_interval_s = fsync_interval_s
+        self.compact_bytes = compact_bytes
+
+        self._fd: Optional[int] = None
+        self._epoch = 0
+        self._size = 0
+        self._dirty = False
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._syncer: Optional[threading.Thread] = None
+
+        # Métricas
+        self.appends = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        self.replayed = 0
+
+    # -------- Lectura (arranque) --------
+    def replay(
+        self,
+        restore_session: Callable[[Dict[str, Any]], None],
+        apply_record: Callable[[Dict[str, Any]], None],
+    ) -> int:
+        """
+        Carga el snapshot (`restore_session` por sesión) y luego el journal
+        (`apply_record` por registro). Deja el journal abierto para escribir.
+        Devuelve la cantidad de registros leídos.
+        """
+        count = 0
+        snapshot = _RecordFile(self.snapshot_path, _SNAPSHOT_HEADER, _SNAPSHOT_MAGIC)
+        for record in snapshot:
+            restore_session(record)
+            count += 1
+
+        journal = _RecordFile(self.path, _FILE_HEADER, _JOURNAL_MAGIC)
+        valid_end = 0
+        if journal.header is not None:
+            (journal_epoch,) = journal.header
+            snap_epoch, snap_offset = snapshot.header or (-1, 0)
+            if journal_epoch == snap_epoch:
+                # El snapshot se escribió pero el journal no alcanzó a rotar
+                journal.start = max(snap_offset, journal.start)
+            if journal_epoch >= snap_epoch:
+                for record in journal:
+                    apply_record(record)
+                    count += 1
+                valid_end = journal.end
+                self._epoch = journal_epoch
+            else:
+                logger.warning("[journal] journal anterior al snapshot (época %s < %s), se ignora", journal_epoch, snap_epoch)
+                self._epoch = snap_epoch + 1
+        elif snapshot.header is not None:
+            self._epoch = snapshot.header[0] + 1
+
+        self._open(truncate_to=valid_end)
+        self.replayed = count
+        return count
+
+    # -------- Escritura --------
+    def _open(self, truncate_to: int = 0) -> None:
+        with self._io_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+            if truncate_to >= _FILE_HEADER.size:
+                os.ftruncate(fd, truncate_to)  # descarta una cola corrupta
+                self._size = truncate_to
+            else:
+                os.ftruncate(fd, 0)
+                os.write(fd, _FILE_HEADER.pack(_JOURNAL_MAGIC, self._epoch))
+                os.fsync(fd)
+                self._size = _FILE_HEADER.size
+            self._fd = fd
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Escribe un registro. Debe llamarse bajo el lock del store (orden = orden de aplicación)."""
+        if self._fd is None:
+            self._open()
+        data = _encode(record)
+        with self._io_lock:
+            os.write(self._fd, data)
+            self._size += len(data)
+            self._dirty = True
+        self.appends += 1
+
+    def sync(self) -> None:
+        with self._io_lock:
+            if self._fd is not None and self._dirty:
+                os.fsync(self._fd)
+                self._dirty = False
+                self.fsyncs += 1
+
+    def needs_compaction(self) -> bool:
+        return self._size >= self.compact_bytes
+
+    def checkpoint(self) -> Tuple[int, int]:
+        """Paso 1 (bajo el lock del store): posición del journal que cubrirá el snapshot."""
+        return self._epoch, self._size
+
+    def write_snapshot(self, sessions: Iterable[Dict[str, Any]], checkpoint: Tuple[int, int]) -> None:
+        """Paso 2 (sin lock): escribe el snapshot con el estado copiado en `checkpoint`."""
+        epoch, offset = checkpoint
+        tmp = self.snapshot_path + ".tmp"
+        with _open_private(tmp) as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, epoch, offset))
+            for session in sessions:
+                f.write(_encode(session))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+    def rotate(self, checkpoint: Tuple[int, int]) -> None:
+        """Paso 3 (bajo el lock del store): journal nuevo con la cola posterior al checkpoint."""
+        epoch, offset = checkpoint
+        with self._io_lock:
+            if epoch != self._epoch or self._fd is None:
+                return
+            tail = os.pread(self._fd, self._size - offset, offset) if self._size > offset else b""
+            tmp = self.path + ".tmp"
+            with _open_private(tmp) as f:
+                f.write(_FILE_HEADER.pack(_JOURNAL_MAGIC, epoch + 1))
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+            self._epoch = epoch + 1
+            self._size = _FILE_HEADER.size + len(tail)
+            self._dirty = False
+        self.compactions += 1
+
+    # -------- fsync agrupado --------
+    def start(self) -> None:
+        if self._syncer is not None and self._syncer.is_alive():
+            return
+        self._stop.clear()
+        self._syncer = threading.Thread(target=self._sync_loop, name="session-journal-fsync", daemon=True)
+        self._syncer.start()
+
+    def _sync_loop(self) -> None:
+        while not self._stop.wait(self.fsync_interval_s):
+            try:
+                self.sync()
+            except OSError:
+                logger.exception("[journal] error en fsync")
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._syncer is not None:
+            self._syncer.join(timeout=2)
+            self._syncer = None
+        self.sync()
+        with self._io_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "epoch": self._epoch,
+            "bytes": self._size,
+            "appends": self.appends,
+            "fsyncs": self.fsyncs,
+            "compactions": self.compactions,
+            "replayed": self.replayed,
+        }
@@ -1,38 +1,341 @@
 # app/utils/session_store.py
+"""
+Fachada del estado de sesión. Las funciones de este módulo mantienen la API
+histórica (get_history, append_message, set_ocr_result, ...) y delegan en el
+backend configurado (`SessionStore`: memoria, SQLite o Redis).
 
-from typing import Dict, List, Set, Optional, Any
+Para un request con varias lecturas/escrituras usa `session_batch`: una sola
+lectura al entrar y un solo commit al salir. `session_batch` y `view_session`
+son async: con backends que bloquean (SQLite, Redis) la llamada corre en un
+hilo y no detiene el event loop; en memoria se ejecuta directo.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Set, Optional, Any, Tuple, TypeVar
 
-# Historias de chat
-_sessions: Dict[str, List[Dict[str, str]]] = {}
-# Documentos subidos (acta / cédula / certificados) por sesión
-_uploaded_docs: Dict[str, Set[str]] = {}
-# Perfiles de usuario por sesión
-_profiles: Dict[str, Dict[str, str]] = {}
-# Resultados de OCR/analizar-imágenes por sesión
-_ocr_results: Dict[str, Dict[str, Any]] = {}
+import anyio.to_thread
+
+from app.utils.session_backends import (
+    ALL_PARTS,
+    DOCS,
+    MESSAGES,
+    OCR,
+    PROFILE,
+    InMemorySessionStore,
+    Message,
+    MessagesView,
+    RedisSessionStore,
+    SessionSnapshot,
+    SessionStore,
+    SessionWrites,
+    SQLiteSessionStore,
+)
+from app.utils.conversation_state import LEGACY_TAGS, ConversationState, state_of
+from app.utils.session_events import OCR as OCR_EVENT, session_events
+from app.utils.session_gate import session_gate
+from app.utils.session_journal import SessionJournal
+from app.utils.stage_timer import stage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_store: Optional[SessionStore] = None
+_sweeper: Optional[asyncio.Task] = None
+
+
+# -------- Backend --------
+
+def create_session_store() -> SessionStore:
+    """
+    Construye el backend según la configuración:
+      SESSION_STORE_BACKEND = memory | sqlite | redis
+      SESSION_STORE_SQLITE_PATH, SESSION_STORE_REDIS_URL, SESSION_STORE_REDIS_PREFIX
+      SESSION_IDLE_TTL_S, SESSION_MAX_BYTES,
+      SESSION_COMPRESS_IDLE_S, SESSION_COMPRESS_MIN_BYTES,
+      SESSION_JOURNAL_PATH, SESSION_JOURNAL_FSYNC_MS, SESSION_JOURNAL_COMPACT_BYTES (solo memoria)
+    """
+    from app.core.config import settings
+
+    backend = (settings.session_store_backend or "memory").strip().lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore(settings.session_store_sqlite_path)
+    if backend == "redis":
+        return RedisSessionStore.from_url(
+            settings.session_store_redis_url,
+            prefix=settings.session_store_redis_prefix,
+        )
+    if backend != "memory":
+        raise ValueError(f"SESSION_STORE_BACKEND desconocido: {backend!r}")
+    journal = None
+    if settings.session_journal_path:
+        journal = SessionJournal(
+            settings.session_journal_path,
+            fsync_interval_s=settings.session_journal_fsync_ms / 1000,
+            compact_bytes=settings.session_journal_compact_bytes,
+        )
+    store = InMemorySessionStore(
+        idle_ttl_s=settings.session_idle_ttl_s,
+        max_bytes=settings.session_max_bytes,
+        compress_idle_s=settings.session_compress_idle_s,
+        compress_min_bytes=settings.session_compress_min_bytes,
+        journal=journal,
+    )
+    if journal is not None:
+        t0 = time.perf_counter()
+        count = store.restore()
+        logger.info(
+            "[session] journal restaurado: %d registros, %d sesiones en %.2fs",
+            count, store.stats()["sessions"], time.perf_counter() - t0,
+        )
+        if count:
+            store.compact()  # el próximo arranque solo lee el snapshot
+    return store
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        _store = create_session_store()
+    return _store
+
+def close_session_store() -> None:
+    """Cierra el backend activo (fsync final del journal, si lo hay)."""
+    close = getattr(_store, "close", None)
+    if close is not None:
+        close()
+
+def set_session_store(store: SessionStore) -> None:
+    """Reemplaza el backend activo (pruebas o arranque personalizado)."""
+    global _store
+    _store = store
+
+async def _offload(fn: Callable[..., T], *args: Any) -> T:
+    """Llamada al backend desde código async: en un hilo si el backend hace I/O bloqueante."""
+    if getattr(get_session_store(), "blocking", False):
+        return await anyio.to_thread.run_sync(fn, *args)
+    return fn(*args)
+
+
+def session_store_stats() -> Dict[str, Any]:
+    """Métricas del backend activo (sesiones, bytes, expulsiones) si las expone."""
+    store = get_session_store()
+    stats = getattr(store, "stats", None)
+    return {"backend": type(store).__name__, **(stats() if stats else {})}
+
+def session_memory(session_id: str) -> Optional[Dict[str, Any]]:
+    """Bytes estimados por parte (messages/docs/profile/ocr/state/total) de una sesión en memoria."""
+    usage = getattr(get_session_store(), "memory_usage", None)
+    return usage(session_id) if usage else None
+
+def largest_sessions(limit: int = 10) -> List[Tuple[str, int]]:
+    """Sesiones que más memoria ocupan: [(session_id, bytes)]."""
+    largest = getattr(get_session_store(), "largest_sessions", None)
+    return largest(limit) if largest else []
+
+
+# -------- Barrido de sesiones inactivas --------
+
+async def _sweep_loop(interval_s: float) -> None:
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            store = get_session_store()
+            expired = store.sweep_expired()
+            if expired:
+                logger.info("[session] %d sesiones expiradas por inactividad", expired)
+            compressed = store.compress_cold()
+            if compressed:
+                logger.info("[session] %d historiales comprimidos", compressed)
+            # La serialización del snapshot no debe bloquear el event loop
+            await asyncio.to_thread(store.maybe_compact)
+        except Exception:
+            logger.exception("[session] error en el barrido de sesiones")
+
+def start_session_sweeper(interval_s: Optional[float] = None) -> None:
+    """
+    Arranca el barrido periódico (debe llamarse dentro del event loop).
+    Solo aplica a backends con `sweep_expired` (memoria); SQLite/Redis no lo necesitan.
+    Además comprime historiales en frío y compacta el journal cuando corresponde.
+    """
+    global _sweeper
+    if not hasattr(get_session_store(), "sweep_expired"):
+        return
+    if _sweeper is not None and not _sweeper.done():
+        return
+    if interval_s is None:
+        from app.core.config import settings
+        interval_s = settings.session_sweep_interval_s
+    _sweeper = asyncio.create_task(_sweep_loop(interval_s), name="session-sweeper")
+
+async def stop_session_sweeper() -> None:
+    global _sweeper
+    if _sweeper is None:
+        return
+    _sweeper.cancel()
+    try:
+        await _sweeper
+    except asyncio.CancelledError:
+        pass
+    _sweeper = None
+
+
+# -------- Lectura/escritura por lotes --------
+
+class SessionBatch:
+    """
+    Vista de una sesión durante un request: lee el estado una vez y acumula
+    las escrituras hasta `flush()`. Las lecturas reflejan las escrituras
+    pendientes, igual que si se hubieran aplicado. Los eventos de la sesión
+    (`session_events`) se publican recién después del commit.
+    """
+
+    def __init__(self, session_id: str, snapshot: SessionSnapshot) -> None:
+        self.session_id = session_id
+        self._snap = snapshot
+        self._writes = SessionWrites()
+        self._events: List[Tuple[str, Dict[str, Any]]] = []
+
+    # Lecturas
+    @property
+    def history(self) -> List[Message]:
+        return self._snap.messages
+
+    @property
+    def uploaded_docs(self) -> Set[str]:
+        return self._snap.docs
+
+    @property
+    def profile(self) -> Optional[Dict[str, str]]:
+        return self._snap.profile
+
+    @property
+    def ocr_result(self) -> Optional[Dict[str, Any]]:
+        return self._snap.ocr
+
+    @property
+    def state(self) -> ConversationState:
+        """Estado de la conversación (deducido del historial si la sesión aún no lo guarda)."""
+        return state_of(self._snap)
+
+    # Escrituras
+    def append_message(self, role: str, content: str) -> None:
+        msg = Message(role, content)
+        self._snap.messages.append(msg)
+        self._writes.messages.append(msg)
+
+    def add_uploaded_doc(self, doc_type: str) -> None:
+        self._snap.docs.add(doc_type)
+        self._writes.add_docs.add(doc_type)
+        self._writes.discard_docs.discard(doc_type)
+
+    def discard_uploaded_doc(self, doc_type: str) -> None:
+        self._snap.docs.discard(doc_type)
+        self._writes.discard_docs.add(doc_type)
+        self._writes.add_docs.discard(doc_type)
+
+    def set_profile(self, profile: Dict[str, str]) -> None:
+        self._snap.profile = profile
+        self._writes.profile = profile
+
+    def set_ocr_result(self, result: Dict[str, Any]) -> None:
+        """Guarda el OCR, pasa la conversación a `certificado_recibido` y lo avisa a los suscriptores."""
+        state = self.state
+        self._snap.ocr = result
+        self._writes.ocr = result
+        self.set_state(state.document(result))
+        self._events.append((OCR_EVENT, result))
+
+    def set_state(self, state: ConversationState) -> None:
+        self._snap.state = self._writes.state = state.to_dict()
+        # Las etiquetas que antes guardaban parte del estado ya no se usan
+        for tag in LEGACY_TAGS & self._snap.docs:
+            self.discard_uploaded_doc(tag)
+
+    def clear(self) -> None:
+        """Limpieza total de la sesión (descarta también lo pendiente)."""
+        self._snap = SessionSnapshot()
+        self._writes = SessionWrites(clear=set(ALL_PARTS))
+        self._events = []
+
+    def discard(self) -> None:
+        """Descarta lo pendiente: el request termina sin guardar nada en la sesión."""
+        self._writes = SessionWrites()
+        self._events = []
+
+    def flush(self) -> None:
+        """Commit de lo pendiente (síncrono; `session_batch` lo saca del event loop si bloquea)."""
+        if not self._writes.is_empty():
+            get_session_store().commit(self.session_id, self._writes)
+        self._writes = SessionWrites()
+        events, self._events = self._events, []
+        for kind, data in events:
+            session_events.publish(self.session_id, kind, data)
+
+@asynccontextmanager
+async def session_batch(session_id: str) -> AsyncIterator[SessionBatch]:
+    """
+    Abre la sesión (una lectura) y hace commit de todo al salir.
+    Si el bloque lanza una excepción, las escrituras pendientes se descartan.
+    Mientras el bloque está abierto, el backend en memoria no expulsa la sesión.
+    """
+    store = get_session_store()
+    pin = getattr(store, "pin", None)
+    if pin is not None:
+        pin(session_id)
+    try:
+        with stage("session_load"):
+            batch = SessionBatch(session_id, await _offload(store.load, session_id))
+        yield batch
+        with stage("session_commit"):
+            await _offload(batch.flush)
+    finally:
+        if pin is not None:
+            store.unpin(session_id)
+
+def load_session(session_id: str) -> SessionSnapshot:
+    """Lectura completa de la sesión en un solo acceso al backend."""
+    return get_session_store().load(session_id)
+
+async def view_session(session_id: str) -> SessionSnapshot:
+    """
+    Lectura completa de solo lectura: en memoria, `messages` es una
+    `MessagesView` sobre el historial (sin copiarlo). Otros backends ya
+    devuelven una lista nueva, así que se usa `load` tal cual.
+    """
+    store = get_session_store()
+    view = getattr(store, "view", None)
+    return await _offload(view or store.load, session_id)
+
+def _commit(session_id: str, writes: SessionWrites) -> None:
+    get_session_store().commit(session_id, writes)
 
 
 # -------- Historial de chat --------
 
-def get_history(session_id: str) -> List[Dict[str, str]]:
-    return _sessions.setdefault(session_id, [])
+def get_history(session_id: str) -> List[Message]:
+    return get_session_store().load(session_id, (MESSAGES,)).messages
 
 def append_message(session_id: str, role: str, content: str) -> None:
-    _sessions.setdefault(session_id, []).append({"role": role, "content": content})
+    _commit(session_id, SessionWrites(messages=[Message(role, content)]))
 
 # Wrapper de solo-lectura (útil para summary)
-def get_session_messages(session_id: str) -> List[Dict[str, str]]:
+def get_session_messages(session_id: str) -> List[Message]:
     """Devuelve una copia del historial de la sesión (o lista vacía)."""
-    return list(_sessions.get(session_id, []))
+    return list(get_history(session_id))
 
 
 # -------- Documentos subidos --------
 
 def get_uploaded_docs(session_id: str) -> Set[str]:
-    return _uploaded_docs.setdefault(session_id, set())
+    return get_session_store().load(session_id, (DOCS,)).docs
 
 def add_uploaded_doc(session_id: str, doc_type: str) -> None:
-    _uploaded_docs.setdefault(session_id, set()).add(doc_type)
+    _commit(session_id, SessionWrites(add_docs={doc_type}))
+
+def discard_uploaded_doc(session_id: str, doc_type: str) -> None:
+    _commit(session_id, SessionWrites(discard_docs={doc_type}))
 
 
 # -------- Perfil del estudiante --------
@@ -42,16 +345,16 @@ def get_profile(session_id: str) -> Optional[Dict[str, str]]:
     Devuelve el perfil guardado (nombre, apodo, cédula, carrera, facultad,
     semestre_actual, correo) o None si aún no existe.
     """
-    return _profiles.get(session_id)
+    return get_session_store().load(session_id, (PROFILE,)).profile
 
 def set_profile(session_id: str, profile: Dict[str, str]) -> None:
     """Guarda o reemplaza el perfil del estudiante para la sesión."""
-    _profiles[session_id] = profile
+    _commit(session_id, SessionWrites(profile=profile))
 
 
 # -------- Estado OCR / Analyze Images --------
 
-def set_ocr_result(session_id: str, result: Dict[str, Any]) -> None:
+async def set_ocr_result(session_id: str, result: Dict[str, Any]) -> None:
     """
     Guarda el resultado de análisis de imágenes para la sesión.
     Ejemplo de 'result':
@@ -61,43 +364,52 @@ def set_ocr_result(session_id: str, result: Dict[str, Any]) -> None:
         "escalated": "justificado" | "",
         "ts": "2025-08-14T12:34:56Z"
       }
+    La conversación pasa a `certificado_recibido` (el agent lo notifica una vez) y
+    las conexiones WebSocket abiertas de la sesión reciben el resultado al instante.
+    Lectura y commit van en un `session_batch` tomado con el turno de la sesión
+    (`session_gate.exclusive`): un turno del agente en curso no pisa el resultado.
     """
-    _ocr_results[session_id] = result
+    async with session_gate.exclusive(session_id), session_batch(session_id) as session:
+        session.set_ocr_result(result)
 
 def get_ocr_result(session_id: str) -> Optional[Dict[str, Any]]:
     """Devuelve el último resultado de OCR para la sesión o None."""
-    return _ocr_results.get(session_id)
+    return get_session_store().load(session_id, (OCR,)).ocr
+
+
+# -------- Estado de la conversación --------
+
+def get_state(session_id: str) -> ConversationState:
+    """Estado de la conversación (deducido del historial si la sesión aún no lo guarda)."""
+    return state_of(get_session_store().load(session_id))
+
+def set_state(session_id: str, state: ConversationState) -> None:
+    _commit(session_id, SessionWrites(state=state.to_dict()))
 
 
 # -------- Limpieza / Reset de contexto --------
 
 def clear_history(session_id: str) -> None:
     """Elimina por completo el historial de chat de la sesión."""
-    _sessions.pop(session_id, None)
+    _commit(session_id, SessionWrites(clear={MESSAGES}))
 
 def clear_uploaded_docs(session_id: str) -> None:
     """Elimina los documentos/etiquetas subidos asociados a la sesión."""
-    _uploaded_docs.pop(session_id, None)
+    _commit(session_id, SessionWrites(clear={DOCS}))
 
 def clear_profile(session_id: str) -> None:
     """Elimina el perfil almacenado para la sesión."""
-    _profiles.pop(session_id, None)
+    _commit(session_id, SessionWrites(clear={PROFILE}))
 
 def clear_ocr_result(session_id: str) -> None:
     """Elimina el estado de OCR/Analyze Images para la sesión."""
-    _ocr_results.pop(session_id, None)
+    _commit(session_id, SessionWrites(clear={OCR}))
 
 def clear_session(session_id: str) -> None:
-    """Limpieza total: historial + docs + perfil + OCR para la sesión."""
-    clear_history(session_id)
-    clear_uploaded_docs(session_id)
-    clear_profile(session_id)
-    clear_ocr_result(session_id)
+    """Limpieza total: historial + docs + perfil + OCR + estado para la sesión."""
+    _commit(session_id, SessionWrites(clear=set(ALL_PARTS)))
 
 # (Opcional) Reset global del entorno de pruebas
 def clear_all() -> None:
-    """Borra todas las sesiones, documentos, perfiles y OCR en memoria."""
-    _sessions.clear()
-    _uploaded_docs.clear()
-    _profiles.clear()
-    _ocr_results.clear()
+    """Borra todas las sesiones, documentos, perfiles, OCR y estados del backend."""
+    get_session_store().clear_all()
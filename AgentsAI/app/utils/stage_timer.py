@@ -0,0 +1,89 @@
+# app/utils/stage_timer.py
+"""
+Tiempos por etapa de un request (auth, escalamiento, Manager, handoffs,
+vector search, Banner, llamadas a Azure…), para saber en qué se fue un turno lento.
+
+- `ServerTimingMiddleware` (app.core.middleware) abre un `StageTimings` por
+  request en un ContextVar y lo emite como header `Server-Timing`.
+- El código instrumentado marca etapas con `with stage("nombre"):` o
+  `record("nombre", segundos)`; las tareas e hilos creados dentro del request
+  heredan el mismo `StageTimings`. Una etapa repetida suma sus duraciones.
+- Con SERVER_TIMING_META=1 los tiempos también van en `meta.timings` de
+  `success_response`.
+
+Si SERVER_TIMING está apagado no hay `StageTimings` activo y `stage()` solo
+hace un `ContextVar.get()`.
+"""
+from __future__ import annotations
+
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+_current: ContextVar[Optional["StageTimings"]] = ContextVar("stage_timings", default=None)
+
+# Nombres de métrica válidos en Server-Timing (token HTTP)
+_INVALID_NAME = re.compile(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]")
+
+
+class StageTimings:
+    """Duración acumulada (ms) por etapa, en orden de primera aparición."""
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def as_meta(self) -> Dict[str, float]:
+        out = {name: round(ms, 1) for name, ms in self.stages.items()}
+        out["total"] = round(self.total_ms(), 1)
+        return out
+
+    def header(self) -> str:
+        parts = [f"{_INVALID_NAME.sub('_', name)};dur={ms:.1f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(parts)
+
+
+def start() -> StageTimings:
+    """Abre la medición del request actual (lo llama el middleware)."""
+    timings = StageTimings()
+    _current.set(timings)
+    return timings
+
+
+def current() -> Optional[StageTimings]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class stage:
+    """`with stage("manager"):` suma la duración del bloque a la etapa (no-op si no se mide)."""
+
+    __slots__ = ("name", "_timings", "_t0")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "stage":
+        self._timings = _current.get()
+        if self._timings is not None:
+            self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._timings is not None:
+            self._timings.add(self.name, time.perf_counter() - self._t0)
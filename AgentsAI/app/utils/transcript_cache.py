@@ -0,0 +1,102 @@
+# app/utils/transcript_cache.py
+"""
+Caché por sesión del tamaño (tokens estimados) del transcript del Manager
+("Estudiante: ..." / "Mentor: ...").
+
+La ventana de contexto solo necesita saber si el transcript completo cabe en
+el presupuesto; el texto que se envía ya no es el transcript plano, así que
+no se guarda. El historial solo crece por append: cada turno suma el largo de
+los mensajes nuevos al conteo cacheado para ese número de mensajes. Si el
+historial no coincide con lo cacheado (reinicio, expiración, sesión atendida
+en otro worker), se recuenta desde cero.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata (≈ 4 caracteres por token en español)."""
+    return _chars_to_tokens(len(text))
+
+
+def _chars_to_tokens(chars: int) -> int:
+    return (chars + 3) // 4
+
+
+def render_line(msg: Mapping[str, str]) -> str:
+    prefix = "Estudiante:" if msg["role"] == "user" else "Mentor:"
+    return f"{prefix} {msg['content']}\n"
+
+
+class _Counted:
+    __slots__ = ("chars", "count", "last")
+
+    def __init__(self) -> None:
+        self.chars = 0             # largo del transcript de los primeros `count` mensajes
+        self.count = 0
+        self.last: Optional[Mapping[str, str]] = None  # último mensaje contado (validación)
+
+
+class TranscriptCache:
+    """LRU acotado del tamaño del transcript por `session_id`."""
+
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Counted]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.hits = 0
+        self.rebuilds = 0
+
+    def tokens(self, session_id: str, history: Sequence[Mapping[str, str]]) -> int:
+        """
+        Tokens estimados del transcript completo de `history` (igual a
+        `estimate_tokens` sobre el render). Costo: solo los mensajes nuevos.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+            n = len(history)
+            if (
+                entry is None
+                or entry.count > n
+                or (entry.count and history[entry.count - 1] != entry.last)
+            ):
+                entry = _Counted()
+                self._entries[session_id] = entry
+                self.rebuilds += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+
+            if entry.count < n:
+                entry.chars += sum(len(render_line(m)) for m in history[entry.count:n])
+                entry.count = n
+                entry.last = history[n - 1]
+            return _chars_to_tokens(entry.chars)
+
+    def discard(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "rebuilds": self.rebuilds,
+        }
+
+
+# Instancia compartida del proceso
+transcript_cache = TranscriptCache()
@@ -0,0 +1,101 @@
+"""
+Benchmark de autenticación (get_token_payload)
+==============================================
+Mide el costo por request de validar un Bearer JWT usando un JWKS local
+(LocalJWKS), sin red ni Azure AD.
+
+Uso:
+    cd AgentsAI
+    python testing/bench_auth.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# Configuración mínima de seguridad ANTES de importar app.core.security
+os.environ.setdefault("TENANT_ID", "00000000-0000-0000-0000-000000000000")
+os.environ.setdefault("CLIENT_ID", "11111111-1111-1111-1111-111111111111")
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import HTTPException  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+
+from app.core import security  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.core.jwks import JWKSKeyStore, LocalJWKS  # noqa: E402
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+ITERACIONES = int(os.getenv("BENCH_ITERACIONES", "2000"))
+
+
+def _credenciales(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+async def _medir(nombre: str, token: str, n: int = ITERACIONES) -> None:
+    creds = _credenciales(token)
+    inicio = time.perf_counter()
+    for _ in range(n):
+        try:
+            await security.get_token_payload(creds)
+        except HTTPException:
+            pass
+    total = time.perf_counter() - inicio
+    print(f"{nombre:<40} {total / n * 1e6:>10.1f} µs/request")
+
+
+async def _rafaga(token: str, concurrencia: int) -> None:
+    """Ráfaga de validaciones simultáneas (sin caché): mide el uso del cupo de hilos."""
+    creds = _credenciales(token)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(security.get_token_payload(creds) for _ in range(concurrencia)))
+    total = time.perf_counter() - inicio
+    print(f"{f'ráfaga x{concurrencia}':<40} {total * 1e3:>10.1f} ms  (cupo auth: {settings.auth_thread_limit} hilos)")
+
+
+async def main():
+    local = LocalJWKS()
+    store = JWKSKeyStore(["https://local.test/discovery/keys"], fetcher=local.fetch)
+    security.set_key_store(store)
+    await store.prefetch()
+
+    iss = security.ISSUER_CANDIDATES[0]
+    aud = security.AUDIENCE_CANDIDATES[0]
+    exp = int(time.time()) + 3600
+
+    valido = local.issue({"iss": iss, "aud": aud, "exp": exp, "sub": "bench"})
+    kid_desconocido = LocalJWKS(kid="rotada").issue({"iss": iss, "aud": aud, "exp": exp})
+    issuer_ajeno = local.issue({"iss": "https://evil.example/", "aud": aud, "exp": exp})
+    audience_ajena = local.issue({"iss": iss, "aud": "api://otra-app", "exp": exp})
+    expirado = local.issue({"iss": iss, "aud": aud, "exp": int(time.time()) - 60})
+    firma_invalida = valido[:-6] + ("AAAAAA" if not valido.endswith("AAAAAA") else "BBBBBB")
+
+    print("=" * 60)
+    print(f"Issuers: {len(security.ISSUER_CANDIDATES)}  Audiences: {len(security.AUDIENCE_CANDIDATES)}")
+    print("=" * 60)
+    security.token_cache.max_entries = 0
+    await _medir("token válido (sin caché)", valido)
+    await _rafaga(valido, 200)
+    security.token_cache.max_entries = settings.auth_token_cache_size or 1024
+    # Rechazos: deben costar lo mismo o menos que un token válido sin caché,
+    # sin importar cuántos issuers/audiences candidatos haya configurados.
+    await _medir("issuer no aceptado", issuer_ajeno)
+    await _medir("audience no aceptada", audience_ajena)
+    await _medir("kid desconocido", kid_desconocido)
+    await _medir("firma inválida", firma_invalida)
+    await _medir("token expirado", expirado)
+    print("-" * 60)
+    await _medir("token válido (caché de verificados)", valido)
+    print("=" * 60)
+    print(f"Descargas de JWKS: {local.fetch_count}  (store: {store.stats()})")
+    print(f"Caché de tokens: {security.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
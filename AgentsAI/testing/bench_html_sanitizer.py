@@ -0,0 +1,209 @@
+"""
+Saneador HTML de respuestas del agente: corpus dorado + micro-benchmark
+========================================================================
+Compara el saneador de una sola pasada (app.utils.html_sanitizer) con la
+versión anterior de `_sanitize_html` (varias pasadas de regex, copiada abajo
+tal cual como referencia):
+
+1. Corpus dorado: la salida por lotes debe ser idéntica byte a byte, y la de
+   streaming también (partiendo cada respuesta en fragmentos de varios tamaños)
+   cuando la respuesta empieza con <p> o es texto plano, que es lo que garantiza
+   el saneador en streaming.
+2. Tiempo por respuesta: versión anterior, nueva por lotes, nueva en streaming y,
+   como referencia, volver a sanear el texto acumulado en cada delta.
+
+Uso:
+    cd AgentsAI
+    python testing/bench_html_sanitizer.py
+"""
+
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils.html_sanitizer import StreamingHtmlSanitizer, sanitize_html  # noqa: E402
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+ITERACIONES = int(os.getenv("BENCH_ITERACIONES", "2000"))
+TAMANOS_FRAGMENTO = (1, 2, 3, 5, 8, 13, 40)   # caracteres por delta en streaming
+TAMANO_DELTA_BENCH = int(os.getenv("BENCH_TAMANO_DELTA", "6"))  # ~ un token
+
+# Respuestas reales y variantes típicas del Manager / sub-agentes
+CORPUS = [
+    "<p>Hola Ana, claro que sí. ¿En qué fecha fue tu inasistencia?</p>",
+    "<p>Hola Ana 😊</p><p>Para justificar tu falta necesito el certificado médico.</p>",
+    "--mentor--",
+    "  --mentor--\n",
+    "<p>--mentor--</p>",
+    "```html\n<p>Tu certificado está completo.</p>\n```",
+    "```\n<p>Gracias por escribir.</p>\n```",
+    "<pHola Ana, espero que te mejores pronto.</p>",
+    "<p>Hola</p><pNo olvides subir tu certificado.</p>",
+    "Hola Ana, claro que sí.\n\nPara justificar tu falta debes subir el certificado en el chat.",
+    "Hola Ana,\npor favor sube el certificado.\nGracias.",
+    "Hola Ana  \n\n  Gracias por avisar.  \n\n\n\nSaludos",
+    "Primero:\r\n- sube el certificado\r\n- espera la revisión\r\n\r\nTe aviso por correo.",
+    "Hola \n \nAna",
+    "Hola\n \n\nAna",
+    "",
+    "   \n\n  ",
+    "<p>Revisa el <a href=\"https://www.udla.edu.ec/reglamento\" target=\"_blank\">reglamento</a>.</p>",
+    "Puedes revisar el <a href=\"https://www.udla.edu.ec/faq\">FAQ</a> para más detalles.",
+    "<p>Hola<br>¿cómo estás?</p>",
+    "Hola<br>Ana",
+    "<p>Hola</p><script>alert('x')</script><p>Chao</p>",
+    "<p>Hola</p> <script>fetch('/x')</script>",
+    "<script>alert(1)</script> <p>Hola</p>",
+    "<p>Hola</p><SCRIPT type=\"text/javascript\">\nalert(1)\n</SCRIPT>",
+    "<p>Tu justificación del 03/03 fue aprobada.</p>\n\n",
+    "<p>Claro te comento, el estado de tu justificación es: Aprobado (última actualización: 2025-03-04).</p>",
+    "Para justificar una falta debes subir el certificado en el chat.",
+    "Hola Ana, ```html\n<p>",
+    "<p>Línea 1</p>\n<p>Línea 2</p>\r\n<p>Línea 3</p>",
+    "\n\n<p>Hola</p>\n\n",
+    "Hola</p>",
+    "<p>Hola Ana, espero que te mejores pronto. " + "Recuerda subir el certificado. " * 30 + "</p>",
+    "Hola Ana.\n\n" + "Recuerda subir el certificado a tiempo.\n" * 20,
+]
+
+# Diferencias deliberadas con la versión anterior (no cuentan como fallo; se muestran)
+DIFERENCIAS = [
+    "<p onclick='x'>Hola</p>",                       # <p> con atributos: antes "<p>>Hola</p>"
+    "<p>Hola</p><img src=x onerror=alert(1)>",       # tags fuera de la lista permitida
+    "<p>Hola</p><iframe src='https://x'></iframe>",
+    "<p>Hola</p><script>alert(1)",                   # <script> sin cerrar
+    "<p>Hola onclick=\"x\" fuera de un tag</p>",     # on*= solo se quita dentro de tags
+    "<p>Haz clic <a href=\"#\" onclick=\"robar()\">aquí</a>.</p>",  # <a>: solo href http(s)/mailto, target, rel
+    "Texto con <a href='#' onmouseover='x()'>enlace</a> y nada más",
+    "<p><a href=# onclick=alert(1)>x</a></p>",        # atributos sin comillas: antes pasaban
+    "<p><a href=\"javascript:alert(1)\">x</a></p>",
+    "<p>3 < 5 y 7 > 2</p>",                         # "<" que no abre un tag permitido → "&lt;"
+    "Te quiero <3",
+    "Hola <img src=x onerror=alert(1)//",             # tag sin ">": antes quedaba vivo en el HTML
+]
+
+
+# ============================================================================
+# REFERENCIA: versión anterior (agent.py)
+# ============================================================================
+
+def _sanitize_html_anterior(text: str) -> str:
+    if text is None:
+        return "<p></p>"
+
+    t = str(text).strip()
+
+    # Si el modelo devuelve solo el handoff
+    if t == "--mentor--":
+        return "<p>--mentor--</p>"
+
+    # Elimina fences de markdown si los hubiera
+    t = re.sub(r"```(?:html)?", "", t).replace("```", "").strip()
+
+    # Arreglar tags malformados como "<pTexto" → "<p>Texto"
+    t = re.sub(r"<p([^>])", r"<p>\1", t)
+
+    # Detectar si ya tiene tags HTML válidos
+    has_html = bool(re.search(r"<[a-zA-Z][^>]*>", t))
+
+    if has_html:
+        # El LLM generó HTML intencionalmente, lo dejamos pasar
+        # Solo sanitizamos scripts y eventos peligrosos
+        t = re.sub(r'<script[^>]*>.*?</script>', '', t, flags=re.IGNORECASE | re.DOTALL)
+        t = re.sub(r'\son\w+\s*=\s*["\'][^"\']*["\']', '', t, flags=re.IGNORECASE)
+
+        # Si ya hay estructura <p>, retornar como está
+        if "<p>" in t:
+            return t
+
+    # Si NO hay HTML, es texto plano: convertir a párrafos
+    t = t.replace("\r\n", "\n")
+
+    # Párrafos por doble salto de línea
+    paras = [seg.strip() for seg in re.split(r"\n{2,}", t) if seg.strip()]
+    if not paras:
+        return "<p></p>"
+
+    parts = []
+    for seg in paras:
+        # Convertir saltos simples en <br>
+        seg_html = seg.replace("\n", "<br>")
+        parts.append(f"<p>{seg_html}</p>")
+
+    return "".join(parts)
+
+
+def _streaming(text: str, size: int) -> str:
+    sanitizer = StreamingHtmlSanitizer()
+    out = [sanitizer.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    out.append(sanitizer.close())
+    return "".join(out)
+
+
+def _verificar() -> int:
+    fallos = 0
+    for texto in CORPUS:
+        esperado = _sanitize_html_anterior(texto)
+        obtenido = sanitize_html(texto)
+        if obtenido != esperado:
+            fallos += 1
+            print(f"[lotes] {texto!r}\n  esperado: {esperado!r}\n  obtenido: {obtenido!r}")
+        if not esperado.startswith("<p>"):
+            continue
+        for size in TAMANOS_FRAGMENTO:
+            streamed = _streaming(texto, size)
+            if streamed != esperado:
+                fallos += 1
+                print(f"[stream {size}] {texto!r}\n  esperado: {esperado!r}\n  obtenido: {streamed!r}")
+                break
+    for texto in DIFERENCIAS:
+        esperado = sanitize_html(texto)
+        for size in TAMANOS_FRAGMENTO:
+            streamed = _streaming(texto, size)
+            if streamed != esperado:
+                fallos += 1
+                print(f"[stream {size}] {texto!r}\n  esperado: {esperado!r}\n  obtenido: {streamed!r}")
+                break
+    return fallos
+
+
+def _resanear_acumulado(text: str) -> str:
+    out = ""
+    for i in range(TAMANO_DELTA_BENCH, len(text) + TAMANO_DELTA_BENCH, TAMANO_DELTA_BENCH):
+        out = sanitize_html(text[:i])
+    return out
+
+
+def _medir(nombre: str, fn) -> None:
+    inicio = time.perf_counter()
+    for _ in range(ITERACIONES):
+        for texto in CORPUS:
+            fn(texto)
+    total = time.perf_counter() - inicio
+    print(f"{nombre:<36}{total / (ITERACIONES * len(CORPUS)) * 1e6:>10.1f} µs/respuesta")
+
+
+def main() -> None:
+    fallos = _verificar()
+    print(f"Corpus dorado: {len(CORPUS)} respuestas, {fallos} diferencias\n")
+    print("Diferencias deliberadas:")
+    for texto in DIFERENCIAS:
+        print(f"  {texto!r}\n    antes: {_sanitize_html_anterior(texto)!r}\n    ahora: {sanitize_html(texto)!r}")
+    print()
+    _medir("anterior (varias pasadas)", _sanitize_html_anterior)
+    _medir("una pasada (lotes)", sanitize_html)
+    _medir(f"una pasada (stream, {TAMANO_DELTA_BENCH} car/delta)", lambda t: _streaming(t, TAMANO_DELTA_BENCH))
+    _medir("re-saneo del acumulado por delta", _resanear_acumulado)
+    if fallos:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
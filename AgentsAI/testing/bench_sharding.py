@@ -0,0 +1,68 @@
+"""
+Benchmark del anillo de sesiones (app.core.sharding.HashRing)
+=============================================================
+Mide el reparto de sesiones entre workers y cuántas cambian de dueño cuando
+un worker entra o sale (idealmente ~1/N), además del costo de `owner()`.
+
+Uso:
+    cd AgentsAI
+    python testing/bench_sharding.py
+"""
+
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.sharding import HashRing  # noqa: E402
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SESIONES = int(os.getenv("BENCH_SESIONES", "100000"))
+WORKERS = int(os.getenv("BENCH_WORKERS", "4"))
+VNODES = int(os.getenv("BENCH_VNODES", "128"))
+
+
+def _asignacion(ring: HashRing, sesiones):
+    return {sid: ring.owner(sid) for sid in sesiones}
+
+
+def _movidas(antes, despues) -> float:
+    return sum(1 for sid in antes if antes[sid] != despues[sid]) / len(antes) * 100
+
+
+def main():
+    nodos = [f"http://worker-{i}:8000" for i in range(WORKERS)]
+    sesiones = [f"sesion-{i}" for i in range(SESIONES)]
+    ring = HashRing(nodos, vnodes=VNODES)
+
+    inicio = time.perf_counter()
+    base = _asignacion(ring, sesiones)
+    costo = (time.perf_counter() - inicio) / SESIONES * 1e6
+
+    print("=" * 60)
+    print(f"Sesiones: {SESIONES}  Workers: {WORKERS}  vnodes: {VNODES}")
+    print("=" * 60)
+    carga = Counter(base.values())
+    ideal = SESIONES / WORKERS
+    for nodo in nodos:
+        print(f"{nodo:<28} {carga[nodo]:>8}  ({carga[nodo] / ideal * 100:5.1f}% del ideal)")
+    print(f"{'owner()':<28} {costo:>8.2f} µs/sesión")
+    print("-" * 60)
+
+    ring.add(f"http://worker-{WORKERS}:8000")
+    print(f"{'entra 1 worker':<28} {_movidas(base, _asignacion(ring, sesiones)):>7.1f}% movidas  (ideal {100 / (WORKERS + 1):.1f}%)")
+
+    ring.set_nodes(nodos)
+    ring.remove(nodos[0])
+    print(f"{'sale 1 worker':<28} {_movidas(base, _asignacion(ring, sesiones)):>7.1f}% movidas  (ideal {100 / WORKERS:.1f}%)")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark del tamaño del transcript del Manager (app.utils.transcript_cache)
+============================================================================
+Simula sesiones de N turnos y compara, turno a turno, estimar los tokens
+renderizando todo el historial con el conteo cacheado que solo suma los
+mensajes nuevos (lo que usa la ventana de contexto para decidir si compacta).
+
+Uso:
+    cd AgentsAI
+    python testing/bench_transcript.py
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils.session_backends import Message  # noqa: E402
+from app.utils.transcript_cache import TranscriptCache, estimate_tokens, render_line  # noqa: E402
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+TURNOS = int(os.getenv("BENCH_TURNOS", "200"))
+SESIONES = int(os.getenv("BENCH_SESIONES", "20"))
+
+
+def _tokens_completo(history) -> int:
+    """Render completo del historial: O(n) operaciones Python por turno."""
+    return estimate_tokens("".join(render_line(m) for m in history))
+
+
+def _conversacion(construir) -> float:
+    """Tiempo total de construir el prompt en cada turno de SESIONES conversaciones."""
+    total = 0.0
+    for s in range(SESIONES):
+        history = []
+        for turno in range(TURNOS):
+            history.append(Message("user", f"Pregunta {turno}: ¿cómo justifico una falta del día {turno}?"))
+            inicio = time.perf_counter()
+            construir(f"sesion-{s}", history)
+            total += time.perf_counter() - inicio
+            history.append(Message("assistant", f"<p>Respuesta {turno} con el detalle del proceso de justificación.</p>" * 3))
+    return total
+
+
+def main():
+    cache = TranscriptCache()
+    # Verificación: ambos caminos dan exactamente el mismo conteo
+    history = []
+    for turno in range(TURNOS):
+        history.append(Message("user", f"hola {turno}"))
+        assert _tokens_completo(history) == cache.tokens("check", history)
+        history.append(Message("assistant", f"<p>ok {turno}</p>"))
+    cache.clear()
+
+    completo = _conversacion(lambda sid, h: _tokens_completo(h))
+    cacheado = _conversacion(cache.tokens)
+    turnos = TURNOS * SESIONES
+
+    print("=" * 60)
+    print(f"Sesiones: {SESIONES}  Turnos por sesión: {TURNOS}")
+    print("=" * 60)
+    print(f"{'render completo':<32} {completo / turnos * 1e6:>10.1f} µs/turno")
+    print(f"{'conteo cacheado':<32} {cacheado / turnos * 1e6:>10.1f} µs/turno")
+    print(f"{'aceleración':<32} {completo / cacheado:>10.1f}x")
+    print(f"Caché: {cache.stats()}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Llamadas al modelo por ejecución del Manager (handoffs a FAQ / Inquirer / Operator)
+===================================================================================
+Ejecuta el Manager real con un modelo simulado (sin red) que siempre hace lo
+que pide el prompt: handoff al sub-agente, llamada a su herramienta y, si el
+SDK vuelve a llamar al modelo, eco del resultado. Compara la configuración
+anterior de los sub-agentes (`run_llm_again`) con la actual (terminan con el
+primer resultado de la herramienta) y muestra llamadas al modelo por ejecución
+y la latencia estimada con LATENCIA_MODELO_S por llamada.
+
+Uso:
+    cd AgentsAI
+    python testing/bench_turns.py
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from agents import Agent, FunctionTool, ModelResponse, Runner, Usage, function_tool  # noqa: E402
+from agents.models.interface import Model  # noqa: E402
+from openai.types.responses import (  # noqa: E402
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+)
+
+from app.agents.faq_agent import faq_agent  # noqa: E402
+from app.agents.inquirer_agent import inquirer_agent  # noqa: E402
+from app.agents.manager_agent import manager_agent  # noqa: E402
+from app.agents.operator_agent import operator_agent  # noqa: E402
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+EJECUCIONES = int(os.getenv("BENCH_EJECUCIONES", "20"))
+LATENCIA_MODELO_S = float(os.getenv("BENCH_LATENCIA_MODELO_S", "1.5"))
+
+# Herramientas sin red con el mismo nombre que las reales
+STUBS = {
+    "search_faq": "Para justificar una falta debes subir el certificado en el chat.",
+    "case_status_udla": "<p>Tu justificación del 03/03 fue aprobada.</p>",
+    "classify_justification_case": '{"case": "deportiva", "required_doc": "Certificado", "follow_up": ["¿En qué fecha?"]}',
+}
+
+
+def _stub_tool(tool: FunctionTool) -> FunctionTool:
+    text = STUBS[tool.name]
+
+    @function_tool(name_override=tool.name)
+    def stub(query: str) -> str:
+        return text
+
+    return stub
+
+
+class ScriptedModel(Model):
+    """Handoff al agente pedido → llamada a su herramienta → eco del resultado."""
+
+    def __init__(self, target: str) -> None:
+        self.target = target
+        self.calls = 0
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id, prompt=None):
+        self.calls += 1
+        items = input if isinstance(input, list) else []
+        last = items[-1] if items else {}
+        names = {t.name for t in tools}
+        called = {
+            i.get("call_id"): i.get("name") for i in items
+            if isinstance(i, dict) and i.get("type") == "function_call"
+        }
+        n = self.calls
+        if handoffs:
+            h = next(h for h in handoffs if h.agent_name == self.target)
+            out = ResponseFunctionToolCall(type="function_call", call_id=f"c{n}", name=h.tool_name, arguments="{}")
+        elif isinstance(last, dict) and called.get(last.get("call_id")) in names:
+            out = ResponseOutputMessage(
+                id=f"m{n}", type="message", role="assistant", status="completed",
+                content=[ResponseOutputText(type="output_text", text=str(last["output"]), annotations=[])],
+            )
+        else:
+            out = ResponseFunctionToolCall(
+                type="function_call", call_id=f"c{n}", name=tools[0].name, arguments='{"query": "x"}'
+            )
+        return ModelResponse(output=[out], usage=Usage(), response_id=None)
+
+    def stream_response(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+def _setup(target: str, before: bool) -> Agent:
+    model = ScriptedModel(target)
+    subs = []
+    for sub in (faq_agent, operator_agent, inquirer_agent):
+        overrides = {"model": model, "tools": [_stub_tool(t) for t in sub.tools]}
+        if before:
+            overrides["tool_use_behavior"] = "run_llm_again"
+        subs.append(sub.clone(**overrides))
+    return manager_agent.clone(model=model, tools=[], handoffs=subs)
+
+
+async def _turnos(target: str, before: bool) -> float:
+    total = 0
+    for _ in range(EJECUCIONES):
+        result = await Runner.run(_setup(target, before), "Estudiante: hola\nMentor:")
+        total += len(result.raw_responses)
+    return total / EJECUCIONES
+
+
+async def main() -> None:
+    print(f"{'Sub-agente':<16}{'antes':>8}{'ahora':>8}{'ahorro (s)':>12}")
+    for target in ("FAQAgent", "OperatorAgent", "InquirerAgent"):
+        antes = await _turnos(target, before=True)
+        ahora = await _turnos(target, before=False)
+        print(f"{target:<16}{antes:>8.1f}{ahora:>8.1f}{(antes - ahora) * LATENCIA_MODELO_S:>12.1f}")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("OPENAI_AGENTS_DISABLE_TRACING", "1")
+    asyncio.run(main())
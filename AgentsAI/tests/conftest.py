@@ -0,0 +1,25 @@
+"""
+Configuración común de las pruebas (sin red): variables mínimas para que
+`app.core.config.Settings` y `app.core.security` se puedan importar.
+
+Las pruebas async usan el plugin de anyio (`@pytest.mark.anyio`) sobre asyncio.
+"""
+import os
+
+import pytest
+
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
+os.environ.setdefault("AZURE_OPENAI_API_VERSION", "2024-10-21")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+os.environ.setdefault("AZURE_OPENAI_DEPLOYMENT", "test")
+os.environ.setdefault("AZURE_OPENAI_DEPLOYMENT_CHAT", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OPENAI_VS_FAQ_ID", "vs_test")
+os.environ.setdefault("OPENAI_VS_INQUIRER_ID", "vs_test")
+os.environ.setdefault("TENANT_ID", "00000000-0000-0000-0000-000000000000")
+os.environ.setdefault("CLIENT_ID", "11111111-1111-1111-1111-111111111111")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,85 @@
+"""
+/agent/: un deadline agotado no se guarda en la sesión ni como respuesta idempotente;
+en streaming, si ya se entregó texto, queda la respuesta parcial marcada en `meta`.
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import app.agents.manager_agent as manager
+from app.agents.manager_agent import TIMEOUT_REPLY
+from app.api.v1.endpoints.agent import _agent_response, _final_payload, _start_streamed_turn
+from app.schemas.agent import AgentRequest
+from app.utils import session_store as ss
+from app.utils.idempotency import IdempotencyStore, fingerprint
+from app.utils.session_backends import InMemorySessionStore
+
+pytestmark = pytest.mark.anyio
+
+PROMPT = "¿cuál es el horario de atención?"
+
+
+@pytest.fixture
+def memory_store():
+    previous = ss._store
+    ss.set_session_store(InMemorySessionStore())
+    yield
+    ss.set_session_store(previous)
+
+
+def _request(session_id="s1"):
+    return AgentRequest(
+        prompt=PROMPT, session_id=session_id, fullName="Ana P", nickname="Ana", idCard="1",
+        career="Sis", email="a@udla.edu.ec", student_gender="F", mentor_gender="M",
+    )
+
+
+def _manager(*replies):
+    calls = []
+
+    async def run(manager_input, intent=None):
+        calls.append(manager_input)
+        return replies[len(calls) - 1]
+
+    return run, calls
+
+
+async def test_timeout_is_504_and_not_saved(memory_store):
+    run, _ = _manager(TIMEOUT_REPLY)
+    response = await _agent_response(_request(), run)
+    body = json.loads(response.body)
+    assert response.status_code == 504
+    assert body["success"] is False and body["data"]["response"] == TIMEOUT_REPLY
+    assert ss.get_history("s1") == []
+
+
+async def test_retry_with_same_key_runs_after_timeout(memory_store):
+    store = IdempotencyStore()
+    run, calls = _manager(TIMEOUT_REPLY, "<p>De 8 a 18.</p>")
+    fp = fingerprint("s1", PROMPT)
+    first = await store.run("agent", "u1|s1", "k1", fp, lambda: _agent_response(_request(), run))
+    retry = await store.run("agent", "u1|s1", "k1", fp, lambda: _agent_response(_request(), run))
+    assert (first.status_code, retry.status_code) == (504, 200)
+    assert json.loads(retry.body)["data"]["response"] == "<p>De 8 a 18.</p>"
+    assert len(calls) == 2
+    assert [m["role"] for m in ss.get_history("s1")] == ["user", "assistant"]
+
+
+async def test_stream_timeout_after_text_keeps_partial_answer(memory_store, monkeypatch):
+    async def events():
+        yield SimpleNamespace(
+            type="raw_response_event",
+            data=manager.ResponseTextDeltaEvent.model_construct(type="response.output_text.delta", delta="<p>De 8"),
+        )
+        raise TimeoutError
+
+    result = SimpleNamespace(stream_events=events, final_output=None, is_complete=True)
+    monkeypatch.setattr(manager.Runner, "run_streamed", lambda *a, **k: result)
+    deltas = []
+    gated = await _start_streamed_turn(_request(), manager.stream_manager, deltas.append)
+    payload = await _final_payload(gated, "s1")
+    assert "".join(deltas) == "<p>De 8"
+    assert payload["data"]["response"] == "<p>De 8</p>"
+    assert payload["meta"]["deadline"] == {"exceeded": True, "partial": True}
+    assert ss.get_history("s1")[-1].content == "<p>De 8</p>"
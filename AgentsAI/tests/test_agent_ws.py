@@ -0,0 +1,82 @@
+"""Canal WebSocket del agente: errores de auth, revalidación del token y push de OCR."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app.main as main
+import app.api.v1.endpoints.agent as agent
+from app.utils.dep_agents import get_manager_stream
+
+PERFIL = dict(
+    fullName="Ana P", nickname="Ana", idCard="1", career="Sis",
+    email="a@udla.edu.ec", student_gender="F", mentor_gender="M",
+)
+
+
+async def _verify(token):
+    if token != "ok":
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return {"sub": "x"}
+
+
+async def _stream(*args, **kwargs):
+    yield "<p>Hola Ana</p>"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(agent, "verify_token", _verify)
+    main.app.dependency_overrides[get_manager_stream] = lambda: _stream
+    yield TestClient(main.app)
+    main.app.dependency_overrides.pop(get_manager_stream, None)
+
+
+def _until_done(ws):
+    while True:
+        message = ws.receive_json()
+        if message["type"] in ("final", "error"):
+            return message
+
+
+def test_invalid_auth_sends_error_then_closes(client):
+    with client.websocket_connect("/api/v1/agents/agent/ws/ws-auth") as ws:
+        ws.send_json({"type": "auth", "token": "malo", "profile": PERFIL})
+        assert ws.receive_json()["code"] == 401
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+
+def test_prompt_reverifies_token(client):
+    with client.websocket_connect("/api/v1/agents/agent/ws/ws-reauth") as ws:
+        ws.send_json({"type": "auth", "token": "ok", "profile": PERFIL})
+        assert ws.receive_json()["type"] == "ready"
+        # verify_token deja de aceptar el token (p. ej. expiró): el prompt no se atiende
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(agent, "verify_token", lambda token: _verify("vencido"))
+            ws.send_json({"type": "prompt", "prompt": "hola", "id": 1})
+            error = ws.receive_json()
+        assert (error["type"], error["id"], error["code"]) == ("error", 1, 401)
+        ws.send_json({"type": "prompt", "prompt": "hola", "id": 2})
+        assert _until_done(ws)["type"] == "final"
+
+
+def test_prompt_is_not_coalesced_with_ocr_push(client, monkeypatch):
+    notify = agent._notify_ocr
+
+    async def slow_notify(session_id):
+        await asyncio.sleep(0.3)
+        return await notify(session_id)
+
+    monkeypatch.setattr(agent, "_notify_ocr", slow_notify)
+    with client.websocket_connect("/api/v1/agents/agent/ws/ws-ocr") as ws:
+        ws.send_json({"type": "auth", "token": "ok", "profile": PERFIL})
+        assert ws.receive_json()["type"] == "ready"
+        # Mientras el push revisa el OCR, el estudiante escribe justo "--ocr--"
+        ws.send_json({"type": "prompt", "prompt": "--ocr--", "id": 1})
+        final = _until_done(ws)
+    assert final["type"] == "final"
+    assert final["response"]["data"]["response"] == "<p>Hola Ana</p>"
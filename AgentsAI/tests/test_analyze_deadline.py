@@ -0,0 +1,86 @@
+"""/analyze-file/: un deadline agotado nunca se registra como veredicto del documento."""
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+from starlette.datastructures import Headers, UploadFile
+
+from app.api.v1.endpoints import analyze_images
+from app.utils.idempotency import IdempotencyStore, fingerprint
+
+pytestmark = pytest.mark.anyio
+
+REPLIES = {
+    "ocr": "Certificado Cita Médica Con Reposo. Paciente: Ana Pérez, CI 1712345678, 3 días de reposo.",
+    "classify": "CitaMedicaConReposo",
+    "summary": "El certificado tiene lo requerido.",
+    "check": "OK",
+    "name": "ANA PEREZ",
+    "dates": '{"dateInit": "2026-10-14", "dateEnd": "2026-10-16"}',
+    "id": "1712345678",
+}
+
+
+@pytest.fixture
+def fake_azure(monkeypatch):
+    persisted = []
+    timeouts = set()
+
+    async def complete(step, **kwargs):
+        if step in timeouts:
+            raise TimeoutError
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=REPLIES[step]))])
+
+    async def persist(session_id, tags, ocr):
+        persisted.append((tags, ocr))
+
+    monkeypatch.setattr(analyze_images, "_complete", complete)
+    monkeypatch.setattr(analyze_images, "_persist_ocr_state", persist)
+    return SimpleNamespace(persisted=persisted, timeouts=timeouts)
+
+
+CONTENT = b"\x89PNG fake"
+
+
+def _upload():
+    return UploadFile(io.BytesIO(CONTENT), filename="cert.png", headers=Headers({"content-type": "image/png"}))
+
+
+async def _analyze():
+    response = await analyze_images._analyze_file("s1", _upload(), CONTENT)
+    return json.loads(response.body)["data"]
+
+
+async def test_valid_certificate_is_justified(fake_azure):
+    data = await _analyze()
+    assert data["escalated"] == "justificado"
+    assert "certificado_validado" in fake_azure.persisted[0][0]
+
+
+@pytest.mark.parametrize("step", ["ocr", "classify", "check"])
+async def test_deadline_in_a_verdict_step_returns_timeout_fallback(fake_azure, step):
+    fake_azure.timeouts.add(step)
+    data = await _analyze()
+    assert data["summary"] == analyze_images.TIMEOUT_SUMMARY
+    assert data["escalated"] == "" and data["certificate"] == ""
+    assert fake_azure.persisted == []
+
+
+async def test_retry_after_deadline_runs_the_analysis_again(fake_azure):
+    store = IdempotencyStore()
+    fp = fingerprint("s1", CONTENT)
+    fake_azure.timeouts.add("ocr")
+    first = await store.run("analyze-file", "u1|s1", "k1", fp, lambda: analyze_images._analyze_file("s1", _upload(), CONTENT))
+    assert first.status_code == 504
+    fake_azure.timeouts.clear()
+    retry = await store.run("analyze-file", "u1|s1", "k1", fp, lambda: analyze_images._analyze_file("s1", _upload(), CONTENT))
+    assert retry.status_code == 200
+    assert json.loads(retry.body)["data"]["escalated"] == "justificado"
+    assert store.stats()["executed"] == 2
+
+
+async def test_deadline_in_optional_extraction_keeps_the_verdict(fake_azure):
+    fake_azure.timeouts.add("name")
+    data = await _analyze()
+    assert data["escalated"] == "justificado" and data["fullName"] == ""
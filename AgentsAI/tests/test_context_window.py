@@ -0,0 +1,65 @@
+"""ContextWindow: recorte por presupuesto y resumen en segundo plano."""
+import asyncio
+
+import pytest
+
+from app.utils.context_window import ContextWindow
+from app.utils.deadline import remaining, request_deadline
+from app.utils.session_backends import Message
+from app.utils.transcript_cache import TranscriptCache
+
+pytestmark = pytest.mark.anyio
+
+
+def _history(n: int):
+    return [Message("user" if i % 2 == 0 else "assistant", f"mensaje {i} " + "x" * 80) for i in range(n)]
+
+
+async def test_small_transcript_goes_whole():
+    window = ContextWindow(token_budget=4000)
+    history = _history(4)
+    assert window.window("s", history, TranscriptCache().tokens("s", history)) == ("", 0)
+
+
+async def test_long_transcript_keeps_recent_messages_within_budget():
+    seen = []
+
+    async def summarizer(previous, messages):
+        seen.append(len(messages))
+        return "resumen"
+
+    window = ContextWindow(token_budget=300, recent_messages=4, stale_messages=4, summarizer=summarizer)
+    history = _history(20)
+    summary, start = window.window("s", history, TranscriptCache().tokens("s", history))
+    assert summary == "" and start >= 20 - 4 - 10
+    await window._entries["s"].task
+    assert seen == [16]
+    summary, start = window.window("s", history, TranscriptCache().tokens("s", history))
+    assert summary == "resumen" and start >= 16
+
+
+async def test_summary_task_does_not_inherit_request_context():
+    seen = []
+
+    async def summarizer(previous, messages):
+        seen.append(remaining())
+        await asyncio.sleep(0)
+        return "resumen"
+
+    window = ContextWindow(token_budget=300, recent_messages=4, stale_messages=4, summarizer=summarizer)
+    history = _history(20)
+    with request_deadline(5):
+        window.window("s", history, TranscriptCache().tokens("s", history))
+    await window._entries["s"].task
+    assert seen == [None]
+
+
+def test_token_count_matches_full_render():
+    from app.utils.transcript_cache import estimate_tokens, render_line
+
+    cache = TranscriptCache()
+    history = []
+    for message in _history(10):
+        history.append(message)
+        assert cache.tokens("s", history) == estimate_tokens("".join(render_line(m) for m in history))
+    assert cache.tokens("s", history[:3]) == estimate_tokens("".join(render_line(m) for m in history[:3]))
@@ -0,0 +1,115 @@
+"""ConversationState: transiciones de fase, insistencia y migración desde el historial."""
+import pytest
+
+from app.utils import conversation_state as cs
+from app.utils.conversation_state import ConversationState, derive
+from app.utils.session_backends import Message
+
+ENFERMEDAD = {"case": "enfermedad"}
+
+
+def _exchange(state, prompt, reply, case=None, **kwargs):
+    state = state.user_turn(prompt, case)
+    insisting = state.insisting
+    return state.assistant_turn(reply, **kwargs), insisting
+
+
+# -------- Fases --------
+def test_happy_path_phases():
+    state = ConversationState().user_turn("me enfermé ayer", ENFERMEDAD)
+    assert state.phase == cs.CASO_ABIERTO and state.case == "enfermedad"
+    state = state.assistant_turn("<p>Sube tu certificado</p>", asks_document=True)
+    assert state.phase == cs.CERTIFICADO_PEDIDO and state.interaction == 1
+    state = state.document({"certificate": "CitaMedicaConReposo", "escalated": "justificado"})
+    assert state.phase == cs.CERTIFICADO_RECIBIDO and state.validated
+    state = state.on(cs.EV_OCR_NOTIFICADO)
+    assert state.phase == cs.OCR_NOTIFICADO
+    assert state.on(cs.EV_CIERRE).phase == cs.CERRADO
+
+
+def test_escalation_from_any_phase():
+    for phase in (cs.INICIO, cs.CASO_ABIERTO, cs.CERTIFICADO_PEDIDO, cs.OCR_NOTIFICADO, cs.CERRADO):
+        state = ConversationState(phase=phase).assistant_turn("<p>--mentor--</p>")
+        assert state.phase == cs.ESCALADO
+
+
+def test_unknown_transition_keeps_phase():
+    assert ConversationState().on(cs.EV_CIERRE).phase == cs.INICIO
+    assert ConversationState(phase=cs.CERTIFICADO_PEDIDO).on(cs.EV_CASO).phase == cs.CERTIFICADO_PEDIDO
+
+
+def test_same_case_with_document_does_not_reopen():
+    state = ConversationState(phase=cs.OCR_NOTIFICADO, case="enfermedad", certificate="CitaMedicaConReposo")
+    assert state.user_turn("sigo con fiebre", ENFERMEDAD).phase == cs.OCR_NOTIFICADO
+    assert state.user_turn("falleció mi abuela", {"case": "calamidad"}).phase == cs.CASO_ABIERTO
+
+
+# -------- Insistencia --------
+def test_third_identical_prompt_escalates():
+    state = ConversationState()
+    flags = []
+    for reply in ("<p>a</p>", "<p>b</p>", "<p>c</p>"):
+        state, insisting = _exchange(state, "¿Cuándo me devuelven la beca?", reply)
+        flags.append(insisting)
+    assert flags == [False, False, True]
+
+
+def test_normalized_prompts_count_as_identical():
+    state = ConversationState().user_turn("Quiero hablar con mi mentor")
+    state = state.user_turn("  quiero hablar con mi MENTOR!! ")
+    assert state.insistence == 2
+
+
+@pytest.mark.parametrize("answer", ["si", "Sí", "ok", "gracias", "muchas gracias!", "de acuerdo"])
+def test_short_confirmations_never_escalate(answer):
+    state = ConversationState()
+    for i in range(5):
+        state, insisting = _exchange(state, answer, f"<p>respuesta {i}</p>")
+        assert not insisting
+
+
+def test_confirmation_does_not_reset_insistence():
+    state = ConversationState().user_turn("necesito justificar mi falta").user_turn("ok")
+    assert state.user_turn("necesito justificar mi falta").insistence == 2
+
+
+def test_same_case_in_different_words_is_not_insistence():
+    state = ConversationState()
+    for i, prompt in enumerate(("tengo fiebre desde ayer", "me duele la cabeza", "el doctor me dio reposo")):
+        state, insisting = _exchange(state, prompt, f"<p>respuesta {i}</p>", ENFERMEDAD)
+        assert not insisting
+
+
+def test_writing_again_after_the_same_reply_twice_is_insistence():
+    state = ConversationState()
+    state, _ = _exchange(state, "me voy de viaje de trabajo", "<p>No es justificable.</p>")
+    state, _ = _exchange(state, "pero es por mi trabajo", "<p>No es justificable.</p>")
+    assert state.looping
+    state, insisting = _exchange(state, "de verdad no puedo faltar al trabajo", "<p>No es justificable.</p>")
+    assert state.insistence == 2 and not insisting
+    _, insisting = _exchange(state, "por favor ayúdame con el trabajo", "<p>x</p>")
+    assert insisting
+
+
+# -------- Serialización y migración --------
+def test_round_trip_ignores_unknown_keys():
+    state = ConversationState(phase=cs.CERRADO, interaction=4, case="enfermedad", insistence=2, looping=True)
+    assert ConversationState.from_dict({**state.to_dict(), "obsoleto": 1}) == state
+    assert ConversationState.from_dict({"phase": cs.CASO_ABIERTO}).interaction == 0
+
+
+def test_derive_from_history_and_legacy_tags():
+    history = [
+        Message("user", "necesito justificar"),
+        Message("assistant", "<p>Claro</p>"),
+        Message("user", "necesito justificar"),
+        Message("assistant", "<p>Claro</p>"),
+        Message("user", "ok"),
+    ]
+    ocr = {"certificate": "CitaMedicaSinReposo", "escalated": "justificado"}
+    state = derive(history, {"ocr_notified"}, ocr)
+    assert state.phase == cs.OCR_NOTIFICADO
+    assert state.interaction == 2 and state.insistence == 2 and state.looping
+    assert state.certificate == "CitaMedicaSinReposo" and state.validated
+    assert derive(history, {"caso_cerrado"}, ocr).phase == cs.CERRADO
+    assert derive([Message("assistant", "<p>--mentor--</p>")], set(), None).phase == cs.ESCALADO
@@ -0,0 +1,36 @@
+"""Respuestas determinísticas del endpoint del agente (sin LLM)."""
+from app.agents.inquirer_agent import classify_case
+from app.api.v1.endpoints.agent import _respuesta_directa
+from app.utils.conversation_state import CERTIFICADO_PEDIDO, ConversationState
+
+ENFERMO = "falté ayer porque tenía fiebre"
+
+
+def _turn(state: ConversationState, prompt: str):
+    case = classify_case(prompt)
+    state = state.user_turn(prompt, case)
+    return case, state, _respuesta_directa(case, state)
+
+
+def test_illness_asks_for_the_certificate_once():
+    case, state, directa = _turn(ConversationState(), ENFERMO)
+    assert case["case"] == "enfermedad"
+    reply, _ = directa
+    assert case["follow_up"][0] in reply
+
+    state = state.assistant_turn(reply, asks_document=True)
+    assert state.phase == CERTIFICADO_PEDIDO
+    _, _, directa = _turn(state, "todavía me duele la cabeza, el doctor me dio reposo")
+    assert directa is None
+
+
+def test_illness_with_document_goes_to_manager():
+    state = ConversationState().document({"certificate": "CitaMedicaConReposo", "escalated": "justificado"})
+    _, _, directa = _turn(state, ENFERMO)
+    assert directa is None
+
+
+def test_immediate_escalation_is_direct():
+    case = {"case": "escalamiento_inmediato", "note": "Te comunico con tu mentor."}
+    reply, message = _respuesta_directa(case, ConversationState().user_turn("x", case))
+    assert "--mentor--" in reply and message == "Te comunico con tu mentor."
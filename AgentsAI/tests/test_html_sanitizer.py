@@ -0,0 +1,88 @@
+"""Saneador HTML: corpus dorado (lotes y streaming) y casos XSS."""
+import re
+
+import pytest
+
+from app.utils.html_sanitizer import StreamingHtmlSanitizer, sanitize_html
+from testing.bench_html_sanitizer import CORPUS, DIFERENCIAS, TAMANOS_FRAGMENTO, _sanitize_html_anterior
+
+
+def _streaming(text: str, size: int) -> str:
+    sanitizer = StreamingHtmlSanitizer()
+    out = [sanitizer.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    out.append(sanitizer.close())
+    return "".join(out)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_golden_corpus_matches_previous_sanitizer(text):
+    expected = _sanitize_html_anterior(text)
+    assert sanitize_html(text) == expected
+    if expected.startswith("<p>"):
+        for size in TAMANOS_FRAGMENTO:
+            assert _streaming(text, size) == expected, size
+
+
+@pytest.mark.parametrize("text", DIFERENCIAS)
+def test_streaming_matches_batch(text):
+    for size in TAMANOS_FRAGMENTO:
+        assert _streaming(text, size) == sanitize_html(text), size
+
+
+_TAG = re.compile(r"<[^>]*>?")
+_SAFE_TAG = re.compile(r'</?(?:p|br)>|<a(?: (?:href|target|rel)="[^"<]*")*>|</a>')
+
+XSS = [
+    "<p><a href=# onclick=alert(1)>x</a></p>",
+    "<p><a href='#' ONCLICK = 'alert(1)'>x</a></p>",
+    '<p><a href="https://x"onclick="alert(1)">x</a></p>',
+    "<p><a/onclick=alert(1)>x</a></p>",
+    '<p><a href="javascript:alert(1)">x</a></p>',
+    "<p><a href=javascript:alert(1)>x</a></p>",
+    '<p><a href="JaVaScRiPt:alert(1)">x</a></p>',
+    '<p><a href=" javascript:alert(1)">x</a></p>',
+    '<p><a href="java\tscript:alert(1)">x</a></p>',
+    '<p><a href="jav&#x61;script:alert(1)">x</a></p>',
+    '<p><a href="javascript&colon;alert(1)">x</a></p>',
+    '<p><a href="data:text/html,<script>alert(1)</script>">x</a></p>',
+    '<p><a href="vbscript:msgbox(1)">x</a></p>',
+    '<p><a style="background:url(javascript:alert(1))">x</a></p>',
+    "<p>x<br onmouseover=alert(1)>y</p>",
+    "<p>x</a onclick=alert(1)></p>",
+    "<p>Hola</p><img src=x onerror=alert(1)>",
+    "<p>Hola</p><svg onload=alert(1)>",
+    "<p>Hola</p><script>alert(1)",
+    "<p><img src=x onerror=alert(1) <script>x</script>></p>",
+    "Hola <img src=x onerror=alert(1)//",
+    "<p>Hola <svg/onload=alert(1)//</p>",
+    "<p>x <a href='https://x' onclick=alert(1)//",
+]
+
+
+@pytest.mark.parametrize("text", XSS)
+@pytest.mark.parametrize("size", [None, 1, 5])
+def test_xss_is_neutralized(text, size):
+    out = sanitize_html(text) if size is None else _streaming(text, size)
+    # Fuera de los tags todo es texto inerte ("<" escapado): solo se revisan los tags
+    for tag in _TAG.findall(out):
+        assert _SAFE_TAG.fullmatch(tag), (tag, out)
+        lowered = tag.lower()
+        for needle in ("onclick", "onmouseover", "onerror", "onload", "javascript", "vbscript", "data:", "style"):
+            assert needle not in lowered, (needle, out)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (
+            "<p><a href='https://www.udla.edu.ec' target=_blank rel=noopener>UDLA</a></p>",
+            '<p><a href="https://www.udla.edu.ec" target="_blank" rel="noopener">UDLA</a></p>',
+        ),
+        ('<p><a href="mailto:bienestar@udla.edu.ec" class="x">correo</a></p>', '<p><a href="mailto:bienestar@udla.edu.ec">correo</a></p>'),
+        ('<p><a href="https://x.ec/?a=1&amp;b=2">x</a></p>', '<p><a href="https://x.ec/?a=1&amp;b=2">x</a></p>'),
+        ('<p><a href="https://x.ec/" title="a&quot;onclick=b">x</a></p>', '<p><a href="https://x.ec/">x</a></p>'),
+        ("<p>x<br/>y<br />z</p>", "<p>x<br/>y<br />z</p>"),
+    ],
+)
+def test_safe_links_are_kept(text, expected):
+    assert sanitize_html(text) == expected
@@ -0,0 +1,108 @@
+"""IdempotencyStore: replay de respuestas 2xx, single-flight en vuelo, conflictos y dueño de la clave."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.utils.idempotency import REPLAYED_HEADER, IdempotencyStore, fingerprint, owner_of
+
+pytestmark = pytest.mark.anyio
+
+OWNER = owner_of({"sub": "alumno-1"}, "s1")
+
+
+def _counter(status_code=200, delay=0.0):
+    calls = {"n": 0}
+
+    async def fn():
+        calls["n"] += 1
+        await asyncio.sleep(delay)
+        return JSONResponse({"n": calls["n"]}, status_code=status_code)
+
+    return fn, calls
+
+
+async def test_retry_replays_stored_response():
+    store = IdempotencyStore()
+    fn, calls = _counter()
+    fp = fingerprint("s1", "hola")
+    first = await store.run("agent", OWNER, "k1", fp, fn)
+    second = await store.run("agent", OWNER, "k1", fp, fn)
+    assert calls["n"] == 1
+    assert second.body == first.body
+    assert second.headers[REPLAYED_HEADER] == "true"
+
+
+async def test_concurrent_retry_joins_inflight_execution():
+    store = IdempotencyStore()
+    fn, calls = _counter(delay=0.02)
+    fp = fingerprint("s1", "hola")
+    first, second = await asyncio.gather(store.run("agent", OWNER, "k1", fp, fn), store.run("agent", OWNER, "k1", fp, fn))
+    assert calls["n"] == 1
+    assert first.body == second.body
+    assert store.stats()["joined"] == 1
+
+
+async def test_same_key_with_other_content_is_rejected():
+    store = IdempotencyStore()
+    fn, _ = _counter()
+    await store.run("agent", OWNER, "k1", fingerprint("s1", "hola"), fn)
+    with pytest.raises(HTTPException) as exc:
+        await store.run("agent", OWNER, "k1", fingerprint("s1", "otro prompt"), fn)
+    assert exc.value.status_code == 422
+
+
+async def test_keys_are_scoped_per_endpoint():
+    store = IdempotencyStore()
+    fn, calls = _counter()
+    await store.run("agent", OWNER, "k1", "fp", fn)
+    await store.run("analyze", OWNER, "k1", "fp", fn)
+    assert calls["n"] == 2
+
+
+async def test_same_key_from_another_user_does_not_replay():
+    store = IdempotencyStore()
+    fn, calls = _counter()
+    fp = fingerprint("s1", "hola")
+    mine = await store.run("agent", OWNER, "k1", fp, fn)
+    theirs = await store.run("agent", owner_of({"sub": "alumno-2"}, "s1"), "k1", fp, fn)
+    other_session = await store.run("agent", owner_of({"sub": "alumno-1"}, "s2"), "k1", fp, fn)
+    assert calls["n"] == 3
+    assert REPLAYED_HEADER not in theirs.headers and REPLAYED_HEADER not in other_session.headers
+    assert theirs.body != mine.body
+
+
+async def test_errors_are_not_stored():
+    store = IdempotencyStore()
+    failing, failing_calls = _counter(status_code=500)
+    await store.run("agent", OWNER, "k1", "fp", failing)
+    ok, ok_calls = _counter()
+    response = await store.run("agent", OWNER, "k1", "fp", ok)
+    assert failing_calls["n"] == 1 and ok_calls["n"] == 1
+    assert REPLAYED_HEADER not in response.headers
+
+
+async def test_exception_lets_waiter_retry():
+    store = IdempotencyStore()
+    attempts = {"n": 0}
+
+    async def flaky():
+        attempts["n"] += 1
+        await asyncio.sleep(0.01)
+        if attempts["n"] == 1:
+            raise RuntimeError("timeout del proveedor")
+        return JSONResponse({"ok": True})
+
+    results = await asyncio.gather(store.run("agent", OWNER, "k1", "fp", flaky), store.run("agent", OWNER, "k1", "fp", flaky), return_exceptions=True)
+    assert isinstance(results[0], RuntimeError)
+    assert results[1].status_code == 200
+    assert attempts["n"] == 2
+
+
+async def test_expired_entry_runs_again():
+    store = IdempotencyStore(ttl_s=0)
+    fn, calls = _counter()
+    await store.run("agent", OWNER, "k1", "fp", fn)
+    await store.run("agent", OWNER, "k1", "fp", fn)
+    assert calls["n"] == 2
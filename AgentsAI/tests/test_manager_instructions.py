@@ -0,0 +1,22 @@
+"""Instrucciones del Manager por intención: todas comparten el mismo prefijo."""
+from app.agents.manager_agent import INTENT_INSTRUCTIONS, MANAGER_VARIANTS, _BLOQUE_COMUN
+from app.utils.intent_detector import GENERAL
+from app.utils.transcript_cache import estimate_tokens
+
+
+def test_every_variant_starts_with_the_shared_block():
+    for intent, text in INTENT_INSTRUCTIONS.items():
+        assert text.startswith(_BLOQUE_COMUN), intent
+        assert MANAGER_VARIANTS[intent].instructions == text
+
+
+def test_shared_block_is_long_enough_to_be_cached():
+    # El proveedor solo cachea prefijos de al menos 1024 tokens
+    assert estimate_tokens(_BLOQUE_COMUN) >= 1024
+
+
+def test_general_carries_every_section():
+    general = INTENT_INSTRUCTIONS[GENERAL]
+    for text in INTENT_INSTRUCTIONS.values():
+        for section in text[len(_BLOQUE_COMUN):].split("\n\n"):
+            assert section in general
@@ -0,0 +1,73 @@
+"""stream_manager: resultado de herramientas sin deltas y deadline a mitad del stream."""
+from types import SimpleNamespace
+
+import pytest
+from openai.types.responses import ResponseTextDeltaEvent
+
+import app.agents.manager_agent as manager
+
+pytestmark = pytest.mark.anyio
+
+
+def _delta(text):
+    return SimpleNamespace(
+        type="raw_response_event",
+        data=ResponseTextDeltaEvent.model_construct(type="response.output_text.delta", delta=text),
+    )
+
+
+def _handoff(name):
+    return SimpleNamespace(type="agent_updated_stream_event", new_agent=SimpleNamespace(name=name))
+
+
+class _FakeStream:
+    def __init__(self, events, final_output):
+        self._events = events
+        self.final_output = final_output
+        self.is_complete = True
+
+    async def stream_events(self):
+        for event in self._events:
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+
+
+@pytest.fixture
+def streamed(monkeypatch):
+    def use(events, final_output):
+        monkeypatch.setattr(manager.Runner, "run_streamed", lambda *a, **k: _FakeStream(events, final_output))
+    monkeypatch.setattr(manager.run_stats, "record", lambda *a, **k: None)
+    return use
+
+
+async def _collect(prompt="¿cuál es el horario?"):
+    return [chunk async for chunk in manager.stream_manager(prompt)]
+
+
+async def test_tool_result_is_yielded_after_handoff(streamed):
+    # FAQAgent termina con search_faq (stop_on_first_tool): no hay deltas suyos
+    streamed([_handoff("ManagerAgent"), _handoff("FAQAgent")], "<p>El horario es 8-18</p>")
+    assert await _collect() == ["<p>El horario es 8-18</p>"]
+
+
+async def test_text_before_handoff_does_not_hide_tool_result(streamed):
+    streamed([_handoff("ManagerAgent"), _delta("Un momento. "), _handoff("OperatorAgent")], "<p>Listo</p>")
+    assert await _collect() == ["Un momento. ", "<p>Listo</p>"]
+
+
+async def test_streamed_text_is_not_repeated(streamed):
+    streamed([_handoff("ManagerAgent"), _delta("<p>Hola"), _delta("</p>")], "<p>Hola</p>")
+    assert await _collect() == ["<p>Hola", "</p>"]
+
+
+async def test_timeout_before_any_text_yields_fallback(streamed):
+    streamed([_handoff("ManagerAgent"), TimeoutError()], None)
+    assert await _collect() == [manager.TIMEOUT_REPLY]
+    assert manager.last_run_truncated.get() is False
+
+
+async def test_timeout_after_text_keeps_partial_answer(streamed):
+    streamed([_handoff("ManagerAgent"), _delta("<p>El horario"), TimeoutError()], None)
+    assert await _collect() == ["<p>El horario"]
+    assert manager.last_run_truncated.get() is True
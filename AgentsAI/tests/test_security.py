@@ -0,0 +1,114 @@
+"""Validación de tokens con un JWKS local (LocalJWKS), sin Azure AD."""
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.jwks import JWKSKeyStore, LocalJWKS
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def local_jwks():
+    original = security.key_store
+    local = LocalJWKS()
+    store = JWKSKeyStore(["https://local.test/discovery/keys"], fetcher=local.fetch, min_refetch_interval_s=30)
+    security.set_key_store(store)
+    security.token_cache.clear()
+    yield local, store
+    security.set_key_store(original)
+    security.token_cache.clear()
+
+
+def _claims(**extra):
+    return {
+        "iss": security.ISSUER_CANDIDATES[0],
+        "aud": security.AUDIENCE_CANDIDATES[0],
+        "exp": int(time.time()) + 3600,
+        "sub": "estudiante",
+        **extra,
+    }
+
+
+async def test_valid_token(local_jwks):
+    local, store = local_jwks
+    await store.prefetch()
+    payload = await security.verify_token(local.issue(_claims()))
+    assert payload["sub"] == "estudiante"
+    assert local.fetch_count == 1
+
+
+async def test_signing_key_is_fetched_once_for_many_tokens(local_jwks):
+    local, store = local_jwks
+    await store.prefetch()
+    for i in range(5):
+        await security.verify_token(local.issue(_claims(sub=f"u{i}")))
+    assert local.fetch_count == 1
+
+
+async def test_rotated_key_triggers_one_refetch(local_jwks):
+    local, store = local_jwks
+    await store.prefetch()
+    local.rotate("local-key-2")
+    payload = await security.verify_token(local.issue(_claims()))
+    assert payload["sub"] == "estudiante"
+    assert local.fetch_count == 2
+    assert "local-key-2" in store.kids()
+
+
+async def test_unknown_kid_refetch_is_rate_limited(local_jwks):
+    local, store = local_jwks
+    await store.prefetch()
+    forged = LocalJWKS(kid="desconocida")
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc:
+            await security.verify_token(forged.issue(_claims()))
+        assert exc.value.status_code == 401
+    assert local.fetch_count == 2  # prefetch + un solo refetch por kid desconocido
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {"iss": "https://evil.example/"},
+        {"aud": "api://otra-app"},
+        {"exp": int(time.time()) - 60},
+    ],
+    ids=["issuer", "audience", "expirado"],
+)
+async def test_rejected_claims(local_jwks, claims):
+    local, store = local_jwks
+    await store.prefetch()
+    with pytest.raises(HTTPException) as exc:
+        await security.verify_token(local.issue(_claims(**claims)))
+    assert exc.value.status_code == 401
+
+
+async def test_bad_signature(local_jwks):
+    local, store = local_jwks
+    await store.prefetch()
+    token = local.issue(_claims())
+    head, body, _ = token.split(".")
+    tampered = f"{head}.{body}.{LocalJWKS(kid=local.kid).issue(_claims()).split('.')[2]}"
+    with pytest.raises(HTTPException) as exc:
+        await security.verify_token(tampered)
+    assert exc.value.status_code == 401
+
+
+async def test_jwks_outage_keeps_known_keys():
+    local = LocalJWKS()
+    calls = {"n": 0}
+
+    def flaky(url):
+        calls["n"] += 1
+        if calls["n"] > 1:
+            raise RuntimeError("sin red")
+        return local.fetch(url)
+
+    store = JWKSKeyStore(["https://local.test/discovery/keys"], fetcher=flaky)
+    await store.prefetch()
+    await store.refresh()
+    assert store.kids() == [local.kid]
+    assert store.stats()["fetch_errors"] == 1
@@ -0,0 +1,171 @@
+"""Protocolo SessionStore: el mismo comportamiento en memoria, SQLite y Redis (fakeredis)."""
+import threading
+
+import fakeredis
+import pytest
+
+from app.utils import session_store as ss
+from app.utils.session_backends import (
+    ALL_PARTS,
+    DOCS,
+    MESSAGES,
+    OCR,
+    PROFILE,
+    STATE,
+    InMemorySessionStore,
+    Message,
+    RedisSessionStore,
+    SessionWrites,
+    SQLiteSessionStore,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return RedisSessionStore(fakeredis.FakeRedis(), prefix="test:session")
+
+
+@pytest.fixture
+def active_store(store):
+    """`store` como backend de la fachada (session_batch, view_session)."""
+    previous = ss._store
+    ss.set_session_store(store)
+    yield store
+    ss.set_session_store(previous)
+
+
+def _full_writes():
+    return SessionWrites(
+        messages=[Message("user", "hola"), Message("assistant", "<p>hola</p>")],
+        add_docs={"acta", "cedula"},
+        profile={"nombre": "Ana"},
+        ocr={"certificate": "CitaMedica", "summary": "ok", "escalated": "justificado"},
+        state={"phase": "certificado_recibido", "interaction": 1},
+    )
+
+
+def test_roundtrip(store):
+    store.commit("s1", _full_writes())
+    snap = store.load("s1")
+    assert [m["content"] for m in snap.messages] == ["hola", "<p>hola</p>"]
+    assert [m["role"] for m in snap.messages] == ["user", "assistant"]
+    assert snap.docs == {"acta", "cedula"}
+    assert snap.profile == {"nombre": "Ana"}
+    assert snap.ocr["certificate"] == "CitaMedica"
+    assert snap.state == {"phase": "certificado_recibido", "interaction": 1}
+
+
+def test_unknown_session_is_empty(store):
+    snap = store.load("nadie")
+    assert list(snap.messages) == [] and snap.docs == set()
+    assert snap.profile is None and snap.ocr is None and snap.state is None
+
+
+def test_partial_load(store):
+    store.commit("s1", _full_writes())
+    snap = store.load("s1", (DOCS, STATE))
+    assert list(snap.messages) == []
+    assert snap.profile is None and snap.ocr is None
+    assert snap.docs == {"acta", "cedula"} and snap.state["interaction"] == 1
+
+
+def test_messages_append_in_order(store):
+    for i in range(5):
+        store.commit("s1", SessionWrites(messages=[Message("user", f"m{i}")]))
+    assert [m["content"] for m in store.load("s1", (MESSAGES,)).messages] == [f"m{i}" for i in range(5)]
+
+
+def test_docs_add_and_discard(store):
+    store.commit("s1", SessionWrites(add_docs={"a", "b"}))
+    store.commit("s1", SessionWrites(add_docs={"c"}, discard_docs={"a"}))
+    assert store.load("s1", (DOCS,)).docs == {"b", "c"}
+
+
+def test_clear_parts_then_write(store):
+    store.commit("s1", _full_writes())
+    store.commit("s1", SessionWrites(clear={MESSAGES, OCR}, messages=[Message("system", "[reinicio]")]))
+    snap = store.load("s1")
+    assert [m["content"] for m in snap.messages] == ["[reinicio]"]
+    assert snap.ocr is None
+    assert snap.profile == {"nombre": "Ana"}
+
+
+def test_clear_everything(store):
+    store.commit("s1", _full_writes())
+    store.commit("s1", SessionWrites(clear=set(ALL_PARTS)))
+    snap = store.load("s1")
+    assert list(snap.messages) == [] and snap.docs == set() and snap.profile is None
+
+
+def test_sessions_are_isolated_and_clear_all(store):
+    store.commit("s1", _full_writes())
+    store.commit("s2", SessionWrites(profile={"nombre": "Luis"}))
+    assert store.load("s2", (PROFILE,)).profile == {"nombre": "Luis"}
+    assert store.load("s2", (MESSAGES,)).messages == []
+    store.clear_all()
+    assert store.load("s1", (PROFILE,)).profile is None
+    assert store.load("s2", (PROFILE,)).profile is None
+
+
+def test_empty_commit_is_noop(store):
+    store.commit("s1", SessionWrites())
+    assert store.load("s1").profile is None
+
+
+def test_redis_ttl_is_renewed_on_commit():
+    client = fakeredis.FakeRedis()
+    store = RedisSessionStore(client, prefix="t", ttl_s=120)
+    store.commit("s1", SessionWrites(messages=[Message("user", "x")]))
+    assert 0 < client.ttl("t:s1:messages") <= 120
+
+
+# -------- Fachada async --------
+@pytest.mark.anyio
+async def test_session_batch_reads_pending_writes_and_commits_once(active_store):
+    async with ss.session_batch("s1") as session:
+        session.append_message("user", "hola")
+        session.add_uploaded_doc("acta")
+        assert [m["content"] for m in session.history] == ["hola"]
+        assert session.uploaded_docs == {"acta"}
+        assert active_store.load("s1", (MESSAGES,)).messages == []
+    snap = await ss.view_session("s1")
+    assert [m["content"] for m in snap.messages] == ["hola"]
+    assert snap.docs == {"acta"}
+
+
+@pytest.mark.anyio
+async def test_session_batch_discards_on_error(active_store):
+    with pytest.raises(RuntimeError):
+        async with ss.session_batch("s1") as session:
+            session.append_message("user", "hola")
+            raise RuntimeError("falla el turno")
+    assert active_store.load("s1", (MESSAGES,)).messages == []
+
+
+@pytest.mark.anyio
+async def test_blocking_backends_run_off_the_event_loop(active_store, monkeypatch):
+    loop_thread = threading.get_ident()
+    threads = []
+    load, commit = active_store.load, active_store.commit
+
+    def tracking_load(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return load(*args, **kwargs)
+
+    def tracking_commit(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return commit(*args, **kwargs)
+
+    monkeypatch.setattr(active_store, "load", tracking_load)
+    monkeypatch.setattr(active_store, "commit", tracking_commit)
+    async with ss.session_batch("s1") as session:
+        session.append_message("user", "hola")
+    assert len(threads) == 2
+    if active_store.blocking:
+        assert loop_thread not in threads
+    else:
+        assert threads == [loop_thread, loop_thread]
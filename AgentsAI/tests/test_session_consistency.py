@@ -0,0 +1,86 @@
+"""Escrituras concurrentes sobre la misma sesión: un turno del agente y el resultado del OCR."""
+import asyncio
+
+import pytest
+
+from app.api.v1.endpoints.analyze_images import _persist_ocr_state
+from app.utils import session_store as ss
+from app.utils.conversation_state import CERTIFICADO_RECIBIDO, state_of
+from app.utils.session_backends import InMemorySessionStore
+from app.utils.session_gate import session_gate
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def memory_store():
+    previous = ss._store
+    ss.set_session_store(InMemorySessionStore())
+    yield
+    ss.set_session_store(previous)
+
+
+async def test_ocr_saved_during_a_turn_is_not_overwritten(memory_store):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def turn():
+        async with ss.session_batch("s1") as session:
+            state = session.state.user_turn("¿ya revisaron mi certificado?")
+            session.append_message("user", "¿ya revisaron mi certificado?")
+            started.set()
+            await release.wait()  # el Manager está respondiendo
+            session.append_message("assistant", "<p>Aún no lo recibo.</p>")
+            session.set_state(state.assistant_turn("<p>Aún no lo recibo.</p>"))
+
+    running = asyncio.create_task(session_gate.run("s1", "¿ya revisaron mi certificado?", turn))
+    await started.wait()
+    ocr = asyncio.create_task(
+        _persist_ocr_state("s1", ["doc:CitaMedicaConReposo"], {"certificate": "CitaMedicaConReposo", "escalated": "justificado"})
+    )
+    await asyncio.sleep(0.01)
+    assert not ocr.done()  # espera a que el turno guarde
+    release.set()
+    await asyncio.gather(running, ocr)
+
+    snapshot = await ss.view_session("s1")
+    state = state_of(snapshot)
+    assert state.phase == CERTIFICADO_RECIBIDO
+    assert state.certificate == "CitaMedicaConReposo" and state.validated
+    assert state.interaction == 1
+    assert snapshot.ocr["certificate"] == "CitaMedicaConReposo"
+    assert "doc:CitaMedicaConReposo" in snapshot.docs
+
+
+async def test_set_ocr_result_waits_for_the_running_turn(memory_store):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def turn():
+        async with ss.session_batch("s1") as session:
+            state = session.state.user_turn("hola")
+            session.append_message("user", "hola")
+            started.set()
+            await release.wait()
+            session.append_message("assistant", "<p>Hola.</p>")
+            session.set_state(state.assistant_turn("<p>Hola.</p>"))
+
+    running = asyncio.create_task(session_gate.run("s1", "hola", turn))
+    await started.wait()
+    ocr = asyncio.create_task(ss.set_ocr_result("s1", {"certificate": "CitaMedicaConReposo", "escalated": "justificado"}))
+    await asyncio.sleep(0.01)
+    assert not ocr.done()
+    release.set()
+    await asyncio.gather(running, ocr)
+
+    snapshot = await ss.view_session("s1")
+    assert state_of(snapshot).phase == CERTIFICADO_RECIBIDO
+    assert snapshot.ocr["certificate"] == "CitaMedicaConReposo"
+    assert len(snapshot.messages) == 2
+
+
+def test_session_messages_are_a_copy(memory_store):
+    ss.append_message("s1", "user", "hola")
+    messages = ss.get_session_messages("s1")
+    messages.append("otro")
+    assert len(ss.get_session_messages("s1")) == 1
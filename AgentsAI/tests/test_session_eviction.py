@@ -0,0 +1,77 @@
+"""Backend en memoria: expiración por inactividad, presupuesto LRU y sesiones en uso."""
+import time
+
+import pytest
+
+from app.utils import session_store as ss
+from app.utils.session_backends import MESSAGES, InMemorySessionStore, Message, SessionWrites
+
+
+def _write(store, sid, text="x" * 200):
+    store.commit(sid, SessionWrites(messages=[Message("user", text)]))
+
+
+def test_idle_sessions_expire():
+    store = InMemorySessionStore(idle_ttl_s=10)
+    _write(store, "viejo")
+    now = time.monotonic()
+    assert store.sweep_expired(now + 5) == 0
+    assert store.sweep_expired(now + 11) == 1
+    assert store.load("viejo", (MESSAGES,)).messages == []
+    assert store.stats()["bytes"] == 0
+
+
+def test_access_postpones_expiry():
+    store = InMemorySessionStore(idle_ttl_s=10)
+    _write(store, "s")
+    time.sleep(0.01)
+    store.load("s")
+    assert store.sweep_expired(time.monotonic() + 9.99) == 0
+
+
+def test_budget_evicts_least_recently_used():
+    store = InMemorySessionStore(max_bytes=2700)
+    for sid in ("a", "b", "c"):
+        _write(store, sid, "x" * 800)
+    store.load("a")
+    _write(store, "d", "x" * 800)
+    assert store.load("b", (MESSAGES,)).messages == []
+    assert store.load("a", (MESSAGES,)).messages != []
+    assert store.stats()["evictions_budget"] >= 1
+
+
+def test_single_oversized_session_is_kept():
+    store = InMemorySessionStore(max_bytes=100)
+    _write(store, "grande", "x" * 5000)
+    assert len(store.load("grande", (MESSAGES,)).messages) == 1
+
+
+def test_pinned_session_survives_sweep_and_budget():
+    store = InMemorySessionStore(idle_ttl_s=10, max_bytes=2000)
+    _write(store, "turno", "x" * 800)
+    store.pin("turno")
+    assert store.sweep_expired(time.monotonic() + 60) == 0
+    _write(store, "otra", "x" * 800)
+    _write(store, "otra2", "x" * 800)
+    assert len(store.load("turno", (MESSAGES,)).messages) == 1
+    store.unpin("turno")
+    assert store.sweep_expired(time.monotonic() + 60) >= 1
+    assert store.load("turno", (MESSAGES,)).messages == []
+
+
+@pytest.mark.anyio
+async def test_open_batch_is_not_evicted_mid_turn():
+    store = InMemorySessionStore(idle_ttl_s=10)
+    previous = ss._store
+    ss.set_session_store(store)
+    try:
+        _write(store, "s1", "primer mensaje")
+        async with ss.session_batch("s1") as session:
+            # El barrido corre mientras el turno espera al LLM
+            assert store.sweep_expired(time.monotonic() + 60) == 0
+            session.append_message("assistant", "respuesta")
+        assert store.stats()["in_use"] == 0
+        history = [m["content"] for m in store.load("s1", (MESSAGES,)).messages]
+        assert history == ["primer mensaje", "respuesta"]
+    finally:
+        ss.set_session_store(previous)
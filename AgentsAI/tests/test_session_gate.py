@@ -0,0 +1,137 @@
+"""SessionGate: un turno a la vez por sesión y coalescencia de prompts idénticos en vuelo."""
+import asyncio
+
+import pytest
+
+from app.utils.session_gate import SessionGate
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_same_session_runs_one_at_a_time():
+    gate = SessionGate()
+    running, peak, order = 0, 0, []
+
+    async def turn(tag):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        order.append(tag)
+        running -= 1
+        return tag
+
+    results = await asyncio.gather(*(gate.run("s1", f"p{i}", lambda i=i: turn(i)) for i in range(4)))
+    assert peak == 1
+    assert order == [0, 1, 2, 3]
+    assert [r.queue_depth for r in results] == [0, 1, 2, 3]
+    assert gate.stats()["active_sessions"] == 0
+
+
+async def test_different_sessions_run_in_parallel():
+    gate = SessionGate()
+    both = asyncio.Event()
+    seen = []
+
+    async def turn(sid):
+        seen.append(sid)
+        if len(seen) == 2:
+            both.set()
+        await asyncio.wait_for(both.wait(), 1)
+        return sid
+
+    await asyncio.gather(gate.run("a", "x", lambda: turn("a")), gate.run("b", "x", lambda: turn("b")))
+    assert sorted(seen) == ["a", "b"]
+
+
+async def test_identical_prompt_in_flight_is_coalesced():
+    gate = SessionGate()
+    calls = 0
+
+    async def turn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "<p>respuesta</p>"
+
+    first, second = await asyncio.gather(
+        gate.run("s1", "hola", turn),
+        gate.run("s1", "  hola ", turn),
+    )
+    assert calls == 1
+    assert first.value == second.value == "<p>respuesta</p>"
+    assert (first.coalesced, second.coalesced) == (False, True)
+
+
+async def test_prompt_after_completion_runs_again():
+    gate = SessionGate()
+    calls = 0
+
+    async def turn():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert (await gate.run("s1", "hola", turn)).value == 1
+    assert (await gate.run("s1", "hola", turn)).value == 2
+
+
+async def test_failure_is_shared_and_not_cached():
+    gate = SessionGate()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("falló el LLM")
+
+    results = await asyncio.gather(gate.run("s1", "x", boom), gate.run("s1", "x", boom), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def ok():
+        return "ok"
+
+    assert (await gate.run("s1", "x", ok)).value == "ok"
+
+
+async def test_cancelled_leader_is_replaced_by_follower():
+    gate = SessionGate()
+    calls = 0
+
+    async def turn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    leader = asyncio.create_task(gate.run("s1", "hola", turn))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(gate.run("s1", "hola", turn))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    result = await follower
+    assert result.value == 2 and result.coalesced is False
+    assert gate.stats()["inflight"] == 0
+
+
+async def test_exclusive_waits_for_the_running_turn():
+    gate = SessionGate()
+    order = []
+    release = asyncio.Event()
+
+    async def turn():
+        order.append("turn")
+        await release.wait()
+        order.append("turn done")
+
+    async def push():
+        async with gate.exclusive("s1") as depth:
+            order.append(f"push depth={depth}")
+
+    running = asyncio.create_task(gate.run("s1", "--ocr--", turn))
+    await asyncio.sleep(0)
+    pushing = asyncio.create_task(push())
+    await asyncio.sleep(0.01)
+    assert order == ["turn"]
+    release.set()
+    await asyncio.gather(running, pushing)
+    assert order == ["turn", "turn done", "push depth=1"]
+    assert gate.stats()["active_sessions"] == 0
@@ -0,0 +1,105 @@
+"""Journal del backend en memoria: reinicio en caliente, compactación y colas corruptas."""
+import time
+
+import pytest
+
+from app.utils.session_backends import (
+    ALL_PARTS,
+    MESSAGES,
+    InMemorySessionStore,
+    Message,
+    SessionWrites,
+)
+from app.utils.session_journal import SessionJournal
+
+
+def _open(path, **kwargs):
+    store = InMemorySessionStore(journal=SessionJournal(str(path), fsync_interval_s=60), **kwargs)
+    store.restore()
+    return store
+
+
+def _contents(store, sid):
+    return [m["content"] for m in store.load(sid, (MESSAGES,)).messages]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "sessions.journal"
+
+
+def _populate(store):
+    store.commit("s1", SessionWrites(messages=[Message("user", "hola"), Message("assistant", "qué tal")]))
+    store.commit("s1", SessionWrites(add_docs={"acta", "ocr_notified"}, state={"phase": "cerrado"}))
+    store.commit("s1", SessionWrites(discard_docs={"ocr_notified"}, ocr={"certificate": "X"}))
+    store.commit("s2", SessionWrites(profile={"nombre": "Luis"}))
+    store.commit("s2", SessionWrites(clear=set(ALL_PARTS)))
+
+
+def _assert_populated(store):
+    snap = store.load("s1")
+    assert _contents(store, "s1") == ["hola", "qué tal"]
+    assert snap.docs == {"acta"}
+    assert snap.state == {"phase": "cerrado"} and snap.ocr == {"certificate": "X"}
+    assert store.load("s2").profile is None
+
+
+def test_restart_replays_journal(path):
+    store = _open(path)
+    _populate(store)
+    store.close()
+    _assert_populated(_open(path))
+
+
+def test_compaction_keeps_state_and_later_writes(path):
+    store = _open(path)
+    _populate(store)
+    assert store.compact()
+    store.commit("s1", SessionWrites(messages=[Message("user", "después")]))
+    store.close()
+    restored = _open(path)
+    assert _contents(restored, "s1") == ["hola", "qué tal", "después"]
+    assert restored.load("s1").docs == {"acta"}
+
+
+def test_crash_between_snapshot_and_rotate_does_not_duplicate(path):
+    store = _open(path)
+    _populate(store)
+    journal = store._journal
+    checkpoint = journal.checkpoint()
+    journal.write_snapshot(
+        [{"s": "s1", "m": [("user", "hola"), ("assistant", "qué tal")], "d": ["acta"],
+          "o": {"certificate": "X"}, "e": {"phase": "cerrado"}}],
+        checkpoint,
+    )
+    store.commit("s1", SessionWrites(messages=[Message("user", "tras snapshot")]))
+    store.close()  # sin rotate: el proceso "murió" entre los pasos 2 y 3
+    restored = _open(path)
+    assert _contents(restored, "s1") == ["hola", "qué tal", "tras snapshot"]
+
+
+def test_torn_tail_is_discarded(path):
+    store = _open(path)
+    _populate(store)
+    store.close()
+    with open(path, "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{\"s\":\"s1\",\"m\"")
+    restored = _open(path)
+    _assert_populated(restored)
+    restored.commit("s1", SessionWrites(messages=[Message("user", "sigue")]))
+    restored.close()
+    assert _contents(_open(path), "s1")[-1] == "sigue"
+
+
+def test_evictions_and_clear_all_are_journaled(path):
+    store = _open(path, idle_ttl_s=10)
+    _populate(store)
+    store.sweep_expired(time.monotonic() + 60)
+    store.commit("s3", SessionWrites(messages=[Message("user", "nuevo")]))
+    store.close()
+    restored = _open(path)
+    assert _contents(restored, "s1") == []
+    assert _contents(restored, "s3") == ["nuevo"]
+    restored.clear_all()
+    restored.close()
+    assert _contents(_open(path), "s3") == []
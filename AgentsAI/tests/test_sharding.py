@@ -0,0 +1,167 @@
+"""ShardRoutingMiddleware: el header anti-bucle solo se respeta si viene firmado por otro nodo."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.sharding import FORWARDED_HEADER, OWNER_HEADER, ShardRouter, ShardRoutingMiddleware
+
+pytestmark = pytest.mark.anyio
+
+SELF = "http://worker-0:8000"
+OTHER = "http://worker-1:8000"
+PATH = "/api/v1/agents/agent/"
+
+
+def _router(**kwargs) -> ShardRouter:
+    return ShardRouter([SELF, OTHER], SELF, secret="s3cr3t", mode="redirect", paths=[PATH], **kwargs)
+
+
+def _remote_session(router: ShardRouter) -> str:
+    return next(f"sesion-{i}" for i in range(1000) if not router.is_local(f"sesion-{i}"))
+
+
+def _scope(headers=()):
+    return {
+        "type": "http",
+        "method": "POST",
+        "path": PATH,
+        "raw_path": PATH.encode(),
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), *headers],
+    }
+
+
+async def _call(middleware, session_id: str, headers=()):
+    body = json.dumps({"session_id": session_id}).encode()
+    scope = _scope(headers)
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return sent[0]["status"]
+
+
+def _app(seen):
+    async def app(scope, receive, send):
+        seen.append(dict(scope["headers"]))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    return app
+
+
+async def test_remote_session_is_redirected_to_owner():
+    router = _router()
+    assert await _call(ShardRoutingMiddleware(_app([]), router), _remote_session(router)) == 307
+    assert router.redirected == 1
+
+
+async def test_signed_forward_is_served_locally():
+    router = _router()
+    seen = []
+    token = router._forward_token.encode()
+    status = await _call(ShardRoutingMiddleware(_app(seen), router), _remote_session(router), [(FORWARDED_HEADER.encode(), token)])
+    assert status == 200 and router.local == 1
+
+
+@pytest.mark.parametrize("value", [b"1", b"http://worker-1:8000", b""])
+async def test_client_supplied_forward_header_is_ignored(value):
+    router = _router()
+    status = await _call(ShardRoutingMiddleware(_app([]), router), _remote_session(router), [(FORWARDED_HEADER.encode(), value)])
+    assert status == 307
+    assert router.rejected_forwards == 1
+
+
+async def test_forged_header_is_stripped_before_the_app():
+    router = _router()
+    seen = []
+    local = next(f"sesion-{i}" for i in range(1000) if router.is_local(f"sesion-{i}"))
+    await _call(ShardRoutingMiddleware(_app(seen), router), local, [(FORWARDED_HEADER.encode(), b"1")])
+    assert FORWARDED_HEADER.encode() not in seen[0]
+
+
+def test_router_requires_secret():
+    with pytest.raises(ValueError):
+        ShardRouter([SELF, OTHER], SELF, secret="")
+
+
+def _forwarding_router(stream) -> ShardRouter:
+    router = ShardRouter([SELF, OTHER], SELF, secret="s3cr3t", paths=[PATH])
+    router._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, content=stream()))
+    )
+    return router
+
+
+async def test_forwarded_stream_is_relayed_chunk_by_chunk():
+    release = asyncio.Event()
+
+    async def stream():
+        yield b"event: delta\ndata: hola\n\n"
+        await release.wait()
+        yield b"event: done\ndata: {}\n\n"
+
+    router = _forwarding_router(stream)
+    body = json.dumps({"session_id": _remote_session(router)}).encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+    first_chunk = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+        if message.get("body"):
+            first_chunk.set()
+
+    call = asyncio.create_task(ShardRoutingMiddleware(_app([]), router)(_scope(), receive, send))
+    await asyncio.wait_for(first_chunk.wait(), 1)
+    assert not call.done()  # el primer evento llegó antes de que el dueño terminara
+    release.set()
+    await asyncio.wait_for(call, 1)
+    chunks = [m["body"] for m in sent if m["type"] == "http.response.body"]
+    assert b"".join(chunks).endswith(b"event: done\ndata: {}\n\n")
+    assert sent[-1].get("more_body", False) is False
+    assert (OWNER_HEADER.encode(), OTHER.encode()) in sent[0]["headers"]
+
+
+async def test_client_disconnect_closes_the_forwarded_stream():
+    closed = asyncio.Event()
+
+    async def stream():
+        try:
+            yield b"event: delta\ndata: hola\n\n"
+            await asyncio.Event().wait()
+            yield b""
+        finally:
+            closed.set()
+
+    router = _forwarding_router(stream)
+    body = json.dumps({"session_id": _remote_session(router)}).encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    first_chunk = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message.get("body"):
+            first_chunk.set()
+
+    await asyncio.wait_for(ShardRoutingMiddleware(_app([]), router)(_scope(), receive, send), 1)
+    await asyncio.wait_for(closed.wait(), 1)
+    assert router.client_disconnects == 1
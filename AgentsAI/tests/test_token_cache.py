@@ -0,0 +1,86 @@
+"""Caché de payloads verificados (VerifiedTokenCache) y su uso en verify_token."""
+import time
+
+import pytest
+
+from app.core import security
+from app.core.jwks import JWKSKeyStore, LocalJWKS
+from app.core.token_cache import VerifiedTokenCache
+
+
+def test_hit_returns_copy():
+    cache = VerifiedTokenCache(max_entries=4)
+    cache.put("t", {"sub": "a", "exp": time.time() + 60})
+    first = cache.get("t")
+    first["sub"] = "alterado"
+    assert cache.get("t")["sub"] == "a"
+    assert cache.stats()["hits"] == 2
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    cache = VerifiedTokenCache(max_entries=4)
+    now = time.time()
+    cache.put("t", {"exp": now + 10})
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("t") is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("payload", [{"sub": "sin exp"}, {"exp": "x"}, {"exp": time.time() - 1}])
+def test_payload_without_valid_exp_is_not_cached(payload):
+    cache = VerifiedTokenCache(max_entries=4)
+    cache.put("t", payload)
+    assert cache.get("t") is None
+
+
+def test_lru_eviction():
+    cache = VerifiedTokenCache(max_entries=2)
+    exp = time.time() + 60
+    cache.put("a", {"exp": exp})
+    cache.put("b", {"exp": exp})
+    cache.get("a")
+    cache.put("c", {"exp": exp})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disabled_cache():
+    cache = VerifiedTokenCache(max_entries=0)
+    cache.put("t", {"exp": time.time() + 60})
+    assert cache.get("t") is None
+
+
+def test_token_is_not_stored_in_clear():
+    cache = VerifiedTokenCache(max_entries=4)
+    cache.put("secreto", {"exp": time.time() + 60})
+    assert all(isinstance(k, bytes) and b"secreto" not in k for k in cache._entries)
+
+
+@pytest.mark.anyio
+async def test_verify_token_skips_signature_on_hit(monkeypatch):
+    original = security.key_store
+    local = LocalJWKS()
+    security.set_key_store(JWKSKeyStore(["https://local.test/discovery/keys"], fetcher=local.fetch))
+    security.token_cache.clear()
+    calls = {"n": 0}
+    verify = security._verify_signature
+
+    def counting(*args):
+        calls["n"] += 1
+        return verify(*args)
+
+    monkeypatch.setattr(security, "_verify_signature", counting)
+    try:
+        token = local.issue({
+            "iss": security.ISSUER_CANDIDATES[0],
+            "aud": security.AUDIENCE_CANDIDATES[0],
+            "exp": int(time.time()) + 3600,
+            "sub": "x",
+        })
+        for _ in range(3):
+            assert (await security.verify_token(token))["sub"] == "x"
+        assert calls["n"] == 1
+    finally:
+        security.set_key_store(original)
+        security.token_cache.clear()